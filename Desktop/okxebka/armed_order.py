@@ -0,0 +1,105 @@
+import threading
+import time
+
+from okx_trader import open_pos_side, contracts_for_margin
+
+
+class ArmedOrder:
+    """
+    Взведенные пресеты для одной пары: плечо и режим позиций установлены заранее,
+    размер в контрактах для каждой суммы маржи пересчитывается в фоне по живой цене.
+    Нажатие пресета превращается в один подписанный запрос place_order.
+    """
+
+    def __init__(self, trader, inst_id, leverage, amounts, margin_mode="cross",
+                 refresh_interval=0.2, max_size_age=2.0):
+        self.trader = trader
+        self.inst_id = inst_id
+        self.leverage = leverage
+        self.amounts = tuple(amounts)
+        self.margin_mode = margin_mode
+        self.refresh_interval = refresh_interval  # Период пересчета размера, секунды
+        self.max_size_age = max_size_age  # Старше этого размер считается непригодным
+
+        self.sizes = {}  # сумма маржи -> размер в контрактах (строка)
+        self.price = None
+        self.pos_mode = None
+        self.updated_at = 0
+        self.error = None
+
+        self._lot_sz = None
+        self._running = False
+        self._thread = None
+
+    def arm(self):
+        """Подготовка: плечо, режим позиций, данные инструмента и фоновый пересчет размера"""
+        inst_info = self.trader.instruments.get(self.inst_id)
+        if not inst_info:
+            self.error = f"Инструмент не найден: {self.inst_id}"
+            return False
+        self._lot_sz = float(inst_info['lotSz'])
+        if not self.trader.set_leverage(self.inst_id, self.leverage, self.margin_mode):
+            self.error = f"Не удалось установить плечо {self.leverage}x"
+            return False
+        self.pos_mode = self.trader.get_position_mode()
+        if self.trader.market_feed is not None:
+            self.trader.market_feed.subscribe([self.inst_id])
+
+        self._refresh_sizes()
+        self._running = True
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+        return True
+
+    def disarm(self):
+        """Остановка фонового пересчета"""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def matches(self, inst_id, leverage):
+        """Взведен ли ордер для этой пары и плеча"""
+        return self._running and self.inst_id == inst_id and self.leverage == leverage
+
+    def is_ready(self, usd_amount):
+        """Есть свежий размер для этой суммы маржи, и плечо на бирже не меняли в обход пресетов"""
+        return (usd_amount in self.sizes and self.pos_mode is not None
+                and time.monotonic() - self.updated_at <= self.max_size_age
+                and self.trader.leverage.get((self.inst_id, self.margin_mode)) == float(self.leverage))
+
+    def fire(self, side, usd_amount):
+        """Отправка ордера одним запросом place_order"""
+        if not self.is_ready(usd_amount):
+            return {'success': False, 'error': 'Размер ордера не готов'}
+        result = self.trader.place_prepared_order(
+            self.inst_id, side, self.sizes[usd_amount],
+            open_pos_side(self.pos_mode, side), self.margin_mode
+        )
+        if not result['success'] and 'posSide' in result['error']:
+            # Режим позиций сменился - перечитаем его при следующем пересчете
+            self.pos_mode = None
+        return result
+
+    def _refresh_sizes(self):
+        # Цена из WebSocket; REST - не чаще, чем раз в половину срока годности размера
+        feed = self.trader.market_feed
+        price = feed.get_price(self.inst_id) if feed is not None else None
+        if price is None and time.monotonic() - self.updated_at >= self.max_size_age / 2:
+            price = self.trader.get_current_price(self.inst_id)
+        if not price:
+            return
+        self.sizes = {amount: str(contracts_for_margin(amount, self.leverage, price, self._lot_sz))
+                      for amount in self.amounts}
+        self.price = price
+        self.updated_at = time.monotonic()
+
+    def _refresh_loop(self):
+        while self._running:
+            try:
+                if self.pos_mode is None:
+                    self.pos_mode = self.trader.get_position_mode()
+                self._refresh_sizes()
+            except Exception as e:
+                self.error = str(e)
+            time.sleep(self.refresh_interval)
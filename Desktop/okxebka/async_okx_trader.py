@@ -0,0 +1,422 @@
+import asyncio
+import json
+
+import okx_http
+from okx_log import logger
+from okx_trader import (InstrumentRegistry, BATCH_ORDERS_LIMIT, AMBIGUOUS_CODES, DUPLICATE_CL_ORD_ID,
+                        ORDER_NOT_FOUND, ORDER_FOUND, ORDER_MISSING, ORDER_UNKNOWN, open_pos_side,
+                        close_order_args, contracts_for_margin, new_cl_ord_id)
+from position_book import PositionBook, normalize_position
+
+
+class AsyncOKXTrader:
+    """
+    Асинхронный трейдер OKX с тем же набором методов, что и OKXTrader.
+    Все запросы идут через один пул keep-alive соединений (httpx.AsyncClient),
+    подпись выполняется локально. Один клиент можно передать нескольким
+    трейдерам (несколько аккаунтов в одном процессе).
+    """
+
+    def __init__(self, config_file="config.json", client=None, max_connections=20, timeout=10.0):
+        """Инициализация трейдера с настройками из конфигурационного файла"""
+        with open(config_file, 'r') as f:
+            self.config = json.load(f)
+
+        # API ключи
+        self.api_key = self.config['okx']['api_key']
+        self.secret_key = self.config['okx']['secret_key']
+        self.passphrase = self.config['okx']['passphrase']
+
+        # Флаг торговли: 0 - реальная торговля, 1 - демо
+        self.flag = "0"
+
+        # Общий пул соединений (свой, если не передан снаружи)
+        self._own_client = client is None
+        self.client = client or okx_http.create_async_client(
+            self.config['okx'].get('base_url', okx_http.API_URL), max_connections, timeout
+        )
+
+        self.instruments = InstrumentRegistry(None, self.config.get('instruments_ttl', 3600))
+        self.account_config = None
+        self.leverage = {}
+        self.position_book = PositionBook()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def connect(self):
+        """Параллельная загрузка инструментов и конфигурации аккаунта"""
+        await asyncio.gather(self.refresh_instruments(), self.get_account_config())
+
+    async def aclose(self):
+        """Закрытие пула соединений (только собственного)"""
+        if self._own_client:
+            await self.client.aclose()
+
+    async def _request(self, method, path, params=None, private=False):
+        """REST-запрос к OKX через общий пул; private=True - с подписью"""
+        request_path, body = okx_http.build_request(method, path, params or {})
+        if private:
+            headers = okx_http.make_headers(self.flag, method, request_path, body,
+                                            self.api_key, self.secret_key, self.passphrase)
+        else:
+            headers = okx_http.make_headers(self.flag)
+        response = await self.client.request(method, request_path, content=body or None, headers=headers)
+        return response.json()
+
+    async def refresh_instruments(self):
+        """Загрузка списка SWAP-инструментов в кэш"""
+        try:
+            result = await self._request("GET", "/api/v5/public/instruments", {'instType': "SWAP"})
+            if result['code'] == '0':
+                self.instruments.load(result['data'])
+                return True
+            logger.error("Ошибка при получении инструментов: %s", result)
+            return False
+        except Exception as e:
+            logger.error("Ошибка обновления инструментов: %s", e)
+            return False
+
+    async def _ensure_instruments(self):
+        if self.instruments.is_stale():
+            await self.refresh_instruments()
+
+    async def search_futures_pair(self, symbol):
+        """Поиск фьючерсной пары по символу (например SOL -> SOL-USDT-SWAP)"""
+        try:
+            await self._ensure_instruments()
+            return [{
+                'instId': inst['instId'],
+                'baseCcy': inst['ctVal'],
+                'quoteCcy': inst['quoteCcy'],
+                'tickSz': inst['tickSz'],
+                'lotSz': inst['lotSz']
+            } for inst in self.instruments.search(symbol)]
+        except Exception as e:
+            logger.error("Ошибка поиска пары: %s", e)
+            return []
+
+    async def get_current_price(self, inst_id):
+        """Получение текущей цены инструмента"""
+        try:
+            result = await self._request("GET", "/api/v5/market/ticker", {'instId': inst_id})
+            if result['code'] == '0' and result['data']:
+                return float(result['data'][0]['last'])
+            return None
+        except Exception as e:
+            logger.error("Ошибка получения цены: %s", e)
+            return None
+
+    async def get_account_config(self, refresh=False):
+        """Получение конфигурации аккаунта (из кэша, если она уже загружена)"""
+        if self.account_config is not None and not refresh:
+            return self.account_config
+        try:
+            result = await self._request("GET", "/api/v5/account/config", private=True)
+            if result['code'] == '0':
+                self.account_config = result['data'][0]
+                return self.account_config
+            return None
+        except Exception as e:
+            logger.error("Ошибка получения конфигурации: %s", e)
+            return None
+
+    def invalidate_account_config(self):
+        """Сброс кэша конфигурации аккаунта (перечитается при следующем обращении)"""
+        self.account_config = None
+
+    async def get_position_mode(self):
+        """Режим позиций аккаунта из кэша конфигурации (net_mode / long_short_mode)"""
+        config = await self.get_account_config()
+        if config and 'posMode' in config:
+            return config['posMode']
+        return None
+
+    async def set_position_mode(self, mode="net_mode"):
+        """Установка режима позиций"""
+        try:
+            result = await self._request("POST", "/api/v5/account/set-position-mode", {'posMode': mode}, private=True)
+            if result['code'] == '0':
+                if self.account_config is not None:
+                    self.account_config = dict(self.account_config, posMode=mode)
+                return True
+            logger.error("Ошибка установки режима позиций: %s", result)
+            return False
+        except Exception as e:
+            logger.error("Ошибка установки режима позиций: %s", e)
+            return False
+
+    async def get_leverage_info(self, inst_id, margin_mode="cross", refresh=False):
+        """Текущее плечо инструмента (из кэша или с биржи)"""
+        key = (inst_id, margin_mode)
+        if key in self.leverage and not refresh:
+            return self.leverage[key]
+        try:
+            result = await self._request("GET", "/api/v5/account/leverage-info",
+                                         {'instId': inst_id, 'mgnMode': margin_mode}, private=True)
+            if result['code'] == '0':
+                for item in result['data']:
+                    self.leverage[(item['instId'], item['mgnMode'])] = float(item['lever'])
+                return self.leverage.get(key)
+            logger.error("Ошибка получения плеча: %s", result)
+            return None
+        except Exception as e:
+            logger.error("Ошибка получения плеча: %s", e)
+            return None
+
+    async def set_leverage(self, inst_id, leverage, margin_mode="cross", force=False):
+        """Установка плеча для инструмента (запрос отправляется, только если плечо меняется)"""
+        key = (inst_id, margin_mode)
+        if not force and self.leverage.get(key) == float(leverage):
+            return True
+        try:
+            result = await self._request("POST", "/api/v5/account/set-leverage", {
+                'instId': inst_id,
+                'lever': str(leverage),
+                'mgnMode': margin_mode
+            }, private=True)
+            if result['code'] == '0':
+                self.leverage[key] = float(leverage)
+                return True
+            logger.error("Ошибка установки плеча: %s", result)
+            self.leverage.pop(key, None)
+            return False
+        except Exception as e:
+            logger.error("Ошибка установки плеча: %s", e)
+            self.leverage.pop(key, None)
+            return False
+
+    async def calculate_position_size(self, inst_id, usd_amount, leverage, current_price):
+        """Расчет размера позиции в контрактах по марже в долларах (без учета плеча)"""
+        try:
+            await self._ensure_instruments()
+            inst_info = self.instruments.get(inst_id)
+            if not inst_info:
+                logger.warning("Инструмент не найден: %s", inst_id)
+                return None
+            return str(contracts_for_margin(usd_amount, leverage, current_price, float(inst_info['lotSz'])))
+        except Exception as e:
+            logger.error("Ошибка расчета размера позиции: %s", e)
+            return None
+
+    async def _place_order(self, order):
+        """
+        Отправка ордера с clOrdId (генерируется, если не задан). При таймауте, обрыве
+        соединения или ответе без результата (AMBIGUOUS_CODES) ордер ищется по clOrdId
+        и отправляется повторно с тем же clOrdId, только если биржа ответила, что его нет (51603).
+        Если проверить ордер не удалось, повтора нет - результат неизвестен.
+        """
+        from httpx import TransportError
+        order.setdefault('clOrdId', new_cl_ord_id())
+        retries = self.config.get('order_retries', 2)
+        for attempt in range(retries + 1):
+            try:
+                result = await self._request("POST", "/api/v5/trade/order", order, private=True)
+                s_code = result['data'][0].get('sCode') if result.get('data') else None
+                if result.get('code') not in AMBIGUOUS_CODES and s_code != DUPLICATE_CL_ORD_ID:
+                    return result
+                error = result['data'][0]['sMsg'] if s_code else result.get('msg')
+            except (TransportError, ValueError) as e:  # ValueError - ответ не JSON (страница ошибки шлюза)
+                error = str(e) or type(e).__name__
+            logger.warning("Результат ордера неизвестен (%s), проверка по clOrdId", error, extra={'fields': {
+                'instId': order['instId'], 'clOrdId': order['clOrdId'], 'attempt': attempt + 1
+            }})
+            status, placed = await self._find_order(order['instId'], order['clOrdId'])
+            if status == ORDER_FOUND:
+                return {'code': '0', 'msg': '', 'data': [placed]}
+            if status == ORDER_UNKNOWN:
+                break
+        return {'code': '-1', 'msg': f"Результат ордера {order['clOrdId']} неизвестен: {error}", 'data': []}
+
+    async def _find_order(self, inst_id, cl_ord_id):
+        """Поиск ордера по clOrdId: ORDER_FOUND / ORDER_MISSING (только по 51603) / ORDER_UNKNOWN (как в OKXTrader)"""
+        for attempt in range(self.config.get('order_retries', 2) + 1):
+            try:
+                result = await self._request("GET", "/api/v5/trade/order",
+                                             {'instId': inst_id, 'clOrdId': cl_ord_id}, private=True)
+                if result.get('code') == '0' and result['data']:
+                    order = result['data'][0]
+                    return ORDER_FOUND, {'ordId': order['ordId'], 'clOrdId': cl_ord_id, 'tag': order.get('tag', ''),
+                                         'sCode': '0', 'sMsg': "Order placed"}
+                if result.get('code') == ORDER_NOT_FOUND:
+                    return ORDER_MISSING, None
+                logger.warning("Ошибка проверки ордера %s: %s", cl_ord_id, result.get('msg'))
+            except Exception as e:
+                logger.warning("Ошибка проверки ордера %s: %s", cl_ord_id, e)
+        return ORDER_UNKNOWN, None
+
+    async def place_market_order(self, inst_id, side, size, leverage=None, margin_mode="cross"):
+        """Размещение рыночного ордера"""
+        try:
+            if leverage:
+                await self.set_leverage(inst_id, leverage, margin_mode)
+
+            pos_side = open_pos_side(await self.get_position_mode(), side)
+            order = {'instId': inst_id, 'tdMode': margin_mode, 'side': side,
+                     'posSide': pos_side, 'ordType': "market", 'sz': size}
+            result = await self._place_order(order)
+
+            # Ошибка posSide: режим в кэше мог устареть - перечитываем его и повторяем, только если posSide
+            # изменился (clOrdId тот же). Режим позиций аккаунта здесь не переключается
+            if result['code'] != '0' and 'posSide' in str(result):
+                config = await self.get_account_config(refresh=True)
+                fresh_mode = config.get('posMode') if config else None
+                fresh_side = open_pos_side(fresh_mode, side)
+                if fresh_mode is not None and fresh_side != pos_side:
+                    logger.warning("Режим позиций изменился (%s), повтор с posSide=%s", fresh_mode, fresh_side)
+                    result = await self._place_order(dict(order, posSide=fresh_side))
+
+            if result['code'] == '0':
+                return {
+                    'success': True,
+                    'order_id': result['data'][0]['ordId'],
+                    'data': result['data'][0]
+                }
+            error_msg = result['data'][0]['sMsg'] if result['data'] else result['msg']
+            logger.error("Ошибка размещения ордера: %s", error_msg)
+            return {'success': False, 'error': error_msg}
+        except Exception as e:
+            logger.error("Ошибка размещения ордера: %s", e)
+            return {'success': False, 'error': str(e)}
+
+    async def get_positions(self):
+        """Получение всех открытых позиций"""
+        try:
+            result = await self._request("GET", "/api/v5/account/positions", private=True)
+            if result['code'] == '0':
+                positions = []
+                for pos in result['data']:
+                    if pos.get('lever') and pos.get('mgnMode'):
+                        self.leverage[(pos['instId'], pos['mgnMode'])] = float(pos['lever'])
+                    if float(pos['pos']) != 0:  # Только открытые позиции
+                        positions.append(normalize_position(pos))
+                self.position_book.apply_snapshot(positions)
+                return positions
+            logger.error("Ошибка получения позиций: %s", result)
+            return []
+        except Exception as e:
+            logger.error("Ошибка получения позиций: %s", e)
+            return []
+
+    async def get_account_balance(self):
+        """Получение баланса аккаунта"""
+        try:
+            result = await self._request("GET", "/api/v5/account/balance", private=True)
+            if result['code'] == '0':
+                return result['data'][0]
+            return None
+        except Exception as e:
+            logger.error("Ошибка получения баланса: %s", e)
+            return None
+
+    async def close_position(self, inst_id, size):
+        """Закрытие позиции"""
+        try:
+            positions = await self.get_positions()
+            current_position = next((pos for pos in positions if pos['instId'] == inst_id), None)
+            if not current_position:
+                return {'success': False, 'error': 'Позиция не найдена'}
+
+            order = close_order_args(await self.get_position_mode(), current_position)
+            result = await self._place_order(order)
+
+            if result['code'] == '0':
+                return {'success': True, 'order_id': result['data'][0]['ordId']}
+            if 'posSide' in str(result):
+                self.invalidate_account_config()
+            error_msg = result['data'][0]['sMsg'] if result['data'] else result['msg']
+            logger.error("Ошибка закрытия позиции: %s", error_msg)
+            return {'success': False, 'error': error_msg}
+        except Exception as e:
+            logger.error("Ошибка закрытия позиции: %s", e)
+            return {'success': False, 'error': str(e)}
+
+    async def _send_batch_orders(self, orders):
+        """
+        Отправка ордеров через /trade/batch-orders пачками по 20 (пачки - параллельно).
+        Возвращает ответы по каждому ордеру в том же порядке: ordId, sCode, sMsg.
+        Если результат пачки неизвестен, ордера проверяются по clOrdId и повторно
+        отправляются только точно отсутствующие на бирже (как в _place_order).
+        """
+        from httpx import TransportError
+        retries = self.config.get('order_retries', 2)
+        for order in orders:
+            order.setdefault('clOrdId', new_cl_ord_id())
+
+        async def send(chunk):
+            replies = [None] * len(chunk)
+            pending = list(range(len(chunk)))
+            for attempt in range(retries + 1):
+                try:
+                    result = await self._request("POST", "/api/v5/trade/batch-orders",
+                                                 [chunk[i] for i in pending], private=True)
+                    if result.get('data') and len(result['data']) == len(pending):
+                        for i, reply in zip(pending, result['data']):
+                            replies[i] = reply
+                    elif result.get('code') not in AMBIGUOUS_CODES:
+                        error = {'ordId': '', 'sCode': result.get('code', '-1'), 'sMsg': result.get('msg', '')}
+                        for i in pending:
+                            replies[i] = dict(error)
+                    error = result.get('msg', '')
+                except (TransportError, ValueError) as e:
+                    error = str(e) or type(e).__name__
+                except Exception as e:
+                    for i in pending:
+                        replies[i] = {'ordId': '', 'sCode': '-1', 'sMsg': str(e)}
+                    break
+                # Повторно проверяются ордера без ответа и с дублирующимся clOrdId
+                unknown = [i for i in pending
+                           if replies[i] is None or replies[i].get('sCode') == DUPLICATE_CL_ORD_ID]
+                if not unknown:
+                    break
+                logger.warning("Результат %d ордеров пачки неизвестен (%s), проверка по clOrdId",
+                               len(unknown), error)
+                pending = []
+                for i, (status, placed) in zip(unknown, await asyncio.gather(
+                        *(self._find_order(chunk[i]['instId'], chunk[i]['clOrdId']) for i in unknown))):
+                    replies[i] = placed
+                    if status == ORDER_MISSING:
+                        pending.append(i)
+                if not pending:
+                    break
+            return [reply or {'ordId': '', 'clOrdId': order['clOrdId'], 'sCode': '-1',
+                              'sMsg': f"Результат ордера неизвестен: {error}"}
+                    for order, reply in zip(chunk, replies)]
+
+        chunks = [orders[i:i + BATCH_ORDERS_LIMIT] for i in range(0, len(orders), BATCH_ORDERS_LIMIT)]
+        replies = [reply for chunk_replies in await asyncio.gather(*(send(chunk) for chunk in chunks))
+                   for reply in chunk_replies]
+
+        if any('posSide' in reply.get('sMsg', '') for reply in replies):
+            self.invalidate_account_config()
+        return replies
+
+    async def close_all_positions(self):
+        """Закрытие всех открытых позиций: один снимок позиций и пачка ордеров через batch-orders"""
+        try:
+            positions = await self.get_positions()
+            if not positions:
+                return {'success': True, 'message': 'Нет открытых позиций'}
+
+            pos_mode = await self.get_position_mode()
+            orders = [close_order_args(pos_mode, position) for position in positions]
+            replies = await self._send_batch_orders(orders)
+
+            results = [{
+                'instId': order['instId'],
+                'success': reply.get('sCode') == '0',
+                'error': '' if reply.get('sCode') == '0' else reply.get('sMsg', '')
+            } for order, reply in zip(orders, replies)]
+
+            return {
+                'success': all(r['success'] for r in results),
+                'results': results,
+                'message': f'Закрыто позиций: {sum(1 for r in results if r["success"])}/{len(results)}'
+            }
+        except Exception as e:
+            logger.error("Ошибка закрытия всех позиций: %s", e)
+            return {'success': False, 'error': str(e)}
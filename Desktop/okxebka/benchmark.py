@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Замеры пути ордера OKXTrader на локальном симуляторе биржи.
+Для каждой операции: пропускная способность, перцентили задержки и
+количество REST-запросов на вызов (всего и по эндпоинтам). Результат - JSON,
+который можно сравнивать между версиями.
+
+Запуск: python benchmark.py --latency 0.01 --output benchmark_results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from latency import LatencyRecorder
+from okx_simulator import OKXSimulator, SimExchange
+from okx_trader import OKXTrader
+
+
+INST_ID = "SOL-USDT-SWAP"
+
+
+def open_positions(exchange, count):
+    """Открытие count позиций напрямую в симуляторе (без REST-запросов трейдера)"""
+    inst_ids = [inst_id for inst_id in exchange.instruments if inst_id.endswith('-USDT-SWAP')][:count]
+    with exchange.lock:
+        for inst_id in inst_ids:
+            exchange.place_order({'instId': inst_id, 'tdMode': 'cross', 'side': 'buy', 'posSide': 'net',
+                                  'ordType': 'market', 'sz': exchange.instruments[inst_id]['lotSz']})
+    return inst_ids
+
+
+def close_positions(exchange):
+    with exchange.lock:
+        exchange.positions.clear()
+
+
+class Benchmark:
+    """Прогон операций трейдера с подсчетом времени и REST-запросов"""
+
+    def __init__(self, trader, simulator, quiet=True):
+        self.trader = trader
+        self.simulator = simulator
+        self.quiet = quiet
+        self.results = {}
+
+    def run(self, name, operation, iterations, setup=None):
+        """Выполнение operation iterations раз; setup вызывается перед каждым вызовом и не замеряется"""
+        recorder = LatencyRecorder(max_samples=iterations)
+        endpoints_before = self._endpoint_counts()
+        requests = 0
+        errors = 0
+        total = 0.0
+
+        for _ in range(iterations):
+            if setup:
+                setup()
+            requests_before = self.simulator.requests
+            start = time.perf_counter()
+            try:
+                with self._output():
+                    result = operation()
+                if isinstance(result, dict) and not result.get('success', True):
+                    errors += 1
+            except Exception:
+                errors += 1
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            recorder.record(name, elapsed)
+            requests += self.simulator.requests - requests_before
+
+        stats = recorder.stats()[name]
+        endpoints_after = self._endpoint_counts()
+        result = {
+            'iterations': iterations,
+            'errors': errors,
+            'throughput_per_sec': iterations / total if total else None,
+            'latency_ms': {key: stats[key] for key in ('p50', 'p95', 'p99', 'max')},
+            'rest_calls_per_op': requests / iterations,
+            'rest_calls_by_endpoint': {
+                endpoint: (endpoints_after[endpoint] - endpoints_before.get(endpoint, 0)) / iterations
+                for endpoint in endpoints_after
+                if endpoints_after[endpoint] != endpoints_before.get(endpoint, 0)
+            }
+        }
+        self.results[name] = result
+        print(f"{name}: {result['throughput_per_sec']:.1f} оп/с, p50={stats['p50']:.1f}ms "
+              f"p95={stats['p95']:.1f}ms, REST-запросов на вызов: {result['rest_calls_per_op']:.2f}")
+        return result
+
+    def _endpoint_counts(self):
+        return {name[len('endpoint:'):]: s['count'] for name, s in self.trader.latency.stats().items()
+                if name.startswith('endpoint:')}
+
+    def _output(self):
+        return contextlib.redirect_stdout(io.StringIO()) if self.quiet else contextlib.nullcontext()
+
+
+def run_suite(args):
+    exchange = SimExchange(extra_instruments=max(0, args.max_positions - 8), seed=1)
+    simulator = OKXSimulator(port=0, ws_port=0, latency=args.latency, jitter=args.jitter,
+                             rate_limits=args.rate_limits, exchange=exchange).start()
+
+    config = {'okx': {'api_key': 'bench', 'secret_key': 'bench', 'passphrase': 'bench',
+                      'base_url': simulator.base_url, 'ws_public_url': simulator.ws_public_url,
+                      'ws_private_url': simulator.ws_private_url},
+              'use_websocket': args.websocket, 'client_rate_limit': args.rate_limits,
+              'logging': {'file': None, 'console': args.verbose}, 'snapshot_file': None,
+              'http': {'keepalive_interval': 0}}
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(config, f)
+        config_file = f.name
+
+    trader = None
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            trader = OKXTrader(config_file)
+        startup_ms = (time.perf_counter() - start) * 1000
+        if args.websocket:
+            trader.start_market_feed()
+            trader.start_private_feed()
+            time.sleep(1)
+
+        bench = Benchmark(trader, simulator, quiet=not args.verbose)
+        n = args.iterations
+
+        # Прогрев: кэш инструментов, плечо, конфигурация аккаунта
+        with contextlib.redirect_stdout(io.StringIO()):
+            trader.set_leverage(INST_ID, 10)
+            trader.get_current_price(INST_ID)
+
+        price = trader.get_current_price(INST_ID)
+        bench.run('calculate_position_size', lambda: trader.calculate_position_size(INST_ID, 300, 10, price), n)
+        bench.run('get_current_price', lambda: trader.get_current_price(INST_ID), n)
+
+        def order_flow():
+            current_price = trader.get_current_price(INST_ID)
+            size = trader.calculate_position_size(INST_ID, 300, 10, current_price)
+            return trader.place_market_order(INST_ID, "buy", size, 10)
+
+        bench.run('place_market_order_flow', order_flow, n, setup=lambda: close_positions(exchange))
+        bench.run('place_market_order', lambda: trader.place_market_order(INST_ID, "buy", "1", 10), n,
+                  setup=lambda: close_positions(exchange))
+
+        for count in sorted({1, 10, args.max_positions}):
+            def setup(count=count):
+                close_positions(exchange)
+                open_positions(exchange, count)
+            bench.run(f'close_all_positions_{count}', trader.close_all_positions, max(1, n // 5), setup=setup)
+
+        close_positions(exchange)
+        open_positions(exchange, 10)
+        bench.run('get_positions', trader.get_positions, n)
+        bench.run('reconcile_positions', trader.reconcile_positions, n)
+        bench.run('get_account_balance', trader.get_account_balance, n)
+        close_positions(exchange)
+
+        return {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'settings': {
+                'iterations': n, 'latency': args.latency, 'jitter': args.jitter,
+                'rate_limits': args.rate_limits, 'websocket': args.websocket
+            },
+            'startup_ms': startup_ms,
+            'operations': bench.results
+        }
+    finally:
+        if trader is not None and args.websocket:
+            trader.stop_market_feed()
+            trader.stop_private_feed()
+        if trader is not None:
+            trader.close()
+        simulator.stop()
+        os.unlink(config_file)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры пути ордера OKXTrader на локальном симуляторе")
+    parser.add_argument('--iterations', type=int, default=50, help="вызовов на операцию")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа симулятора, секунды")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--max-positions', type=int, default=50, help="позиций в самом большом close_all_positions")
+    parser.add_argument('--rate-limits', action='store_true', help="включить лимиты OKX в симуляторе и в трейдере")
+    parser.add_argument('--websocket', action='store_true', help="запустить WebSocket-фиды трейдера")
+    parser.add_argument('--verbose', action='store_true', help="не скрывать вывод трейдера")
+    parser.add_argument('--output', default="benchmark_results.json")
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"✅ Результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+
+# Идемпотентные чтения, которые можно продублировать на второй хост
+HEDGE_PATHS = ('/api/v5/market/ticker', '/api/v5/market/tickers', '/api/v5/account/positions')
+
+
+class HostSelector:
+    """
+    Равнозначные хосты REST API OKX: выбор самого быстрого по фоновым замерам RTT
+    и хеджированные чтения - если первый хост не ответил за p95 этого эндпоинта,
+    тот же запрос уходит на второй хост и используется первый пришедший ответ.
+    """
+
+    def __init__(self, hosts, hedge=False, hedge_paths=HEDGE_PATHS, hedge_quantile=95, min_samples=20,
+                 window=200, alpha=0.3):
+        self.hosts = list(hosts)
+        self.hedge = hedge and len(self.hosts) > 1
+        self.hedge_paths = set(hedge_paths)
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples  # Пока замеров меньше, запросы не хеджируются
+        self.window = window
+        self.alpha = alpha
+
+        self.rtt = {host: None for host in self.hosts}  # Сглаженный RTT, секунды (inf - хост недоступен)
+        self.best = self.hosts[0]
+        self.hedged_requests = 0
+        self.samples = {}  # путь -> последние длительности запросов
+        self.counts = {}  # путь -> общее количество замеров
+        self.delays = {}  # путь -> (задержка перед хеджем, количество замеров при расчете)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def update(self, host, rtt):
+        """Учет замера RTT хоста и выбор самого быстрого"""
+        with self._lock:
+            previous = self.rtt.get(host)
+            if previous is None or previous == float('inf'):
+                self.rtt[host] = rtt
+            else:
+                self.rtt[host] = previous + self.alpha * (rtt - previous)
+            self._choose_best()
+
+    def fail(self, host):
+        """Хост не ответил - не используется до следующего успешного замера"""
+        with self._lock:
+            self.rtt[host] = float('inf')
+            self._choose_best()
+
+    def _choose_best(self):
+        # Хосты без замеров считаются медленнее измеренных, но быстрее недоступных
+        self.best = min(self.hosts, key=lambda host: self.rtt[host] if self.rtt[host] is not None else 1e9)
+
+    def ranked(self):
+        """Хосты от самого быстрого к самому медленному"""
+        with self._lock:
+            return sorted(self.hosts, key=lambda host: self.rtt[host] if self.rtt[host] is not None else 1e9)
+
+    def should_hedge(self, method, request_path):
+        return self.hedge and method == "GET" and request_path.split('?', 1)[0] in self.hedge_paths
+
+    def record(self, path, seconds):
+        """Длительность одиночного запроса к эндпоинту (для порога хеджирования)"""
+        with self._lock:
+            samples = self.samples.get(path)
+            if samples is None:
+                samples = self.samples[path] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self.counts[path] = self.counts.get(path, 0) + 1
+
+    def hedge_delay(self, path):
+        """p95 длительности запроса к эндпоинту (пересчитывается каждые 10 замеров) или None"""
+        with self._lock:
+            samples = self.samples.get(path)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            delay, count = self.delays.get(path, (None, 0))
+            if delay is None or self.counts[path] - count >= 10:
+                values = sorted(samples)
+                delay = values[min(len(values) - 1, len(values) * self.hedge_quantile // 100)]
+                self.delays[path] = (delay, self.counts[path])
+            return delay
+
+    def hedged(self, send, request_path):
+        """send(host) на самый быстрый хост; если ответа нет дольше p95 - еще и на второй"""
+        path = request_path.split('?', 1)[0]
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+        def timed_send(host):
+            start = time.perf_counter()
+            result = send(host)
+            self.record(path, time.perf_counter() - start)
+            return result
+
+        primary, secondary = self.ranked()[:2]
+        futures = [self._executor.submit(timed_send, primary)]
+        done, _ = wait(futures, timeout=self.hedge_delay(path))
+        if not done:
+            self.hedged_requests += 1
+            futures.append(self._executor.submit(timed_send, secondary))
+
+        error = None
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        if len(futures) == 1:
+            # Первый хост ответил ошибкой раньше порога - запрос повторяется на втором
+            return timed_send(secondary)
+        raise error
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
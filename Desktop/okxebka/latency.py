@@ -0,0 +1,94 @@
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class LatencyRecorder:
+    """Гистограммы задержек по этапам и эндпоинтам (последние max_samples замеров на каждое имя)"""
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self.samples = {}  # имя -> deque длительностей в секундах
+        self.counts = {}  # имя -> общее количество замеров
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        """Добавление замера"""
+        with self._lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.max_samples)
+            samples.append(seconds)
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    @contextmanager
+    def span(self, name):
+        """Замер длительности блока кода"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def stats(self):
+        """p50/p95/p99/max в миллисекундах по каждому имени"""
+        with self._lock:
+            snapshot = {name: sorted(samples) for name, samples in self.samples.items()}
+            counts = dict(self.counts)
+
+        stats = {}
+        for name, values in snapshot.items():
+            if not values:
+                continue
+            stats[name] = {
+                'count': counts[name],
+                'p50': _percentile(values, 50) * 1000,
+                'p95': _percentile(values, 95) * 1000,
+                'p99': _percentile(values, 99) * 1000,
+                'max': values[-1] * 1000
+            }
+        return stats
+
+    def report(self):
+        """Строки отчета для вывода в лог"""
+        lines = []
+        for name, s in sorted(self.stats().items()):
+            lines.append(f"{name}: n={s['count']} p50={s['p50']:.1f}ms p95={s['p95']:.1f}ms "
+                         f"p99={s['p99']:.1f}ms max={s['max']:.1f}ms")
+        return lines
+
+    def reset(self):
+        """Очистка всех замеров"""
+        with self._lock:
+            self.samples.clear()
+            self.counts.clear()
+
+
+def timed(name):
+    """Декоратор метода: замер длительности в self.latency под именем stage:<name>"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.latency.span(f"stage:{name}"):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_client(client, recorder):
+    """Замер каждого REST-запроса клиента python-okx по эндпоинту (endpoint:METHOD path)"""
+    request = client._request
+
+    def timed_request(method, request_path, params):
+        with recorder.span(f"endpoint:{method} {request_path}"):
+            return request(method, request_path, params)
+
+    client._request = timed_request
+    return client
+
+
+def _percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
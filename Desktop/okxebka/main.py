@@ -1,52 +1,188 @@
+import time
+STARTED_AT = time.perf_counter()  # Начало запуска (до импорта GUI) - для отчета о времени старта
+
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import threading
-import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from okx_trader import OKXTrader, format_currency, format_percentage
+from position_book import position_key, diff_positions
+from armed_order import ArmedOrder
+from okx_log import (logger, add_gui_handler, remove_gui_handler, shutdown_logging,
+                     LogBuffer, PANEL_LEVELS, log_to_file)
 
 
 class OKXTradingApp:
+    # Пресеты быстрого входа: маржа в USD и плечо
+    PRESET_AMOUNTS = (300, 500, 1500)
+    PRESET_LEVERAGE = 10
+    # Колонки таблицы позиций
+    POSITION_COLUMNS = ('Пара', 'Сторона', 'Размер', 'Цена входа', 'Текущая цена', 'PnL', 'PnL%')
+    # Разбор очереди обновлений из фоновых потоков: период (мс) и максимум обработчиков за раз
+    UI_FRAME_MS = 50
+    UI_BATCH_SIZE = 100
+    # Строк в панели логов (полная история - в лог-файле) и фильтры по минимальному уровню
+    LOG_PANEL_SIZE = 500
+    LOG_FILTERS = {'Все': 0, 'INFO': PANEL_LEVELS['INFO'], 'WARNING': PANEL_LEVELS['WARNING'],
+                   'ERROR': PANEL_LEVELS['ERROR']}
+    
     def __init__(self, root):
         self.root = root
         self.root.title("OKX Фьючерс Трейдер Pro")
         self.root.geometry("1200x800")
         self.root.configure(bg='#0a0e1a')
         
-        # Инициализация трейдера
-        try:
-            self.trader = OKXTrader()
-            self.connected = True
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось подключиться к OKX API: {e}")
-            self.connected = False
-            return
+        # Трейдер создается в фоне (connect_trader), окно показывается сразу
+        self.trader = None
+        self.connected = False
+        self.log_handler = None
         
         # Переменные
         self.selected_pair = None
         self.current_positions = []
+        self.shown_positions = {}  # (instId, posSide) -> позиция, показанная в таблице
+        self.position_rows = {}  # (instId, posSide) -> (id строки Treeview, значения ячеек)
         self.pnl_update_thread = None
         self.stop_pnl_updates = False
-        self.logs = []  # Хранение логов
+        self.logs = LogBuffer(self.LOG_PANEL_SIZE)  # Последние записи панели логов
+        self.log_filter = tk.StringVar(value="Все")
+        self.armed = None  # Взведенные пресеты для выбранной пары
+        
+        # Фоновые потоки не трогают виджеты: результаты идут в очередь, которую поток Tk
+        # разбирает через after() (drain_ui_queue). Из снимков позиций отрисовывается только последний
+        self.ui_queue = queue.Queue()
+        self.pending_positions = None
+        self.pending_lock = threading.Lock()
+        self.closing = False
+        # Ордера и другие REST-запросы по кнопкам выполняются вне потока Tk
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="orders")
         
         self.setup_ui()
+        self.window_shown_at = time.perf_counter()
+        self.drain_ui_queue()
+        
+        self.log_message("🔄 Подключение к OKX...")
+        threading.Thread(target=self.connect_trader, daemon=True).start()
+        
+    def connect_trader(self):
+        """Создание трейдера и запуск WebSocket-фидов в фоновом потоке"""
+        try:
+            trader = OKXTrader()
+            trader.start_market_feed()
+            trader.start_private_feed()
+        except Exception as e:
+            self.post(self.on_connect_failed, e)
+            return
+        self.post(self.on_trader_ready, trader)
+    
+    def post(self, callback, *args):
+        """Вызов callback(*args) в потоке Tk (можно вызывать из любого потока)"""
+        self.ui_queue.put((callback, args))
+    
+    def post_positions(self, snapshot):
+        """Снимок PnL (PnLEngine.snapshot) для отрисовки; более ранний неотрисованный снимок заменяется"""
+        with self.pending_lock:
+            self.pending_positions = snapshot
+    
+    def drain_ui_queue(self):
+        """Разбор очереди обновлений пачкой (в потоке Tk), затем повтор через UI_FRAME_MS"""
+        with self.pending_lock:
+            snapshot, self.pending_positions = self.pending_positions, None
+        if snapshot is not None:
+            self.update_positions(*snapshot)
+        
+        for _ in range(self.UI_BATCH_SIZE):
+            try:
+                callback, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error("Ошибка обновления интерфейса: %s", e)
+        self.flush_logs()
+        
+        if not self.closing:
+            self.root.after(self.UI_FRAME_MS, self.drain_ui_queue)
+    
+    def run_in_background(self, work, on_done=None, on_error=None):
+        """Выполнение work() в пуле потоков; on_done(result) или on_error(e) вызываются в потоке Tk"""
+        def run():
+            try:
+                result = work()
+            except Exception as e:
+                self.post(on_error or self.show_error, e)
+                return
+            if on_done is not None:
+                self.post(on_done, result)
+        self.executor.submit(run)
+    
+    def show_error(self, error):
+        """Ошибка фоновой операции"""
+        self.log_message(f"❌ Ошибка: {error}", "ERROR")
+        messagebox.showerror("Ошибка", f"Ошибка: {error}")
+    
+    def refresh_positions(self):
+        """Сверка позиций через REST в фоне (таблица обновится по изменению книги)"""
+        self.run_in_background(self.trader.get_positions)
+        
+    def on_trader_ready(self, trader):
+        """Трейдер готов (в потоке GUI): панель логов, обновление PnL, отчет о запуске"""
+        self.trader = trader
+        self.connected = True
+        # Предупреждения и ошибки трейдера - в панель логов (через очередь обновлений)
+        self.log_handler = add_gui_handler(lambda message, level: self.post(self.log_message, message, level, False))
+        # Поиск по пустому кэшу инструментов повторяется, когда они загрузятся в фоне
+        trader.instruments.add_listener(lambda: self.post(self.on_instruments_loaded))
         self.start_pnl_updates()
         
-    def log_message(self, message, level="INFO"):
-        """Добавить сообщение в лог"""
+        trader.latency.record("startup:window", self.window_shown_at - STARTED_AT)
+        trader.latency.record("startup:connected", time.perf_counter() - STARTED_AT)
+        self.log_message(f"✅ Подключено к OKX (окно: {(self.window_shown_at - STARTED_AT) * 1000:.0f}ms, "
+                         f"трейдер: {(time.perf_counter() - STARTED_AT) * 1000:.0f}ms)", "SUCCESS")
+        for line in trader.startup_report():
+            self.log_message(line, "LATENCY")
+        
+    def on_connect_failed(self, error):
+        """Ошибка создания трейдера"""
+        self.log_message(f"❌ Не удалось подключиться к OKX API: {error}", "ERROR")
+        messagebox.showerror("Ошибка", f"Не удалось подключиться к OKX API: {error}")
+        
+    def log_message(self, message, level="INFO", persist=True):
+        """Добавить сообщение в лог: в кольцевой буфер панели (отрисовка - раз в кадр, flush_logs)
+        и в лог-файл через фоновый поток записи (persist=False - запись уже в файле)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        log_entry = f"[{timestamp}] {level}: {message}"
-        self.logs.append(log_entry)
-        
-        # Ограничиваем количество логов (последние 100)
-        if len(self.logs) > 100:
-            self.logs = self.logs[-100:]
-            
-        # Обновляем виджет логов если он существует
-        if hasattr(self, 'log_text'):
-            self.log_text.delete(1.0, tk.END)
-            self.log_text.insert(tk.END, "\n".join(self.logs))
-            self.log_text.see(tk.END)
+        self.logs.append(f"[{timestamp}] {level}: {message}", level)
+        if persist:
+            log_to_file(message, level)
+    
+    def flush_logs(self):
+        """Дописывание новых строк в панель логов и удаление самых старых сверх LOG_PANEL_SIZE"""
+        lines = self.logs.take_pending(self.LOG_FILTERS[self.log_filter.get()])
+        if not lines or not hasattr(self, 'log_text'):
+            return
+        self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+        self.trim_logs()
+        self.log_text.see(tk.END)
+    
+    def trim_logs(self):
+        """Удаление самых старых строк панели сверх LOG_PANEL_SIZE"""
+        # Считаются строки виджета, а не сообщения: сообщение с трейсбэком занимает несколько строк
+        # (последняя строка виджета после завершающего перевода строки пустая)
+        excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - self.LOG_PANEL_SIZE
+        if excess > 0:
+            self.log_text.delete('1.0', f'{excess + 1}.0')
+    
+    def redraw_logs(self):
+        """Полная перерисовка панели логов (смена фильтра уровня)"""
+        lines = self.logs.lines(self.LOG_FILTERS[self.log_filter.get()])
+        self.log_text.delete('1.0', tk.END)
+        if lines:
+            self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+            self.trim_logs()
+        self.log_text.see(tk.END)
             
     def setup_logs_panel(self, parent):
         """Настройка панели логов"""
@@ -78,14 +214,34 @@ class OKXTradingApp:
                              relief=tk.FLAT, bd=0, padx=10, pady=5)
         clear_btn.pack(pady=(5, 0))
         
+        # Кнопка вывода задержек ордеров
+        latency_btn = tk.Button(parent, text="⏱️ Задержки", command=self.show_latency,
+                               bg='#b0bec5', fg='black', font=('Arial', 9),
+                               relief=tk.FLAT, bd=0, padx=10, pady=5)
+        latency_btn.pack(pady=(5, 0))
+        
+        # Фильтр панели логов по минимальному уровню
+        filter_menu = tk.OptionMenu(parent, self.log_filter, *self.LOG_FILTERS, command=lambda _: self.redraw_logs())
+        filter_menu.config(bg='#b0bec5', fg='black', font=('Arial', 9), relief=tk.FLAT, bd=0, highlightthickness=0)
+        filter_menu.pack(pady=(5, 0))
+        
         # Добавляем приветственное сообщение
         self.log_message("Добро пожаловать в OKX Трейдер Pro!", "INFO")
         
     def clear_logs(self):
         """Очистка логов"""
-        self.logs = []
-        if hasattr(self, 'log_text'):
-            self.log_text.delete(1.0, tk.END)
+        self.logs.clear()
+        self.log_text.delete('1.0', tk.END)
+        
+    def show_latency(self):
+        """Вывод p50/p95/p99 задержек по этапам и эндпоинтам в лог"""
+        if not self.connected:
+            return
+        lines = self.trader.latency_report()
+        if not lines:
+            self.log_message("Замеров задержек пока нет")
+        for line in lines:
+            self.log_message(line, "LATENCY")
         
     def setup_ui(self):
         """Настройка пользовательского интерфейса"""
@@ -153,6 +309,8 @@ class OKXTradingApp:
                                     relief=tk.FLAT, bd=0, highlightbackground='#3a4a5e', highlightthickness=1)
         self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5), ipady=8)
         self.search_entry.bind('<Return>', lambda e: self.search_pairs())
+        # Поиск по мере ввода - по индексу инструментов в памяти, без запросов к бирже
+        self.search_entry.bind('<KeyRelease>', self.on_search_typed)
         
         search_btn = tk.Button(search_entry_frame, text="🔍", command=self.search_pairs, 
                               bg='#64b5f6', fg='black', font=('Arial', 10, 'bold'),
@@ -223,6 +381,13 @@ class OKXTradingApp:
                                   relief=tk.FLAT, bd=0, cursor='hand2', pady=6)
         short_btn_1500.pack(fill=tk.X)
         
+        # Взвод: размер пересчитывается заранее, нажатие пресета - один запрос к бирже
+        self.armed_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(presets_frame, text="🎯 Взвести пресеты", variable=self.armed_var,
+                       command=self.update_armed, bg='#1a1f2e', fg='#e0e0e0', selectcolor='#2a3441',
+                       activebackground='#1a1f2e', activeforeground='white', font=('Arial', 9, 'bold'),
+                       cursor='hand2', relief=tk.FLAT, bd=0).pack(anchor=tk.W)
+        
         # Параметры торговли
         params_frame = tk.Frame(parent, bg='#1a1f2e')
         params_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -283,11 +448,10 @@ class OKXTradingApp:
         positions_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         # Создание Treeview для позиций
-        columns = ('Пара', 'Сторона', 'Размер', 'Цена входа', 'Текущая цена', 'PnL', 'PnL%')
-        self.positions_tree = ttk.Treeview(positions_frame, columns=columns, show='headings', height=10)
+        self.positions_tree = ttk.Treeview(positions_frame, columns=self.POSITION_COLUMNS, show='headings', height=10)
         
         # Настройка заголовков
-        for col in columns:
+        for col in self.POSITION_COLUMNS:
             self.positions_tree.heading(col, text=col)
             self.positions_tree.column(col, width=100, anchor=tk.CENTER)
         
@@ -314,6 +478,9 @@ class OKXTradingApp:
 
     def search_pairs(self):
         """Поиск торговых пар"""
+        if not self.connected:
+            self.log_message("⏳ Подключение к OKX еще не завершено", "WARNING")
+            return
         search_term = self.search_entry.get().strip()
         if not search_term:
             self.log_message("⚠️ Введите символ для поиска", "WARNING")
@@ -322,16 +489,11 @@ class OKXTradingApp:
         try:
             self.log_message(f"🔍 Поиск пар по запросу: {search_term}")
             pairs = self.trader.search_futures_pair(search_term)
-            
-            # Очистка списка
-            self.pairs_listbox.delete(0, tk.END)
-            
-            # Добавление найденных пар
-            for pair in pairs:
-                self.pairs_listbox.insert(tk.END, pair['instId'])
+            self.fill_pairs_list(pairs)
                 
-            if not pairs:
-                self.pairs_listbox.insert(tk.END, "Пары не найдены")
+            if not pairs and not self.trader.instruments.by_id:
+                self.log_message("⏳ Список инструментов загружается, поиск повторится автоматически")
+            elif not pairs:
                 self.log_message(f"❌ Пары не найдены для '{search_term}'", "WARNING")
             else:
                 self.log_message(f"✅ Найдено {len(pairs)} пар", "SUCCESS")
@@ -340,8 +502,34 @@ class OKXTradingApp:
             self.log_message(f"❌ Ошибка поиска: {e}", "ERROR")
             messagebox.showerror("Ошибка", f"Ошибка поиска: {e}")
             
+    def on_search_typed(self, event):
+        """Фильтрация списка пар на каждое нажатие клавиши"""
+        if event.keysym == 'Return' or not self.connected:
+            return
+        search_term = self.search_entry.get().strip()
+        if not search_term:
+            self.pairs_listbox.delete(0, tk.END)
+            return
+        self.fill_pairs_list(self.trader.search_futures_pair(search_term))
+            
+    def on_instruments_loaded(self):
+        """Инструменты загружены (в потоке Tk): повтор поиска по введенному запросу"""
+        search_term = self.search_entry.get().strip()
+        if search_term:
+            self.fill_pairs_list(self.trader.search_futures_pair(search_term))
+            
+    def fill_pairs_list(self, pairs):
+        """Заполнение списка найденных пар"""
+        self.pairs_listbox.delete(0, tk.END)
+        for pair in pairs:
+            self.pairs_listbox.insert(tk.END, pair['instId'])
+        if not pairs:
+            self.pairs_listbox.insert(tk.END, "Пары не найдены")
+            
     def on_pair_select(self, event):
         """Обработка выбора пары"""
+        if not self.connected:
+            return
         selection = self.pairs_listbox.curselection()
         if selection:
             selected_pair = self.pairs_listbox.get(selection[0])
@@ -349,23 +537,31 @@ class OKXTradingApp:
                 self.selected_pair = selected_pair
                 self.log_message(f"📍 Выбрана пара: {selected_pair}")
                 
-                # Получение текущей цены
-                current_price = self.trader.get_current_price(selected_pair)
-                if current_price:
-                    self.pair_info_label.config(
-                        text=f"✅ {selected_pair} | Цена: ${current_price:,.4f}",
-                        fg='#4CAF50'
-                    )
-                    self.log_message(f"💰 Цена {selected_pair}: ${current_price:,.4f}")
-                else:
-                    self.pair_info_label.config(
-                        text=f"⚠️ {selected_pair} | Цена: не доступна",
-                        fg='#ffcc02'
-                    )
-                    self.log_message(f"⚠️ Не удалось получить цену для {selected_pair}", "WARNING")
+                # Получение текущей цены в фоне
+                self.run_in_background(lambda: self.trader.get_current_price(selected_pair),
+                                       lambda price: self.show_pair_price(selected_pair, price))
+                
+                self.update_armed()
+    
+    def show_pair_price(self, pair, current_price):
+        """Цена выбранной пары (результат фонового запроса)"""
+        if pair != self.selected_pair:
+            return
+        if current_price:
+            self.pair_info_label.config(
+                text=f"✅ {pair} | Цена: ${current_price:,.4f}",
+                fg='#4CAF50'
+            )
+            self.log_message(f"💰 Цена {pair}: ${current_price:,.4f}")
+        else:
+            self.pair_info_label.config(
+                text=f"⚠️ {pair} | Цена: не доступна",
+                fg='#ffcc02'
+            )
+            self.log_message(f"⚠️ Не удалось получить цену для {pair}", "WARNING")
                     
     def place_order(self, side):
-        """Размещение ордера"""
+        """Размещение ордера (запросы - в фоне, результат - в on_order_done)"""
         if not self.selected_pair:
             messagebox.showwarning("Предупреждение", "Выберите торговую пару")
             return
@@ -373,255 +569,203 @@ class OKXTradingApp:
         try:
             amount = float(self.amount_entry.get())
             leverage = int(self.leverage_var.get())
-            
-            if amount <= 0:
-                messagebox.showwarning("Предупреждение", "Введите корректную сумму")
-                return
-                
-            # Получение текущей цены
-            current_price = self.trader.get_current_price(self.selected_pair)
-            if not current_price:
-                messagebox.showerror("Ошибка", "Не удалось получить текущую цену")
-                return
-                
-            # Расчет размера позиции
-            size = self.trader.calculate_position_size(
-                self.selected_pair, amount, leverage, current_price
-            )
-            
-            if not size or size == "0":
-                messagebox.showerror("Ошибка", "Не удалось рассчитать размер позиции")
-                return
-                
-            # Размещение ордера без подтверждения
-            side_text = "LONG" if side == "buy" else "SHORT"
-            self.log_message(f"Размещение {side_text} ордера: {self.selected_pair}, маржа ${amount}, плечо {leverage}x")
-            
-            result = self.trader.place_market_order(
-                self.selected_pair, side, size, leverage
-            )
-            
-            if result['success']:
-                self.log_message(f"✅ Ордер размещен! ID: {result['order_id']}", "SUCCESS")
-                self.update_positions()
-            else:
-                self.log_message(f"❌ Ошибка размещения: {result['error']}", "ERROR")
-                messagebox.showerror("Ошибка", f"Ошибка размещения ордера: {result['error']}")
-                    
         except ValueError:
             messagebox.showwarning("Предупреждение", "Введите корректную сумму")
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка: {e}")
+            return
+            
+        if amount <= 0:
+            messagebox.showwarning("Предупреждение", "Введите корректную сумму")
+            return
+        
+        pair = self.selected_pair
+        side_text = "LONG" if side == "buy" else "SHORT"
+        self.log_message(f"Размещение {side_text} ордера: {pair}, маржа ${amount}, плечо {leverage}x")
+        
+        self.run_in_background(lambda: self.execute_market_order(pair, side, amount, leverage),
+                               lambda result: self.on_order_done(result, "Ордер"))
     
     def place_preset_order(self, side, amount, leverage):
-        """Размещение ордера по пресету"""
+        """Размещение ордера по пресету (запросы - в фоне, результат - в on_order_done)"""
         if not self.selected_pair:
             self.log_message("⚠️ Сначала выберите торговую пару!", "WARNING")
             messagebox.showwarning("Предупреждение", "Выберите торговую пару")
             return
             
+        pair = self.selected_pair
+        side_text = "LONG" if side == "buy" else "SHORT"
+        self.log_message(f"🚀 ПРЕСЕТ {side_text}: {pair}, маржа ${amount}, плечо {leverage}x")
+        
+        # Поля ввода показывают значения пресета
+        self.amount_entry.delete(0, tk.END)
+        self.amount_entry.insert(0, str(amount))
+        self.leverage_var.set(str(leverage))
+        
+        armed = self.armed
+        if armed and armed.matches(pair, leverage) and armed.is_ready(amount):
+            # Взведенный пресет: размер и posSide уже готовы
+            work = lambda: armed.fire(side, amount)
+        else:
+            work = lambda: self.execute_market_order(pair, side, amount, leverage)
+        self.run_in_background(work, lambda result: self.on_order_done(result, f"ПРЕСЕТ {side_text}"))
+    
+    def execute_market_order(self, pair, side, amount, leverage):
+        """Цена, размер и рыночный ордер (в фоновом потоке)"""
+        current_price = self.trader.get_current_price(pair)
+        if not current_price:
+            return {'success': False, 'error': "Не удалось получить текущую цену"}
+        
+        size = self.trader.calculate_position_size(pair, amount, leverage, current_price)
+        if not size or size == "0":
+            return {'success': False, 'error': "Не удалось рассчитать размер позиции"}
+        
+        return self.trader.place_market_order(pair, side, size, leverage)
+    
+    def on_order_done(self, result, title):
+        """Результат ордера (в потоке Tk)"""
+        if result['success']:
+            self.log_message(f"✅ {title} размещен! ID: {result['order_id']}", "SUCCESS")
+            self.refresh_positions()
+        else:
+            self.log_message(f"❌ Ошибка размещения: {result['error']}", "ERROR")
+            messagebox.showerror("Ошибка", f"Ошибка размещения ордера: {result['error']}")
+            
+    def update_armed(self):
+        """Взвести пресеты для выбранной пары (в фоне) или снять взвод"""
+        if self.armed:
+            self.armed.disarm()
+            self.armed = None
+        if not self.armed_var.get() or not self.selected_pair:
+            return
+        
+        armed = ArmedOrder(self.trader, self.selected_pair, self.PRESET_LEVERAGE, self.PRESET_AMOUNTS)
+        self.armed = armed
+        self.run_in_background(armed.arm, lambda ok: self.on_armed(armed, ok))
+    
+    def on_armed(self, armed, ok):
+        """Результат взвода пресетов (в потоке Tk)"""
+        if armed is not self.armed:
+            # Пара сменилась или взвод снят, пока шла подготовка
+            armed.disarm()
+            return
+        if ok:
+            self.log_message(f"🎯 Пресеты взведены: {armed.inst_id}, плечо {self.PRESET_LEVERAGE}x")
+        else:
+            self.armed = None
+            self.log_message(f"❌ Не удалось взвести пресеты: {armed.error}", "ERROR")
+            
+    def update_positions(self, snapshot, total_pnl, total_ratio):
+        """Обновление таблицы позиций по изменениям: меняются только затронутые строки и ячейки (в потоке Tk)"""
         try:
-            side_text = "LONG" if side == "buy" else "SHORT"
-            self.log_message(f"🚀 ПРЕСЕТ {side_text}: {self.selected_pair}, маржа ${amount}, плечо {leverage}x")
-            
-            # Получаем текущую цену
-            current_price = self.trader.get_current_price(self.selected_pair)
-            if not current_price:
-                self.log_message("❌ Не удалось получить цену для пресета", "ERROR")
-                messagebox.showerror("Ошибка", "Не удалось получить текущую цену")
-                return
-            
-            # Рассчитываем размер позиции
-            size = self.trader.calculate_position_size(
-                self.selected_pair, amount, leverage, current_price
-            )
-            
-            if not size or size == "0":
-                self.log_message("❌ Не удалось рассчитать размер позиции для пресета", "ERROR")
-                messagebox.showerror("Ошибка", "Не удалось рассчитать размер позиции")
-                return
-            
-            # Размещение ордера
-            result = self.trader.place_market_order(
-                self.selected_pair, side, size, leverage
-            )
-            
-            if result['success']:
-                self.log_message(f"✅ ПРЕСЕТ {side_text} размещен! ID: {result['order_id']}", "SUCCESS")
-                # Обновляем поля с использованными значениями
-                self.amount_entry.delete(0, tk.END)
-                self.amount_entry.insert(0, str(amount))
-                self.leverage_var.set(str(leverage))
-                self.update_positions()
-            else:
-                self.log_message(f"❌ Ошибка пресета: {result['error']}", "ERROR")
-                messagebox.showerror("Ошибка", f"Ошибка размещения ордера: {result['error']}")
-                
-        except Exception as e:
-            self.log_message(f"❌ Ошибка пресета: {e}", "ERROR")
-            messagebox.showerror("Ошибка", f"Ошибка: {e}")
-            
-    def update_positions(self):
-        """Обновление таблицы позиций"""
-        try:
-            positions = self.trader.get_positions()
-            
-            # Очистка таблицы
-            for item in self.positions_tree.get_children():
-                self.positions_tree.delete(item)
-                
-            total_pnl = 0
-            
-            # Добавление позиций
-            for pos in positions:
-                inst_id = pos['instId']
-                side = "LONG" if float(pos['pos']) > 0 else "SHORT"
-                size = abs(float(pos['pos']))
-                avg_price = float(pos['avgPx'])
-                mark_price = float(pos['markPx'])
-                pnl = float(pos['upl'])
-                pnl_ratio = float(pos['uplRatio'])
-                
-                total_pnl += pnl
-                
-                # Цвет для PnL
-                pnl_color = 'green' if pnl >= 0 else 'red'
-                pnl_text = f"${pnl:,.2f}"
-                pnl_ratio_text = f"{pnl_ratio*100:+.2f}%"
-                
-                # Добавление строки
-                item = self.positions_tree.insert('', 'end', values=(
-                    inst_id, side, f"{size:,.0f}", f"${avg_price:,.4f}", 
-                    f"${mark_price:,.4f}", pnl_text, pnl_ratio_text
-                ))
-                
-                # Установка цвета для PnL
-                if pnl >= 0:
-                    self.positions_tree.set(item, 'PnL', pnl_text)
-                    self.positions_tree.set(item, 'PnL%', pnl_ratio_text)
-                
-            # Обновление общего PnL
-            total_pnl_color = 'green' if total_pnl >= 0 else 'red'
-            self.total_pnl_label.config(
-                text=f"Общий PnL: ${total_pnl:,.2f}",
-                fg=total_pnl_color
-            )
-            
-            self.current_positions = positions
+            diff = diff_positions(self.shown_positions, snapshot)
+            
+            # Закрытые позиции
+            for key in diff['removed']:
+                self.positions_tree.delete(self.position_rows.pop(key)[0])
+            
+            # Новые позиции
+            for pos in diff['added']:
+                key = position_key(pos)
+                item = f"{key[0]}:{key[1]}"
+                values = self.position_values(pos)
+                self.positions_tree.insert('', 'end', iid=item, values=values)
+                self.position_rows[key] = (item, values)
+            
+            # Изменившиеся позиции - только ячейки с новым значением
+            for pos in diff['changed']:
+                key = position_key(pos)
+                item, shown = self.position_rows[key]
+                values = self.position_values(pos)
+                for column, value, old_value in zip(self.POSITION_COLUMNS, values, shown):
+                    if value != old_value:
+                        self.positions_tree.set(item, column, value)
+                self.position_rows[key] = (item, values)
+            
+            self.shown_positions = snapshot
+            
+            # Обновление общего PnL (только при изменении текста)
+            total_pnl_text = f"💰 Общий PnL: ${total_pnl:,.2f} ({total_ratio * 100:+.2f}%)"
+            if total_pnl_text != self.total_pnl_label.cget('text'):
+                self.total_pnl_label.config(
+                    text=total_pnl_text,
+                    fg='green' if total_pnl >= 0 else 'red'
+                )
+            
+            self.current_positions = list(snapshot.values())
             
         except Exception as e:
-            print(f"Ошибка обновления позиций: {e}")
+            logger.error("Ошибка обновления позиций: %s", e)
+    
+    @staticmethod
+    def position_values(pos):
+        """Значения ячеек строки позиции"""
+        size = float(pos['pos'])
+        return (
+            pos['instId'],
+            "LONG" if size > 0 else "SHORT",
+            f"{abs(size):,.0f}",
+            f"${float(pos['avgPx']):,.4f}",
+            f"${float(pos['markPx']):,.4f}",
+            f"${float(pos['upl']):,.2f}",
+            f"{float(pos['uplRatio'])*100:+.2f}%"
+        )
             
     def start_pnl_updates(self):
-        """Запуск обновления PnL в реальном времени"""
+        """Запуск обновления PnL в реальном времени (тики mark-price + периодическая сверка через REST)"""
         def update_loop():
+            engine = self.trader.pnl
+            version = -1
             while not self.stop_pnl_updates:
-                self.update_positions()
-                time.sleep(2)  # Обновление каждые 2 секунды
+                try:
+                    self.trader.reconcile_positions()
+                    engine.refresh()
+                except Exception as e:
+                    logger.error("Ошибка обновления PnL: %s", e)
+                    time.sleep(2)
+                    continue
+                if engine.version != version:
+                    version = engine.version
+                    self.post_positions(engine.snapshot())
+                engine.wait_for_change(version, timeout=1)
                 
         self.pnl_update_thread = threading.Thread(target=update_loop, daemon=True)
         self.pnl_update_thread.start()
         
-    def show_context_menu(self, event):
-        """Показ контекстного меню"""
-        try:
-            self.context_menu.tk_popup(event.x_root, event.y_root)
-        finally:
-            self.context_menu.grab_release()
-            
-    def close_selected_position(self):
-        """Закрытие выбранной позиции"""
-        selection = self.positions_tree.selection()
-        if not selection:
-            return
-            
-        item = selection[0]
-        values = self.positions_tree.item(item, 'values')
-        inst_id = values[0]
-        
-        confirm = messagebox.askyesno("Подтверждение", f"Закрыть позицию {inst_id}?")
-        if confirm:
-            try:
-                result = self.trader.close_position(inst_id, None)
-                if result['success']:
-                    messagebox.showinfo("Успех", "Позиция закрыта")
-                    self.update_positions()
-                else:
-                    messagebox.showerror("Ошибка", f"Ошибка закрытия: {result['error']}")
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка: {e}")
-                
-    def close_all_positions(self):
-        """Закрытие всех позиций"""
-        if not self.current_positions:
-            messagebox.showinfo("Информация", "Нет открытых позиций")
-            return
-            
-        confirm = messagebox.askyesno("Подтверждение", 
-                                    f"Закрыть все позиции ({len(self.current_positions)} шт.)?")
-        if confirm:
-            try:
-                result = self.trader.close_all_positions()
-                
-                if result['success']:
-                    messagebox.showinfo("Успех", result['message'])
-                else:
-                    # Показываем детали по каждой позиции
-                    error_details = []
-                    for r in result.get('results', []):
-                        if not r['success']:
-                            error_details.append(f"{r['instId']}: {r['error']}")
-                    
-                    if error_details:
-                        messagebox.showwarning("Ошибки закрытия", 
-                                             f"{result['message']}\n\nОшибки:\n" + "\n".join(error_details))
-                    else:
-                        messagebox.showerror("Ошибка", result.get('error', 'Неизвестная ошибка'))
-                    
-                self.update_positions()
-                
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка: {e}")
-                
     def close_all_positions(self):
-        """Закрытие всех позиций"""
+        """Закрытие всех позиций (запросы - в фоне)"""
         if not self.current_positions:
             self.log_message("ℹ️ Нет открытых позиций для закрытия", "INFO")
             messagebox.showinfo("Информация", "Нет открытых позиций")
             return
             
         self.log_message(f"🚫 Закрытие всех позиций ({len(self.current_positions)} шт.)")
-        
-        try:
-            result = self.trader.close_all_positions()
-            
-            if result['success']:
-                self.log_message(f"✅ {result['message']}", "SUCCESS")
-                messagebox.showinfo("Успех", result['message'])
+        self.run_in_background(self.trader.close_all_positions, self.on_close_all_done,
+                               lambda e: self.show_error(f"Ошибка закрытия позиций: {e}"))
+    
+    def on_close_all_done(self, result):
+        """Результат закрытия всех позиций (в потоке Tk)"""
+        if result['success']:
+            self.log_message(f"✅ {result['message']}", "SUCCESS")
+            messagebox.showinfo("Успех", result['message'])
+        else:
+            # Показываем детали по каждой позиции
+            error_details = []
+            for r in result.get('results', []):
+                if not r['success']:
+                    error_details.append(f"{r['instId']}: {r['error']}")
+                    self.log_message(f"❌ {r['instId']}: {r['error']}", "ERROR")
+            
+            if error_details:
+                self.log_message(f"⚠️ Частичное закрытие: {result['message']}", "WARNING")
+                messagebox.showwarning("Ошибки закрытия", 
+                                     f"{result['message']}\n\nОшибки:\n" + "\n".join(error_details))
             else:
-                # Показываем детали по каждой позиции
-                error_details = []
-                for r in result.get('results', []):
-                    if not r['success']:
-                        error_details.append(f"{r['instId']}: {r['error']}")
-                        self.log_message(f"❌ {r['instId']}: {r['error']}", "ERROR")
-                
-                if error_details:
-                    self.log_message(f"⚠️ Частичное закрытие: {result['message']}", "WARNING")
-                    messagebox.showwarning("Ошибки закрытия", 
-                                         f"{result['message']}\n\nОшибки:\n" + "\n".join(error_details))
-                else:
-                    self.log_message(f"❌ {result.get('error', 'Неизвестная ошибка')}", "ERROR")
-                    messagebox.showerror("Ошибка", result.get('error', 'Неизвестная ошибка'))
-                
-            self.update_positions()
+                self.log_message(f"❌ {result.get('error', 'Неизвестная ошибка')}", "ERROR")
+                messagebox.showerror("Ошибка", result.get('error', 'Неизвестная ошибка'))
             
-        except Exception as e:
-            self.log_message(f"❌ Ошибка закрытия позиций: {e}", "ERROR")
-            messagebox.showerror("Ошибка", f"Ошибка: {e}")
+        self.refresh_positions()
     
     def close_selected_position(self):
-        """Закрытие выбранной позиции из контекстного меню"""
+        """Закрытие выбранной позиции из контекстного меню (запрос - в фоне)"""
         selected_item = self.positions_tree.selection()
         if not selected_item:
             return
@@ -633,22 +777,20 @@ class OKXTradingApp:
             
         inst_id = item_values[0]  # Первая колонка - пара
         self.log_message(f"🚫 Закрытие позиции: {inst_id}")
-        
-        try:
-            result = self.trader.close_position(inst_id, None)
-            
-            if result['success']:
-                self.log_message(f"✅ Позиция {inst_id} закрыта! ID: {result['order_id']}", "SUCCESS")
-                messagebox.showinfo("Успех", f"Позиция {inst_id} закрыта!")
-            else:
-                self.log_message(f"❌ Ошибка закрытия {inst_id}: {result['error']}", "ERROR")
-                messagebox.showerror("Ошибка", f"Ошибка закрытия позиции: {result['error']}")
-                
-            self.update_positions()
-            
-        except Exception as e:
-            self.log_message(f"❌ Ошибка закрытия {inst_id}: {e}", "ERROR")
-            messagebox.showerror("Ошибка", f"Ошибка: {e}")
+        self.run_in_background(lambda: self.trader.close_position(inst_id, None),
+                               lambda result: self.on_close_done(inst_id, result),
+                               lambda e: self.show_error(f"Ошибка закрытия {inst_id}: {e}"))
+    
+    def on_close_done(self, inst_id, result):
+        """Результат закрытия позиции (в потоке Tk)"""
+        if result['success']:
+            self.log_message(f"✅ Позиция {inst_id} закрыта! ID: {result['order_id']}", "SUCCESS")
+            messagebox.showinfo("Успех", f"Позиция {inst_id} закрыта!")
+        else:
+            self.log_message(f"❌ Ошибка закрытия {inst_id}: {result['error']}", "ERROR")
+            messagebox.showerror("Ошибка", f"Ошибка закрытия позиции: {result['error']}")
+            
+        self.refresh_positions()
     
     def show_context_menu(self, event):
         """Показать контекстное меню для позиций"""
@@ -661,9 +803,21 @@ class OKXTradingApp:
     def on_closing(self):
         """Обработка закрытия приложения"""
         self.log_message("👋 Закрытие приложения")
+        self.closing = True
         self.stop_pnl_updates = True
+        self.executor.shutdown(wait=False)
+        if self.armed:
+            self.armed.disarm()
         if self.pnl_update_thread:
             self.pnl_update_thread.join(timeout=1)
+        if self.connected:
+            self.trader.stop_market_feed()
+            self.trader.stop_private_feed()
+            self.trader.save_snapshot()
+            self.trader.close()
+        if self.log_handler:
+            remove_gui_handler(self.log_handler)
+        shutdown_logging()
         self.root.destroy()
 
 
@@ -1,67 +1,110 @@
+import time
+STARTED_AT = time.perf_counter()  # Начало запуска (до импорта Qt) - для отчета о времени старта
+
 import sys
 import threading
-import time
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QGridLayout, QPushButton, QLineEdit, 
                              QListWidget, QTableWidget, QTableWidgetItem, 
                              QTextEdit, QLabel, QButtonGroup, QFrame, QSplitter,
-                             QHeaderView, QAbstractItemView)
+                             QHeaderView, QAbstractItemView, QCheckBox, QComboBox)
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject, QThread
-from PyQt5.QtGui import QFont, QPalette, QColor
+from PyQt5.QtGui import QFont, QPalette, QColor, QTextCursor
 from okx_trader import OKXTrader, format_currency, format_percentage
+from armed_order import ArmedOrder
+from position_book import position_key, diff_positions
+from okx_log import add_gui_handler, remove_gui_handler, shutdown_logging, LogBuffer, PANEL_LEVELS, log_to_file
 
 
 class PnLUpdateWorker(QObject):
     """Воркер для обновления PnL в отдельном потоке"""
-    update_signal = pyqtSignal(list, float, float)
+    # Изменения позиций (diff_positions), общий PnL и его доля от маржи
+    update_signal = pyqtSignal(dict, float, float)
     log_signal = pyqtSignal(str, str)
     
+    FRAME_INTERVAL = 0.05  # Не чаще одного обновления таблицы за кадр: тики между кадрами объединяются
+    
     def __init__(self, trader):
         super().__init__()
         self.trader = trader
         self.running = True
         
     def run(self):
+        engine = self.trader.pnl
+        version = -1
+        shown = {}  # Снимок позиций, уже отправленный в таблицу
         while self.running:
             try:
-                positions = self.trader.get_positions()
-                total_pnl = sum(float(pos.get('upl', 0)) for pos in positions)
-                total_pnl_percentage = 0
-                
-                if positions:
-                    total_margin = sum(float(pos.get('margin', 0)) for pos in positions)
-                    if total_margin > 0:
-                        total_pnl_percentage = (total_pnl / total_margin) * 100
-                
-                self.update_signal.emit(positions, total_pnl, total_pnl_percentage)
+                # PnL пересчитывается по тикам mark-price, REST - только для сверки
+                self.trader.reconcile_positions()
+                engine.refresh()
+                if engine.version == version:
+                    engine.wait_for_change(version, timeout=1)
+                    continue
+                version = engine.version
+                positions, total_pnl, total_ratio = engine.snapshot()
+                diff = diff_positions(shown, positions)
+                shown = positions
+                self.update_signal.emit(diff, total_pnl, total_ratio)
+                time.sleep(self.FRAME_INTERVAL)
             except Exception as e:
                 self.log_signal.emit(f"Ошибка обновления PnL: {e}", "ERROR")
-                
-            time.sleep(2)
+                time.sleep(2)
     
     def stop(self):
         self.running = False
 
 
+def position_cells(pos):
+    """Ячейки строки позиции: (текст, цвет или None)"""
+    size = float(pos.get('pos', 0))
+    upl = float(pos.get('upl', 0))
+    upl_ratio = float(pos.get('uplRatio', 0))
+    return (
+        (pos.get('instId', ''), None),
+        ("LONG" if size > 0 else "SHORT", None),
+        (f"{abs(size):.4f}", None),
+        (f"${float(pos.get('avgPx', 0)):.4f}", None),
+        (f"${float(pos.get('markPx', 0)):.4f}", None),
+        (format_currency(upl), "#4caf50" if upl >= 0 else "#f44336"),
+        (format_percentage(upl_ratio)[0], "#4caf50" if upl_ratio >= 0 else "#f44336")
+    )
+
+
 class TradingApp(QMainWindow):
+    # Записи лога трейдера из фонового потока: (сообщение, уровень)
+    trader_log_signal = pyqtSignal(str, str)
+    # Результат фонового подключения: трейдер или текст ошибки
+    trader_ready_signal = pyqtSignal(object)
+    trader_failed_signal = pyqtSignal(str)
+    instruments_loaded_signal = pyqtSignal()
+    pair_price_signal = pyqtSignal(str, object)  # instId, цена или None
+    armed_signal = pyqtSignal(object, bool)  # ArmedOrder, результат arm()
+    # Строк в панели логов (полная история - в лог-файле), период дописывания (мс) и фильтры уровня
+    LOG_PANEL_SIZE = 500
+    LOG_FRAME_MS = 50
+    LOG_FILTERS = {'Все': 0, 'INFO': PANEL_LEVELS['INFO'], 'WARNING': PANEL_LEVELS['WARNING'],
+                   'ERROR': PANEL_LEVELS['ERROR']}
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Трейдер")
         self.setGeometry(100, 100, 1400, 900)
         
-        # Инициализация трейдера
-        try:
-            self.trader = OKXTrader()
-            self.connected = True
-        except Exception as e:
-            self.log_message(f"Ошибка подключения: {e}", "ERROR")
-            self.connected = False
+        # Трейдер создается в фоне (connect_trader), окно показывается сразу
+        self.trader = None
+        self.connected = False
+        self.window_shown_at = None
         
         # Переменные
         self.selected_pair = None
         self.pairs_data = []
-        self.logs = []
+        self.logs = LogBuffer(self.LOG_PANEL_SIZE)  # Последние записи панели логов
+        self.armed = None  # Взведенные пресеты для выбранной пары
+        self.log_handler = None
+        self.position_keys = []  # (instId, posSide) по строкам таблицы позиций
+        self.position_cells = {}  # (instId, posSide) -> показанные ячейки строки
         
         # Настройка темной темы
         self.setup_theme()
@@ -69,11 +112,62 @@ class TradingApp(QMainWindow):
         # Настройка UI
         self.setup_ui()
         
-        # Запуск обновления PnL
-        if self.connected:
-            self.setup_pnl_worker()
+        self.trader_log_signal.connect(self.log_trader_message)
+        self.trader_ready_signal.connect(self.on_trader_ready)
+        self.trader_failed_signal.connect(self.on_connect_failed)
+        self.instruments_loaded_signal.connect(self.on_instruments_loaded)
+        self.pair_price_signal.connect(self.show_pair_price)
+        self.armed_signal.connect(self.on_armed)
         
         self.log_message("Добро пожаловать в трейдер", "INFO")
+        
+        # Панель логов дописывается пачкой раз в кадр
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_logs)
+        self.log_timer.start(self.LOG_FRAME_MS)
+        
+        # Подключение начинается, когда окно уже показано (первый проход цикла событий)
+        QTimer.singleShot(0, self.start_connect)
+    
+    def start_connect(self):
+        """Запуск фонового подключения к OKX"""
+        self.window_shown_at = time.perf_counter()
+        self.log_message("Подключение к OKX...", "INFO")
+        threading.Thread(target=self.connect_trader, daemon=True).start()
+    
+    def connect_trader(self):
+        """Создание трейдера и запуск WebSocket-фидов в фоновом потоке"""
+        try:
+            trader = OKXTrader()
+            trader.start_market_feed()
+            trader.start_private_feed()
+        except Exception as e:
+            self.trader_failed_signal.emit(str(e))
+            return
+        self.trader_ready_signal.emit(trader)
+    
+    def on_trader_ready(self, trader):
+        """Трейдер готов (в потоке GUI): панель логов, обновление PnL, отчет о запуске"""
+        self.trader = trader
+        self.connected = True
+        
+        # Предупреждения и ошибки трейдера - в панель логов (сигнал доставляет их в поток GUI)
+        self.log_handler = add_gui_handler(self.trader_log_signal.emit)
+        # Поиск по пустому кэшу инструментов повторяется, когда они загрузятся в фоне
+        trader.instruments.add_listener(self.instruments_loaded_signal.emit)
+        self.setup_pnl_worker()
+        
+        now = time.perf_counter()
+        trader.latency.record("startup:window", self.window_shown_at - STARTED_AT)
+        trader.latency.record("startup:connected", now - STARTED_AT)
+        self.log_message(f"Подключено к OKX (окно: {(self.window_shown_at - STARTED_AT) * 1000:.0f}ms, "
+                         f"трейдер: {(now - STARTED_AT) * 1000:.0f}ms)", "SUCCESS")
+        for line in trader.startup_report():
+            self.log_message(line, "LATENCY")
+    
+    def on_connect_failed(self, error):
+        """Ошибка создания трейдера"""
+        self.log_message(f"Ошибка подключения: {error}", "ERROR")
     
     def setup_theme(self):
         """Настройка минималистичной черно-белой темы"""
@@ -277,6 +371,8 @@ class TradingApp(QMainWindow):
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Введите символ (например: SOL)")
         self.search_input.returnPressed.connect(self.search_pairs)
+        # Поиск по мере ввода - по индексу инструментов в памяти, без запросов к бирже
+        self.search_input.textChanged.connect(self.on_search_typed)
         search_layout.addWidget(self.search_input)
         
         search_btn = QPushButton("🔍")
@@ -318,6 +414,7 @@ class TradingApp(QMainWindow):
             ("500", 500, 10), 
             ("1500", 1500, 10)
         ]
+        self.presets = presets
         
         for i, (label, amount, leverage) in enumerate(presets):
             # LONG кнопка
@@ -334,6 +431,11 @@ class TradingApp(QMainWindow):
         
         layout.addLayout(presets_layout)
         
+        # Взвод: размер пересчитывается заранее, нажатие пресета - один запрос к бирже
+        self.armed_checkbox = QCheckBox("Взвести пресеты")
+        self.armed_checkbox.toggled.connect(self.update_armed)
+        layout.addWidget(self.armed_checkbox)
+        
         # Разделитель
         separator = QFrame()
         separator.setProperty("class", "separator")
@@ -443,12 +545,25 @@ class TradingApp(QMainWindow):
         clear_btn.clicked.connect(self.clear_logs)
         header_layout.addWidget(clear_btn)
         
+        latency_btn = QPushButton("Задержки")
+        latency_btn.setMaximumWidth(100)
+        latency_btn.clicked.connect(self.show_latency)
+        header_layout.addWidget(latency_btn)
+        
+        # Фильтр по минимальному уровню
+        self.log_filter = QComboBox()
+        self.log_filter.addItems(list(self.LOG_FILTERS))
+        self.log_filter.setMaximumWidth(110)
+        self.log_filter.currentTextChanged.connect(self.redraw_logs)
+        header_layout.addWidget(self.log_filter)
+        
         layout.addLayout(header_layout)
         
-        # Текстовое поле логов
+        # Текстовое поле логов (не больше LOG_PANEL_SIZE строк, полная история - в лог-файле)
         self.log_text = QTextEdit()
         self.log_text.setMaximumHeight(200)
         self.log_text.setReadOnly(True)
+        self.log_text.document().setMaximumBlockCount(self.LOG_PANEL_SIZE)
         layout.addWidget(self.log_text)
     
     def setup_pnl_worker(self):
@@ -469,32 +584,42 @@ class TradingApp(QMainWindow):
         query = self.search_input.text().strip().upper()
         if not query:
             return
+        if not self.connected:
+            self.log_message("Подключение к OKX еще не завершено", "WARNING")
+            return
         
         self.log_message(f"Поиск пар: {query}", "INFO")
         
         try:
-            # Получаем все пары через API
-            instruments = self.trader.trading_api.get_instruments(instType="SWAP")
+            # Фильтруем пары по запросу из кэша инструментов
+            self.fill_pairs_list(query)
             
-            if instruments['code'] != '0':
-                self.log_message("Ошибка получения инструментов", "ERROR")
+            if not self.pairs_data and not self.trader.instruments.by_id:
+                self.log_message("Список инструментов загружается, поиск повторится автоматически", "INFO")
                 return
             
-            # Фильтруем пары по запросу
-            self.pairs_data = []
-            self.pairs_list.clear()
-            
-            for instrument in instruments['data']:
-                inst_id = instrument['instId']
-                if query in inst_id:
-                    self.pairs_data.append(instrument)
-                    self.pairs_list.addItem(inst_id)
-            
             self.log_message(f"Найдено {len(self.pairs_data)} пар", "SUCCESS")
             
         except Exception as e:
             self.log_message(f"Ошибка поиска: {e}", "ERROR")
     
+    def on_search_typed(self, text):
+        """Фильтрация списка пар на каждое нажатие клавиши"""
+        if not self.connected:
+            return
+        self.fill_pairs_list(text.strip().upper())
+    
+    def on_instruments_loaded(self):
+        """Инструменты загружены: повтор поиска по введенному запросу"""
+        self.fill_pairs_list(self.search_input.text().strip().upper())
+    
+    def fill_pairs_list(self, query):
+        """Заполнение списка пар результатами поиска по индексу"""
+        self.pairs_data = self.trader.instruments.search(query, usdt_only=False) if query else []
+        self.pairs_list.clear()
+        for instrument in self.pairs_data:
+            self.pairs_list.addItem(instrument['instId'])
+    
     def select_pair(self, item):
         """Выбор торговой пары"""
         selected_text = item.text()
@@ -506,18 +631,53 @@ class TradingApp(QMainWindow):
                 break
         
         if self.selected_pair:
-            # Получаем текущую цену
-            try:
-                ticker = self.trader.public_api.get_tickers(instType="SWAP", instId=selected_text)
-                if ticker['code'] == '0' and ticker['data']:
-                    price = float(ticker['data'][0]['last'])
-                    self.selected_pair_label.setText(f"✓ {selected_text} | Цена: ${price:.4f}")
-                    self.selected_pair_label.setStyleSheet("color: #4caf50; font-weight: 600;")
-                    self.log_message(f"Выбрана пара: {selected_text}", "INFO")
-                    self.log_message(f"Цена {selected_text}: ${price:.4f}", "INFO")
-            except Exception as e:
-                self.selected_pair_label.setText(f"✓ {selected_text}")
-                self.log_message(f"Ошибка получения цены: {e}", "WARNING")
+            self.selected_pair_label.setText(f"✓ {selected_text}")
+            self.log_message(f"Выбрана пара: {selected_text}", "INFO")
+            
+            # Цена - в фоне (из WebSocket-фида, пара заодно подписывается; REST - если цены еще нет)
+            threading.Thread(target=lambda: self.pair_price_signal.emit(
+                selected_text, self.trader.get_current_price(selected_text)), daemon=True).start()
+            
+            self.update_armed()
+    
+    def show_pair_price(self, inst_id, price):
+        """Цена выбранной пары (результат фонового запроса)"""
+        if not self.selected_pair or self.selected_pair['instId'] != inst_id:
+            return
+        if price is None:
+            self.log_message(f"Не удалось получить цену {inst_id}", "WARNING")
+            return
+        self.selected_pair_label.setText(f"✓ {inst_id} | Цена: ${price:.4f}")
+        self.selected_pair_label.setStyleSheet("color: #4caf50; font-weight: 600;")
+        self.log_message(f"Цена {inst_id}: ${price:.4f}", "INFO")
+    
+    def update_armed(self):
+        """Взвести пресеты для выбранной пары (в фоне) или снять взвод"""
+        if self.armed:
+            self.armed.disarm()
+            self.armed = None
+        if not self.armed_checkbox.isChecked() or not self.selected_pair or not self.connected:
+            return
+        
+        # Все пресеты используют одно плечо - взводим по нему
+        leverage = self.presets[0][2]
+        amounts = [amount for _, amount, _ in self.presets]
+        armed = ArmedOrder(self.trader, self.selected_pair['instId'], leverage, amounts)
+        self.armed = armed
+        # arm() делает REST-запросы (плечо, режим позиций, цена) - в фоновом потоке
+        threading.Thread(target=lambda: self.armed_signal.emit(armed, armed.arm()), daemon=True).start()
+    
+    def on_armed(self, armed, ok):
+        """Результат взвода пресетов (в потоке GUI)"""
+        if armed is not self.armed:
+            # Пара сменилась или взвод снят, пока шла подготовка
+            armed.disarm()
+            return
+        if ok:
+            self.log_message(f"Пресеты взведены: {armed.inst_id}, плечо {armed.leverage}x", "INFO")
+        else:
+            self.armed = None
+            self.log_message(f"Не удалось взвести пресеты: {armed.error}", "ERROR")
     
     def place_preset_order(self, side, amount, leverage):
         """Размещение ордера через пресет"""
@@ -528,19 +688,27 @@ class TradingApp(QMainWindow):
         self.log_message(f"ПРЕСЕТ {side.upper()}: {self.selected_pair['instId']}, маржа ${amount}, плечо {leverage}x", "INFO")
         
         try:
-            # Устанавливаем плечо
-            self.trader.set_leverage(self.selected_pair['instId'], leverage)
-            
-            # Размещаем ордер
-            result = self.trader.place_market_order(
-                inst_id=self.selected_pair['instId'],
-                side=side,
-                margin_usd=amount,
-                leverage=leverage
-            )
+            inst_id = self.selected_pair['instId']
+            armed = self.armed
+            if armed and armed.matches(inst_id, leverage) and armed.is_ready(amount):
+                # Взведенный пресет: размер и posSide уже готовы
+                result = armed.fire(side, amount)
+            else:
+                current_price = self.trader.get_current_price(inst_id)
+                if not current_price:
+                    self.log_message("Не удалось получить цену для пресета", "ERROR")
+                    return
+                
+                size = self.trader.calculate_position_size(inst_id, amount, leverage, current_price)
+                if not size:
+                    self.log_message("Не удалось рассчитать размер позиции", "ERROR")
+                    return
+                
+                # Размещаем ордер (плечо устанавливается внутри, только если оно меняется)
+                result = self.trader.place_market_order(inst_id, side, size, leverage)
             
-            if result:
-                self.log_message(f"ПРЕСЕТ {side.upper()} размещен! ID: {result}", "SUCCESS")
+            if result['success']:
+                self.log_message(f"ПРЕСЕТ {side.upper()} размещен! ID: {result['order_id']}", "SUCCESS")
                 # Обновляем поля
                 self.margin_input.setText(str(amount))
                 # Устанавливаем плечо в группе кнопок
@@ -549,7 +717,7 @@ class TradingApp(QMainWindow):
                         btn.setChecked(True)
                         break
             else:
-                self.log_message(f"Ошибка размещения пресета {side.upper()}", "ERROR")
+                self.log_message(f"Ошибка размещения пресета {side.upper()}: {result['error']}", "ERROR")
                 
         except Exception as e:
             self.log_message(f"Ошибка пресета: {e}", "ERROR")
@@ -580,101 +748,151 @@ class TradingApp(QMainWindow):
         self.log_message(f"{side.upper()}: {self.selected_pair['instId']}, маржа ${margin}, плечо {selected_leverage}x", "INFO")
         
         try:
-            # Устанавливаем плечо
-            self.trader.set_leverage(self.selected_pair['instId'], selected_leverage)
+            inst_id = self.selected_pair['instId']
+            current_price = self.trader.get_current_price(inst_id)
+            if not current_price:
+                self.log_message("Не удалось получить текущую цену", "ERROR")
+                return
             
-            # Размещаем ордер
-            result = self.trader.place_market_order(
-                inst_id=self.selected_pair['instId'],
-                side=side,
-                margin_usd=margin,
-                leverage=selected_leverage
-            )
+            size = self.trader.calculate_position_size(inst_id, margin, selected_leverage, current_price)
+            if not size:
+                self.log_message("Не удалось рассчитать размер позиции", "ERROR")
+                return
             
-            if result:
-                self.log_message(f"Ордер {side.upper()} размещен! ID: {result}", "SUCCESS")
+            # Размещаем ордер (плечо устанавливается внутри, только если оно меняется)
+            result = self.trader.place_market_order(inst_id, side, size, selected_leverage)
+            
+            if result['success']:
+                self.log_message(f"Ордер {side.upper()} размещен! ID: {result['order_id']}", "SUCCESS")
             else:
-                self.log_message(f"Ошибка размещения ордера {side.upper()}", "ERROR")
+                self.log_message(f"Ошибка размещения ордера {side.upper()}: {result['error']}", "ERROR")
                 
         except Exception as e:
             self.log_message(f"Ошибка ордера: {e}", "ERROR")
     
-    def update_positions(self, positions, total_pnl, total_pnl_percentage):
-        """Обновление таблицы позиций"""
-        self.positions_table.setRowCount(len(positions))
-        
-        for i, pos in enumerate(positions):
-            inst_id = pos.get('instId', '')
-            side = "LONG" if float(pos.get('pos', 0)) > 0 else "SHORT"
-            size = abs(float(pos.get('pos', 0)))
-            avg_px = float(pos.get('avgPx', 0))
-            mark_px = float(pos.get('markPx', 0))
-            upl = float(pos.get('upl', 0))
-            upl_ratio = float(pos.get('uplRatio', 0)) * 100
-            
-            # Заполняем строку
-            self.positions_table.setItem(i, 0, QTableWidgetItem(inst_id))
-            self.positions_table.setItem(i, 1, QTableWidgetItem(side))
-            self.positions_table.setItem(i, 2, QTableWidgetItem(f"{size:.4f}"))
-            self.positions_table.setItem(i, 3, QTableWidgetItem(f"${avg_px:.4f}"))
-            self.positions_table.setItem(i, 4, QTableWidgetItem(f"${mark_px:.4f}"))
-            
-            # PnL с цветом
-            pnl_item = QTableWidgetItem(format_currency(upl))
-            pnl_item.setForeground(QColor("#4caf50" if upl >= 0 else "#f44336"))
-            self.positions_table.setItem(i, 5, pnl_item)
-            
-            pnl_percent_item = QTableWidgetItem(format_percentage(upl_ratio))
-            pnl_percent_item.setForeground(QColor("#4caf50" if upl_ratio >= 0 else "#f44336"))
-            self.positions_table.setItem(i, 6, pnl_percent_item)
-        
-        # Обновляем общий PnL
-        color = "#4caf50" if total_pnl >= 0 else "#f44336"
-        pnl_text = f"PnL: {format_currency(total_pnl)} ({format_percentage(total_pnl_percentage)})"
-        self.total_pnl_label.setText(pnl_text)
-        self.total_pnl_label.setStyleSheet(f"color: {color}; font-weight: 700; font-size: 16px; padding: 8px; border-radius: 6px; background-color: #1a1a1a;")
+    def update_positions(self, diff, total_pnl, total_ratio):
+        """Обновление таблицы позиций по изменениям: меняются только затронутые строки и ячейки"""
+        table = self.positions_table
+        
+        # Закрытые позиции
+        for key in diff['removed']:
+            table.removeRow(self.position_keys.index(key))
+            self.position_keys.remove(key)
+            del self.position_cells[key]
+        
+        # Новые позиции
+        for pos in diff['added']:
+            key = position_key(pos)
+            row = table.rowCount()
+            table.insertRow(row)
+            cells = position_cells(pos)
+            for column, (text, color) in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if color:
+                    item.setForeground(QColor(color))
+                table.setItem(row, column, item)
+            self.position_keys.append(key)
+            self.position_cells[key] = cells
+        
+        # Изменившиеся позиции - существующие ячейки, только новые значения
+        for pos in diff['changed']:
+            key = position_key(pos)
+            row = self.position_keys.index(key)
+            cells = position_cells(pos)
+            for column, (cell, old_cell) in enumerate(zip(cells, self.position_cells[key])):
+                if cell == old_cell:
+                    continue
+                item = table.item(row, column)
+                item.setText(cell[0])
+                if cell[1] != old_cell[1]:
+                    item.setForeground(QColor(cell[1]))
+            self.position_cells[key] = cells
+        
+        # Обновляем общий PnL (только при изменении текста)
+        pnl_text = f"PnL: {format_currency(total_pnl)} ({format_percentage(total_ratio)[0]})"
+        if pnl_text != self.total_pnl_label.text():
+            color = "#4caf50" if total_pnl >= 0 else "#f44336"
+            self.total_pnl_label.setText(pnl_text)
+            self.total_pnl_label.setStyleSheet(f"color: {color}; font-weight: 700; font-size: 16px; padding: 8px; border-radius: 6px; background-color: #1a1a1a;")
     
     def close_all_positions(self):
         """Закрытие всех позиций"""
+        if not self.connected:
+            return
         try:
-            closed_count = self.trader.close_all_positions()
-            if closed_count > 0:
-                self.log_message(f"Закрыто позиций: {closed_count}", "SUCCESS")
+            result = self.trader.close_all_positions()
+            if result['success']:
+                self.log_message(result['message'], "SUCCESS")
+            elif 'results' in result:
+                for r in result['results']:
+                    if not r['success']:
+                        self.log_message(f"{r['instId']}: {r['error']}", "ERROR")
+                self.log_message(result['message'], "WARNING")
             else:
-                self.log_message("Нет позиций для закрытия", "INFO")
+                self.log_message(f"Ошибка закрытия позиций: {result['error']}", "ERROR")
         except Exception as e:
             self.log_message(f"Ошибка закрытия позиций: {e}", "ERROR")
     
-    def log_message(self, message, level="INFO"):
-        """Добавление сообщения в лог"""
+    def log_message(self, message, level="INFO", persist=True):
+        """Добавление сообщения в лог: в кольцевой буфер панели (отрисовка - по таймеру, flush_logs)
+        и в лог-файл через фоновый поток записи (persist=False - запись уже в файле)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        log_entry = f"[{timestamp}] {level}: {message}"
-        self.logs.append(log_entry)
-        
-        # Ограничиваем количество логов
-        if len(self.logs) > 100:
-            self.logs = self.logs[-100:]
-        
-        # Обновляем текстовое поле
-        self.log_text.setPlainText("\n".join(self.logs))
-        
-        # Прокручиваем вниз
-        cursor = self.log_text.textCursor()
-        cursor.movePosition(cursor.End)
-        self.log_text.setTextCursor(cursor)
+        self.logs.append(f"[{timestamp}] {level}: {message}", level)
+        if persist:
+            log_to_file(message, level)
+    
+    def log_trader_message(self, message, level):
+        """Запись лога трейдера (уже в лог-файле) - только в панель"""
+        self.log_message(message, level, persist=False)
+    
+    def flush_logs(self):
+        """Дописывание новых строк в панель логов; старые строки сверх LOG_PANEL_SIZE документ удаляет сам"""
+        lines = self.logs.take_pending(self.LOG_FILTERS[self.log_filter.currentText()])
+        if not lines:
+            return
+        self.log_text.moveCursor(QTextCursor.End)
+        self.log_text.insertPlainText(("\n" if self.log_text.document().characterCount() > 1 else "")
+                                      + "\n".join(lines))
+        self.log_text.moveCursor(QTextCursor.End)
+        self.log_text.ensureCursorVisible()
+    
+    def redraw_logs(self):
+        """Полная перерисовка панели логов (смена фильтра уровня)"""
+        self.log_text.setPlainText("\n".join(self.logs.lines(self.LOG_FILTERS[self.log_filter.currentText()])))
+        self.log_text.moveCursor(QTextCursor.End)
+    
+    def show_latency(self):
+        """Вывод p50/p95/p99 задержек по этапам и эндпоинтам в лог"""
+        if not self.connected:
+            return
+        lines = self.trader.latency_report()
+        if not lines:
+            self.log_message("Замеров задержек пока нет", "INFO")
+        for line in lines:
+            self.log_message(line, "LATENCY")
     
     def clear_logs(self):
         """Очистка логов"""
-        self.logs = []
+        self.logs.clear()
         self.log_text.clear()
     
     def closeEvent(self, event):
         """Обработка закрытия приложения"""
+        if self.armed:
+            self.armed.disarm()
+        if self.log_handler:
+            remove_gui_handler(self.log_handler)
         if hasattr(self, 'pnl_worker'):
             self.pnl_worker.stop()
         if hasattr(self, 'pnl_thread'):
             self.pnl_thread.quit()
             self.pnl_thread.wait()
+        if self.connected:
+            self.trader.stop_market_feed()
+            self.trader.stop_private_feed()
+            self.trader.save_snapshot()
+            self.trader.close()
+        shutdown_logging()
         event.accept()
 
 
@@ -0,0 +1,118 @@
+import base64
+import hmac
+import json
+from datetime import datetime, timezone
+
+import httpx
+
+from server_clock import TIMESTAMP_EXPIRED
+
+
+API_URL = "https://www.okx.com"
+
+
+def get_timestamp():
+    """Метка времени в формате OKX (ISO 8601, миллисекунды, UTC)"""
+    now = datetime.now(timezone.utc)
+    return now.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def sign(timestamp, method, request_path, body, secret_key):
+    """Подпись запроса: base64(HMAC-SHA256(timestamp + METHOD + path + body))"""
+    message = timestamp + method.upper() + request_path + body
+    mac = hmac.new(secret_key.encode(), message.encode(), digestmod='sha256')
+    return base64.b64encode(mac.digest()).decode()
+
+
+def build_request(method, path, params):
+    """Путь запроса (с query-строкой для GET) и тело запроса, как их формирует python-okx"""
+    if method == "GET":
+        query = "&".join(f"{key}={value}" for key, value in params.items()
+                         if value is not None and value != '')
+        return (f"{path}?{query}" if query else path), ""
+    return path, json.dumps(params)
+
+
+def make_headers(flag, method="GET", request_path="", body="", api_key=None, secret_key=None, passphrase=None,
+                 timestamp=None):
+    """Заголовки запроса; при переданных ключах - с подписью (timestamp - метка времени сервера, см. ServerClock)"""
+    headers = {
+        'Content-Type': 'application/json',
+        'x-simulated-trading': flag
+    }
+    if api_key:
+        timestamp = timestamp or get_timestamp()
+        headers['OK-ACCESS-KEY'] = api_key
+        headers['OK-ACCESS-SIGN'] = sign(timestamp, method, request_path, body, secret_key)
+        headers['OK-ACCESS-TIMESTAMP'] = timestamp
+        headers['OK-ACCESS-PASSPHRASE'] = passphrase
+    return headers
+
+
+def create_client(base_url=API_URL, max_connections=10, timeout=10.0, keepalive_expiry=60.0):
+    """Синхронный HTTP/2 клиент с пулом keep-alive соединений (общий для всех клиентов python-okx)"""
+    return httpx.Client(
+        base_url=base_url,
+        http2=True,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                            keepalive_expiry=keepalive_expiry),
+        timeout=timeout
+    )
+
+
+def share_session(client, session, clock=None, timeout=None, hosts=None):
+    """
+    Отправка REST-запросов клиента python-okx через общий HTTP клиент session.
+    Подпись и формат запроса - как в python-okx; собственный пул клиента закрывается.
+    clock (ServerClock) - подпись по времени сервера; при ошибке метки времени
+    часы синхронизируются заново и запрос отправляется повторно (биржа его не приняла).
+    timeout - таймаут запросов этого клиента (по умолчанию - таймаут session).
+    hosts (HostSelector) - запрос на самый быстрый из равнозначных хостов, чтения - с хеджированием.
+    """
+    signed = client.API_KEY != '-1'
+    request_timeout = timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+
+    def send(method, request_path, body, host=None):
+        if signed:
+            headers = make_headers(client.flag, method, request_path, body,
+                                   client.API_KEY, client.API_SECRET_KEY, client.PASSPHRASE,
+                                   timestamp=clock.timestamp() if clock is not None else None)
+        else:
+            headers = make_headers(client.flag)
+        try:
+            response = session.request(method, host + request_path if host else request_path,
+                                       content=body or None, headers=headers, timeout=request_timeout)
+        except httpx.TransportError:
+            if host:
+                hosts.fail(host)
+            raise
+        return response.json()
+
+    def send_to_best(method, request_path, body):
+        if hosts is None:
+            return send(method, request_path, body)
+        if hosts.should_hedge(method, request_path):
+            return hosts.hedged(lambda host: send(method, request_path, body, host), request_path)
+        return send(method, request_path, body, hosts.best)
+
+    def request(method, request_path, params):
+        request_path, body = build_request(method, request_path, params)
+        result = send_to_best(method, request_path, body)
+        if signed and clock is not None and clock.fetch is not None and result.get('code') == TIMESTAMP_EXPIRED:
+            clock.resync()
+            result = send_to_best(method, request_path, body)
+        return result
+
+    client._request = request
+    client.close()
+    return client
+
+
+def create_async_client(base_url=API_URL, max_connections=20, timeout=10.0):
+    """Асинхронный HTTP/2 клиент с пулом keep-alive соединений"""
+    return httpx.AsyncClient(
+        base_url=base_url,
+        http2=True,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=timeout
+    )
@@ -0,0 +1,202 @@
+import logging
+import queue
+import sys
+import threading
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+# Общий логгер трейдера, WebSocket-фидов и вспомогательных модулей
+logger = logging.getLogger("okx")
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(threadName)s] %(message)s"
+
+# Сообщения панели логов GUI: пишутся в файл тем же фоновым потоком, но не возвращаются в панель
+gui_logger = logger.getChild("gui")
+
+# Уровни сообщений панели логов (SUCCESS и LATENCY - уровни приложения)
+SUCCESS = logging.INFO + 5
+logging.addLevelName(SUCCESS, "SUCCESS")
+PANEL_LEVELS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'LATENCY': logging.INFO,
+    'SUCCESS': SUCCESS,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'CRITICAL': logging.CRITICAL
+}
+
+_listener = None
+_queue_handler = None
+_lock = threading.Lock()
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Постановка записи в ограниченную очередь без форматирования в вызывающем потоке.
+    При переполненной очереди запись отбрасывается (счетчик dropped), а не блокирует поток ордера.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Сообщение форматируется в фоновом потоке записи
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredFormatter(logging.Formatter):
+    """Формат записи с полями из extra={'fields': {...}} в виде key=value"""
+
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message += " | " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+
+class CallbackHandler(logging.Handler):
+    """Передача отформатированных записей в функцию callback(message, level) - для панели логов GUI"""
+
+    def __init__(self, callback, level=logging.WARNING):
+        super().__init__(level)
+        self.callback = callback
+        self.setFormatter(StructuredFormatter("%(message)s"))
+        self.addFilter(lambda record: record.name != gui_logger.name)
+
+    def emit(self, record):
+        try:
+            self.callback(self.format(record), record.levelname)
+        except Exception:
+            self.handleError(record)
+
+
+class LogBuffer:
+    """
+    Кольцевой буфер панели логов GUI: последние capacity записей (для перерисовки при смене
+    фильтра) и записи, добавленные после последней отрисовки - панель дописывает только их
+    """
+
+    def __init__(self, capacity=500):
+        self.capacity = capacity
+        self.entries = deque(maxlen=capacity)  # (уровень, строка)
+        self.pending = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def append(self, line, level="INFO"):
+        entry = (PANEL_LEVELS.get(level, logging.INFO), line)
+        with self._lock:
+            self.entries.append(entry)
+            self.pending.append(entry)
+
+    def take_pending(self, min_level=0):
+        """Новые строки с уровнем не ниже min_level (после вызова считаются отрисованными)"""
+        with self._lock:
+            entries = list(self.pending)
+            self.pending.clear()
+        return [line for number, line in entries if number >= min_level]
+
+    def lines(self, min_level=0):
+        """Все строки буфера с уровнем не ниже min_level - для полной перерисовки панели"""
+        with self._lock:
+            self.pending.clear()
+            return [line for number, line in self.entries if number >= min_level]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.pending.clear()
+
+
+def log_to_file(message, level="INFO"):
+    """Запись сообщения панели логов в лог-файл (через очередь фонового потока записи)"""
+    if _listener is None:
+        return  # Логирование еще не настроено (трейдер не создан)
+    gui_logger.log(PANEL_LEVELS.get(level, logging.INFO), message)
+
+
+def setup_logging(config=None):
+    """
+    Настройка логирования (повторные вызовы ничего не меняют).
+    Запись в файл с ротацией и в консоль выполняется в фоновом потоке,
+    вызывающий поток только ставит запись в очередь.
+    """
+    global _listener, _queue_handler
+    config = config or {}
+    with _lock:
+        if _listener is not None:
+            return _listener
+
+        formatter = StructuredFormatter(LOG_FORMAT)
+        handlers = []
+        if config.get('file', "okx_trader.log"):
+            file_handler = RotatingFileHandler(
+                config.get('file', "okx_trader.log"),
+                maxBytes=config.get('max_bytes', 5 * 1024 * 1024),
+                backupCount=config.get('backup_count', 3),
+                encoding='utf-8'
+            )
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        if config.get('console', True):
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+
+        log_queue = queue.Queue(maxsize=config.get('queue_size', 10000))
+        _queue_handler = BoundedQueueHandler(log_queue)
+        logger.addHandler(_queue_handler)
+        logger.setLevel(config.get('level', "INFO"))
+        logger.propagate = False
+
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        return _listener
+
+
+def add_gui_handler(callback, level=logging.WARNING):
+    """Подключение панели логов GUI: callback(message, level) вызывается из фонового потока записи"""
+    handler = CallbackHandler(callback, level)
+    with _lock:
+        if _listener is None:
+            logger.addHandler(handler)
+        else:
+            _listener.handlers = _listener.handlers + (handler,)
+    return handler
+
+
+def remove_gui_handler(handler):
+    """Отключение панели логов GUI"""
+    with _lock:
+        if _listener is not None and handler in _listener.handlers:
+            _listener.handlers = tuple(h for h in _listener.handlers if h is not handler)
+        else:
+            logger.removeHandler(handler)
+
+
+def dropped_records():
+    """Количество записей, отброшенных из-за переполненной очереди"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def shutdown_logging():
+    """Остановка фонового потока с дозаписью очереди"""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logger.removeHandler(_queue_handler)
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        _queue_handler = None
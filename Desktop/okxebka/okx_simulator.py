@@ -0,0 +1,772 @@
+#!/usr/bin/env python3
+"""
+Локальный симулятор биржи OKX для тестов и замеров без сети и реальных ключей.
+REST-эндпоинты, которые использует OKXTrader, и WebSocket-каналы tickers,
+mark-price, positions, account, orders. Задержка, ошибки и лимиты запросов
+настраиваются.
+
+Запуск: python okx_simulator.py --port 8765 --ws-port 8766
+и в config.json: "base_url": "http://127.0.0.1:8765",
+"ws_public_url": "ws://127.0.0.1:8766/ws/v5/public",
+"ws_private_url": "ws://127.0.0.1:8766/ws/v5/private"
+"""
+
+import argparse
+import asyncio
+import base64
+import hmac
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+import websockets
+
+from rate_limit import TokenBucket, endpoint_limit
+
+
+# Базовые инструменты: базовая валюта -> (цена, ctVal, lotSz, tickSz)
+BASE_INSTRUMENTS = {
+    'BTC': (60000.0, '0.01', '0.01', '0.1'),
+    'ETH': (3000.0, '0.1', '0.01', '0.01'),
+    'SOL': (150.0, '1', '0.01', '0.01'),
+    'XRP': (0.6, '100', '1', '0.0001'),
+    'DOGE': (0.15, '1000', '1', '0.00001'),
+    'TON': (5.0, '1', '1', '0.001'),
+    'LTC': (80.0, '1', '0.1', '0.01'),
+    'ADA': (0.45, '100', '0.1', '0.0001'),
+}
+
+ERROR_UNAVAILABLE = ('50001', 'Service temporarily unavailable, please try again later.')
+ERROR_RATE_LIMIT = ('50011', 'Too Many Requests')
+ERROR_TIMESTAMP = ('50102', 'Timestamp request expired')
+ERROR_SIGN = ('50113', 'Invalid Sign')
+
+
+class SimExchange:
+    """Состояние симулятора: инструменты, цены, плечо, позиции, баланс, ордера"""
+
+    def __init__(self, extra_instruments=0, balance=10000.0, pos_mode="net_mode", volatility=0.0005, seed=None):
+        self.random = random.Random(seed)
+        self.volatility = volatility  # Относительный шаг случайного блуждания цены
+        self.pos_mode = pos_mode
+        self.cash = balance
+        self.instruments = {}
+        self.prices = {}
+        self.leverage = {}  # (instId, mgnMode) -> плечо
+        self.positions = {}  # (instId, posSide) -> {'pos', 'avgPx', 'mgnMode', 'cTime'}
+        self.orders = {}  # ordId -> ордер
+        self.cl_ord_ids = {}  # clOrdId -> ordId
+        self.lock = threading.Lock()
+        self.listeners = []  # Функции (channel, data), вызываются при изменениях
+        self._ord_ids = itertools.count(int(time.time() * 1000) * 1000)
+
+        for base, (price, ct_val, lot_sz, tick_sz) in BASE_INSTRUMENTS.items():
+            self._add_instrument(f"{base}-USDT-SWAP", price, ct_val, lot_sz, tick_sz, 'USDT')
+            self._add_instrument(f"{base}-USD-SWAP", price, '10', '1', tick_sz, 'USD')
+        for i in range(extra_instruments):
+            self._add_instrument(f"SIM{i}-USDT-SWAP", 1.0 + i % 100, '1', '1', '0.0001', 'USDT')
+
+    def _add_instrument(self, inst_id, price, ct_val, lot_sz, tick_sz, quote):
+        base = inst_id.split('-')[0]
+        self.instruments[inst_id] = {
+            'instType': 'SWAP', 'instId': inst_id, 'uly': f"{base}-{quote}", 'instFamily': f"{base}-{quote}",
+            'settleCcy': quote if quote == 'USDT' else base, 'ctVal': ct_val, 'ctMult': '1',
+            'ctValCcy': base if quote == 'USDT' else 'USD', 'ctType': 'linear' if quote == 'USDT' else 'inverse',
+            'baseCcy': '', 'quoteCcy': '', 'lotSz': lot_sz, 'minSz': lot_sz, 'tickSz': tick_sz,
+            'lever': '100', 'state': 'live', 'listTime': '1600000000000'
+        }
+        self.prices[inst_id] = price
+
+    # ---- цены ----
+
+    def tick(self):
+        """Шаг случайного блуждания всех цен"""
+        with self.lock:
+            for inst_id, price in self.prices.items():
+                self.prices[inst_id] = price * (1 + self.random.gauss(0, self.volatility))
+
+    def ticker(self, inst_id, ts):
+        last = self.prices[inst_id]
+        return {
+            'instType': 'SWAP', 'instId': inst_id, 'last': _fmt(last), 'lastSz': '1',
+            'askPx': _fmt(last * 1.0001), 'askSz': '100', 'bidPx': _fmt(last * 0.9999), 'bidSz': '100',
+            'open24h': _fmt(last), 'high24h': _fmt(last * 1.02), 'low24h': _fmt(last * 0.98),
+            'volCcy24h': '1000000', 'vol24h': '1000000', 'sodUtc0': _fmt(last), 'sodUtc8': _fmt(last),
+            'ts': ts
+        }
+
+    # ---- аккаунт ----
+
+    def account_config(self):
+        return {
+            'uid': '1000000000', 'mainUid': '1000000000', 'acctLv': '2', 'posMode': self.pos_mode,
+            'autoLoan': False, 'greeksType': 'PA', 'level': 'Lv1', 'ctIsoMode': 'automatic',
+            'mgnIsoMode': 'automatic', 'label': 'okx-simulator', 'perm': 'read_only,trade'
+        }
+
+    def get_leverage(self, inst_id, mgn_mode):
+        return self.leverage.get((inst_id, mgn_mode), 5.0)
+
+    def balance(self):
+        rows = [self._position_row(key, pos) for key, pos in self.positions.items()]
+        upl = sum(row['upl_value'] for row in rows)
+        imr = sum(row['imr_value'] for row in rows)
+        eq = self.cash + upl
+        return {
+            'totalEq': _fmt(eq), 'isoEq': '0', 'adjEq': _fmt(eq), 'imr': _fmt(imr), 'mmr': _fmt(imr / 10),
+            'availEq': _fmt(eq - imr), 'upl': _fmt(upl), 'uTime': _now_ms(),
+            'details': [{
+                'ccy': 'USDT', 'eq': _fmt(eq), 'cashBal': _fmt(self.cash), 'availBal': _fmt(eq - imr),
+                'availEq': _fmt(eq - imr), 'frozenBal': _fmt(imr), 'upl': _fmt(upl), 'eqUsd': _fmt(eq)
+            }]
+        }
+
+    # ---- позиции ----
+
+    def _position_row(self, key, pos):
+        inst_id, pos_side = key
+        inst = self.instruments[inst_id]
+        mark_px = self.prices[inst_id]
+        size = pos['pos']
+        direction = -1 if size < 0 or pos_side == 'short' else 1
+        notional = abs(size) * float(inst['ctVal']) * mark_px
+        upl = direction * abs(size) * float(inst['ctVal']) * (mark_px - pos['avgPx'])
+        lever = self.get_leverage(inst_id, pos['mgnMode'])
+        imr = notional / lever
+        return {
+            'instType': 'SWAP', 'instId': inst_id, 'posId': str(abs(hash(key)) % 10 ** 12),
+            'posSide': pos_side, 'pos': _fmt(size), 'avgPx': _fmt(pos['avgPx']), 'markPx': _fmt(mark_px),
+            'last': _fmt(mark_px), 'upl': _fmt(upl), 'uplRatio': _fmt(upl / imr if imr else 0),
+            'notionalUsd': _fmt(notional), 'lever': _fmt(lever), 'mgnMode': pos['mgnMode'],
+            'margin': _fmt(imr) if pos['mgnMode'] == 'isolated' else '', 'imr': _fmt(imr),
+            'ccy': 'USDT', 'cTime': pos['cTime'], 'uTime': _now_ms(),
+            'upl_value': upl, 'imr_value': imr
+        }
+
+    def position_rows(self, inst_id=None):
+        rows = []
+        for key, pos in self.positions.items():
+            if inst_id and key[0] != inst_id:
+                continue
+            row = self._position_row(key, pos)
+            del row['upl_value'], row['imr_value']
+            rows.append(row)
+        return rows
+
+    def _apply_fill(self, inst_id, side, pos_side, size, price, mgn_mode, reduce_only):
+        """Изменение позиции после исполнения; возвращает исполненный размер"""
+        key = (inst_id, pos_side)
+        pos = self.positions.get(key)
+        current = pos['pos'] if pos else 0.0  # net: со знаком, long/short: положительный
+        if pos_side == 'net':
+            delta = size if side == 'buy' else -size
+            if reduce_only:
+                if current * delta >= 0:
+                    return 0.0
+                if abs(delta) > abs(current):
+                    delta = -current
+        else:
+            opening = (pos_side == 'long') == (side == 'buy')
+            if opening and reduce_only:
+                return 0.0
+            delta = size if opening else -min(size, current)
+        if delta == 0:
+            return 0.0
+
+        # Реализованный результат при сокращении позиции
+        if pos and current * delta < 0:
+            closed = min(abs(current), abs(delta))
+            direction = 1 if pos_side == 'long' or (pos_side == 'net' and current > 0) else -1
+            self.cash += direction * closed * float(self.instruments[inst_id]['ctVal']) * (price - pos['avgPx'])
+
+        new_pos = current + delta
+        if abs(new_pos) < 1e-12:
+            self.positions.pop(key, None)
+        elif pos is None:
+            self.positions[key] = {'pos': new_pos, 'avgPx': price, 'mgnMode': mgn_mode, 'cTime': _now_ms()}
+        else:
+            if current * new_pos < 0:
+                # Переворот позиции - новая средняя цена
+                pos['avgPx'] = price
+            elif abs(new_pos) > abs(current):
+                # Увеличение позиции - средняя цена взвешивается
+                pos['avgPx'] = (abs(current) * pos['avgPx'] + abs(delta) * price) / abs(new_pos)
+            pos['pos'] = new_pos
+        return abs(delta)
+
+    # ---- ордера ----
+
+    def place_order(self, params):
+        """Исполнение рыночного ордера; возвращает строку ответа OKX (sCode/sMsg)"""
+        inst_id = params.get('instId')
+        cl_ord_id = params.get('clOrdId', '')
+        reply = {'clOrdId': cl_ord_id, 'ordId': '', 'tag': params.get('tag', ''), 'ts': _now_ms()}
+
+        if inst_id not in self.instruments:
+            return dict(reply, sCode='51001', sMsg=f"Instrument ID {inst_id} does not exist.")
+        if params.get('ordType') != 'market':
+            return dict(reply, sCode='51000', sMsg="Parameter ordType error")
+        if params.get('side') not in ('buy', 'sell'):
+            return dict(reply, sCode='51000', sMsg="Parameter side error")
+        if params.get('tdMode') not in ('cross', 'isolated'):
+            return dict(reply, sCode='51000', sMsg="Parameter tdMode error")
+        pos_side = params.get('posSide') or 'net'
+        if (self.pos_mode == 'net_mode') != (pos_side == 'net'):
+            return dict(reply, sCode='51000', sMsg="Parameter posSide error")
+        if cl_ord_id and cl_ord_id in self.cl_ord_ids:
+            return dict(reply, sCode='51016', sMsg="Duplicated clOrdId")
+
+        lot_sz = float(self.instruments[inst_id]['lotSz'])
+        try:
+            size = float(params.get('sz'))
+        except (TypeError, ValueError):
+            return dict(reply, sCode='51000', sMsg="Parameter sz error")
+        if size <= 0 or abs(size / lot_sz - round(size / lot_sz)) > 1e-6:
+            return dict(reply, sCode='51121', sMsg=f"Order quantity must be a multiple of the lot size {lot_sz}.")
+
+        price = self.prices[inst_id]
+        reduce_only = str(params.get('reduceOnly', '')).lower() == 'true'
+        filled = self._apply_fill(inst_id, params['side'], pos_side, size, price,
+                                  params['tdMode'], reduce_only)
+
+        ord_id = str(next(self._ord_ids))
+        now = _now_ms()
+        order = {
+            'instType': 'SWAP', 'instId': inst_id, 'ordId': ord_id, 'clOrdId': cl_ord_id,
+            'tag': params.get('tag', ''), 'px': '', 'sz': params['sz'], 'ordType': 'market',
+            'side': params['side'], 'posSide': pos_side, 'tdMode': params['tdMode'],
+            'accFillSz': _fmt(filled), 'fillPx': _fmt(price), 'fillSz': _fmt(filled),
+            'avgPx': _fmt(price) if filled else '', 'state': 'filled' if filled else 'canceled',
+            'lever': _fmt(self.get_leverage(inst_id, params['tdMode'])), 'reduceOnly': str(reduce_only).lower(),
+            'cTime': now, 'uTime': now, 'fillTime': now
+        }
+        self.orders[ord_id] = order
+        if cl_ord_id:
+            self.cl_ord_ids[cl_ord_id] = ord_id
+
+        self._notify('orders', [order])
+        self._notify('positions', self._position_update(inst_id, pos_side))
+        self._notify('account', [self.balance()])
+        return dict(reply, ordId=ord_id, sCode='0', sMsg="Order placed")
+
+    def _position_update(self, inst_id, pos_side):
+        rows = [row for row in self.position_rows(inst_id) if row['posSide'] == pos_side]
+        if rows:
+            return rows
+        # Закрытая позиция приходит в канал positions с pos = 0
+        return [{'instType': 'SWAP', 'instId': inst_id, 'posSide': pos_side, 'pos': '0', 'avgPx': '',
+                 'upl': '0', 'uplRatio': '0', 'notionalUsd': '0', 'lever': '', 'mgnMode': '',
+                 'margin': '', 'imr': '0', 'markPx': _fmt(self.prices[inst_id]), 'uTime': _now_ms()}]
+
+    def get_order(self, ord_id=None, cl_ord_id=None):
+        if not ord_id and cl_ord_id:
+            ord_id = self.cl_ord_ids.get(cl_ord_id)
+        return self.orders.get(ord_id)
+
+    def _notify(self, channel, data):
+        for listener in self.listeners:
+            listener(channel, data)
+
+
+class OKXSimulator:
+    """REST- и WebSocket-сервер поверх SimExchange"""
+
+    def __init__(self, host="127.0.0.1", port=8765, ws_port=8766, latency=0.0, jitter=0.0,
+                 error_rate=0.0, slow_rate=0.0, slow_delay=15.0, rate_limits=True, clock_offset=0.0,
+                 tick_interval=0.1, api_key=None, secret_key=None, passphrase=None, exchange=None):
+        self.host = host
+        self.port = port
+        self.ws_port = ws_port
+        self.latency = latency  # Задержка ответа REST, секунды
+        self.jitter = jitter  # Случайная добавка к задержке (0..jitter), секунды
+        self.error_rate = error_rate  # Доля запросов с ответом 50001
+        self.slow_rate = slow_rate  # Доля запросов, ответ на которые приходит через slow_delay (после исполнения)
+        self.slow_delay = slow_delay
+        self.rate_limits = rate_limits  # Отвечать 50011 при превышении лимитов OKX
+        self.clock_offset = clock_offset  # Смещение часов "биржи" относительно локальных, секунды
+        self.tick_interval = tick_interval
+        self.api_key = api_key  # Если задан секретный ключ - подписи проверяются
+        self.secret_key = secret_key
+        self.passphrase = passphrase
+        self.exchange = exchange or SimExchange()
+        self.exchange.listeners.append(self._on_exchange_event)
+
+        self.requests = 0
+        self.buckets = {}
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._http = None
+        self._loop = None
+        self._ws_server = None
+        self._ws_clients = {}  # соединение -> {'private': bool, 'logged_in': bool, 'subs': set}
+        self._stop = None
+        self._threads = []
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def ws_public_url(self):
+        return f"ws://{self.host}:{self.ws_port}/ws/v5/public"
+
+    @property
+    def ws_private_url(self):
+        return f"ws://{self.host}:{self.ws_port}/ws/v5/private"
+
+    def server_time(self):
+        return time.time() + self.clock_offset
+
+    def start(self):
+        """Запуск REST- и WebSocket-серверов в фоновых потоках"""
+        simulator = self
+
+        class Handler(SimRequestHandler):
+            sim = simulator
+
+        self._http = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._http.daemon_threads = True
+        self.port = self._http.server_address[1]
+
+        ws_ready = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._http.serve_forever, daemon=True),
+            threading.Thread(target=self._ws_main, args=(ws_ready,), daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+        ws_ready.wait(5)
+        return self
+
+    def stop(self):
+        """Остановка серверов"""
+        if self._http:
+            self._http.shutdown()
+            self._http.server_close()
+        if self._loop and self._stop:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        for thread in self._threads:
+            thread.join(timeout=2)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    # ---- REST ----
+
+    def _take_token(self, method, path):
+        group, capacity, period = endpoint_limit(method, path)
+        with self._lock:
+            bucket = self.buckets.get(group)
+            if bucket is None:
+                bucket = self.buckets[group] = TokenBucket(capacity, period)
+            return bucket.try_take() == 0
+
+    def _check_auth(self, headers, method, raw_path, body):
+        timestamp = headers.get('OK-ACCESS-TIMESTAMP')
+        if not headers.get('OK-ACCESS-KEY') or not timestamp:
+            return ('50103', 'Request header OK-ACCESS-KEY can not be empty.')
+        try:
+            ts = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=None)
+            sent = (ts - datetime(1970, 1, 1)).total_seconds()
+        except ValueError:
+            return ('50112', 'Invalid OK-ACCESS-TIMESTAMP')
+        if abs(self.server_time() - sent) > 30:
+            return ERROR_TIMESTAMP
+        if self.secret_key:
+            if headers.get('OK-ACCESS-KEY') != self.api_key or headers.get('OK-ACCESS-PASSPHRASE') != self.passphrase:
+                return ('50111', 'Invalid OK-ACCESS-KEY')
+            if headers.get('OK-ACCESS-SIGN') != _sign(timestamp + method + raw_path + body, self.secret_key):
+                return ERROR_SIGN
+        return None
+
+    def handle(self, method, raw_path, headers, body):
+        """Обработка REST-запроса; возвращает (HTTP-статус, JSON-ответ, задержка перед ответом)"""
+        with self._lock:
+            self.requests += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        url = urlsplit(raw_path)
+        path = url.path
+        params = dict(parse_qsl(url.query)) if method == "GET" else (json.loads(body) if body else {})
+
+        if self.rate_limits and not self._take_token(method, path):
+            return 429, _error(*ERROR_RATE_LIMIT), delay
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 503, _error(*ERROR_UNAVAILABLE), delay
+
+        route = ROUTES.get((method, path))
+        if route is None:
+            return 404, _error('50014', f"Path {path} not found"), delay
+        handler, private = route
+        if private:
+            error = self._check_auth(headers, method, raw_path, body)
+            if error:
+                return 401, _error(*error), delay
+
+        with self.exchange.lock:
+            response = handler(self, params)
+        if self.slow_rate and self._random.random() < self.slow_rate:
+            delay += self.slow_delay
+        return 200, response, delay
+
+    # ---- WebSocket ----
+
+    def _ws_main(self, ready):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._ws_serve(ready))
+        finally:
+            self._loop.close()
+
+    async def _ws_serve(self, ready):
+        self._stop = asyncio.Event()
+        async with websockets.serve(self._ws_handler, self.host, self.ws_port) as server:
+            self.ws_port = server.sockets[0].getsockname()[1]
+            ready.set()
+            ticker = asyncio.ensure_future(self._ws_ticker())
+            await self._stop.wait()
+            ticker.cancel()
+
+    async def _ws_handler(self, ws):
+        client = {'private': ws.request.path.endswith('/private'), 'logged_in': False, 'subs': set()}
+        self._ws_clients[ws] = client
+        try:
+            async for raw in ws:
+                if raw == "ping":
+                    await ws.send("pong")
+                    continue
+                await self._ws_message(ws, client, json.loads(raw))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._ws_clients.pop(ws, None)
+
+    async def _ws_message(self, ws, client, message):
+        op = message.get('op')
+        args = message.get('args', [])
+        if op == 'login':
+            arg = args[0] if args else {}
+            expected = _sign(str(arg.get('timestamp', '')) + "GET/users/self/verify", self.secret_key or '')
+            if self.secret_key and (arg.get('apiKey') != self.api_key or arg.get('sign') != expected):
+                await ws.send(json.dumps({'event': 'error', 'code': '60009', 'msg': 'Login failed.'}))
+                return
+            client['logged_in'] = True
+            await ws.send(json.dumps({'event': 'login', 'code': '0', 'msg': '', 'connId': str(id(ws))}))
+        elif op in ('subscribe', 'unsubscribe'):
+            for arg in args:
+                if client['private'] and not client['logged_in']:
+                    await ws.send(json.dumps({'event': 'error', 'code': '60011', 'msg': 'Please log in.'}))
+                    return
+                key = (arg.get('channel'), arg.get('instId'))
+                if op == 'subscribe':
+                    client['subs'].add(key)
+                else:
+                    client['subs'].discard(key)
+                await ws.send(json.dumps({'event': op, 'arg': arg, 'connId': str(id(ws))}))
+                if op == 'subscribe' and client['private']:
+                    await self._ws_private_snapshot(ws, arg)
+        else:
+            await ws.send(json.dumps({'event': 'error', 'code': '60012', 'msg': f"Invalid request: {message}"}))
+
+    async def _ws_private_snapshot(self, ws, arg):
+        with self.exchange.lock:
+            if arg.get('channel') == 'positions':
+                data = self.exchange.position_rows()
+            elif arg.get('channel') == 'account':
+                data = [self.exchange.balance()]
+            else:
+                return
+        await ws.send(json.dumps({'arg': arg, 'data': data}))
+
+    async def _ws_ticker(self):
+        """Движение цен и рассылка tickers / mark-price / positions"""
+        last_positions_push = 0
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            self.exchange.tick()
+            ts = str(int(self.server_time() * 1000))
+            push_positions = time.monotonic() - last_positions_push >= 1
+            for ws, client in list(self._ws_clients.items()):
+                messages = []
+                with self.exchange.lock:
+                    for channel, inst_id in client['subs']:
+                        if channel == 'tickers' and inst_id in self.exchange.prices:
+                            messages.append({'arg': {'channel': channel, 'instId': inst_id},
+                                             'data': [self.exchange.ticker(inst_id, ts)]})
+                        elif channel == 'mark-price' and inst_id in self.exchange.prices:
+                            messages.append({'arg': {'channel': channel, 'instId': inst_id}, 'data': [{
+                                'instType': 'SWAP', 'instId': inst_id,
+                                'markPx': _fmt(self.exchange.prices[inst_id]), 'ts': ts}]})
+                        elif channel == 'positions' and push_positions and self.exchange.positions:
+                            messages.append({'arg': {'channel': channel, 'instType': 'SWAP'},
+                                             'data': self.exchange.position_rows()})
+                for message in messages:
+                    try:
+                        await ws.send(json.dumps(message))
+                    except websockets.ConnectionClosed:
+                        break
+            if push_positions:
+                last_positions_push = time.monotonic()
+
+    def _on_exchange_event(self, channel, data):
+        # Вызывается из потока REST-обработчика под exchange.lock
+        loop = self._loop
+        if loop is None:
+            return
+        message = json.dumps({'arg': {'channel': channel}, 'data': data})
+        loop.call_soon_threadsafe(self._push_private, channel, message)
+
+    def _push_private(self, channel, message):
+        for ws, client in list(self._ws_clients.items()):
+            if client['private'] and any(sub[0] == channel for sub in client['subs']):
+                asyncio.ensure_future(self._safe_send(ws, message))
+
+    @staticmethod
+    async def _safe_send(ws, message):
+        try:
+            await ws.send(message)
+        except websockets.ConnectionClosed:
+            pass
+
+
+class SimRequestHandler(BaseHTTPRequestHandler):
+    """HTTP-обработчик: передает запрос в OKXSimulator.handle"""
+
+    sim = None
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        status, response, delay = self.sim.handle(method, self.path, self.headers, body)
+        if delay:
+            time.sleep(delay)
+        payload = json.dumps(response).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент не дождался ответа (таймаут) и закрыл соединение
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+# ---- обработчики эндпоинтов (вызываются под exchange.lock) ----
+
+def _instruments(sim, params):
+    inst_id = params.get('instId')
+    data = [inst for inst in sim.exchange.instruments.values() if not inst_id or inst['instId'] == inst_id]
+    return _ok(data)
+
+
+def _time(sim, params):
+    return _ok([{'ts': str(int(sim.server_time() * 1000))}])
+
+
+def _ticker(sim, params):
+    inst_id = params.get('instId')
+    if inst_id not in sim.exchange.prices:
+        return _error('51001', f"Instrument ID {inst_id} does not exist.")
+    return _ok([sim.exchange.ticker(inst_id, str(int(sim.server_time() * 1000)))])
+
+
+def _tickers(sim, params):
+    ts = str(int(sim.server_time() * 1000))
+    return _ok([sim.exchange.ticker(inst_id, ts) for inst_id in sim.exchange.prices])
+
+
+def _account_config(sim, params):
+    return _ok([sim.exchange.account_config()])
+
+
+def _set_position_mode(sim, params):
+    mode = params.get('posMode')
+    if mode not in ('net_mode', 'long_short_mode'):
+        return _error('51000', "Parameter posMode error")
+    if sim.exchange.positions and mode != sim.exchange.pos_mode:
+        return _error('59000', "Settings failed. Close any open positions or orders before changing.")
+    sim.exchange.pos_mode = mode
+    return _ok([{'posMode': mode}])
+
+
+def _leverage_info(sim, params):
+    mgn_mode = params.get('mgnMode', 'cross')
+    data = [{'instId': inst_id, 'mgnMode': mgn_mode, 'posSide': 'net',
+             'lever': _fmt(sim.exchange.get_leverage(inst_id, mgn_mode))}
+            for inst_id in params.get('instId', '').split(',') if inst_id]
+    return _ok(data)
+
+
+def _set_leverage(sim, params):
+    inst_id = params.get('instId')
+    mgn_mode = params.get('mgnMode', 'cross')
+    if inst_id not in sim.exchange.instruments:
+        return _error('51001', f"Instrument ID {inst_id} does not exist.")
+    try:
+        lever = float(params.get('lever'))
+    except (TypeError, ValueError):
+        return _error('51000', "Parameter lever error")
+    if not 1 <= lever <= 100:
+        return _error('59102', "Leverage exceeds the maximum leverage.")
+    sim.exchange.leverage[(inst_id, mgn_mode)] = lever
+    return _ok([{'instId': inst_id, 'lever': _fmt(lever), 'mgnMode': mgn_mode, 'posSide': 'net'}])
+
+
+def _positions(sim, params):
+    return _ok(sim.exchange.position_rows(params.get('instId')))
+
+
+def _balance(sim, params):
+    return _ok([sim.exchange.balance()])
+
+
+def _order(sim, params):
+    reply = sim.exchange.place_order(params)
+    return _orders_response([reply])
+
+
+def _batch_orders(sim, params):
+    if not isinstance(params, list) or not params or len(params) > 20:
+        return _error('51000', "Parameter batch orders error")
+    return _orders_response([sim.exchange.place_order(order) for order in params])
+
+
+def _close_position(sim, params):
+    inst_id = params.get('instId')
+    pos_side = params.get('posSide') or 'net'
+    position = sim.exchange.positions.get((inst_id, pos_side))
+    if position is None:
+        return _error('51023', "Position does not exist.")
+    side = 'sell' if position['pos'] > 0 and pos_side != 'short' else 'buy'
+    reply = sim.exchange.place_order({
+        'instId': inst_id, 'tdMode': params.get('mgnMode', position['mgnMode']), 'side': side,
+        'posSide': pos_side, 'ordType': 'market', 'sz': _fmt(abs(position['pos'])),
+        'reduceOnly': 'true', 'clOrdId': params.get('clOrdId', '')
+    })
+    if reply['sCode'] != '0':
+        return _error(reply['sCode'], reply['sMsg'])
+    return _ok([{'instId': inst_id, 'posSide': pos_side, 'clOrdId': reply['clOrdId']}])
+
+
+def _get_order(sim, params):
+    order = sim.exchange.get_order(params.get('ordId'), params.get('clOrdId'))
+    if order is None or order['instId'] != params.get('instId'):
+        return _error('51603', "Order does not exist")
+    return _ok([order])
+
+
+# (метод, путь) -> (обработчик, требуется подпись)
+ROUTES = {
+    ('GET', '/api/v5/public/instruments'): (_instruments, False),
+    ('GET', '/api/v5/public/time'): (_time, False),
+    ('GET', '/api/v5/market/ticker'): (_ticker, False),
+    ('GET', '/api/v5/market/tickers'): (_tickers, False),
+    ('GET', '/api/v5/account/config'): (_account_config, True),
+    ('POST', '/api/v5/account/set-position-mode'): (_set_position_mode, True),
+    ('GET', '/api/v5/account/leverage-info'): (_leverage_info, True),
+    ('POST', '/api/v5/account/set-leverage'): (_set_leverage, True),
+    ('GET', '/api/v5/account/positions'): (_positions, True),
+    ('GET', '/api/v5/account/balance'): (_balance, True),
+    ('POST', '/api/v5/trade/order'): (_order, True),
+    ('GET', '/api/v5/trade/order'): (_get_order, True),
+    ('POST', '/api/v5/trade/batch-orders'): (_batch_orders, True),
+    ('POST', '/api/v5/trade/close-position'): (_close_position, True),
+}
+
+
+def _ok(data):
+    return {'code': '0', 'msg': '', 'data': data}
+
+
+def _error(code, msg):
+    return {'code': code, 'msg': msg, 'data': []}
+
+
+def _orders_response(replies):
+    failed = sum(1 for reply in replies if reply['sCode'] != '0')
+    if not failed:
+        code, msg = '0', ''
+    elif failed == len(replies):
+        code, msg = '1', 'All operations failed'
+    else:
+        code, msg = '2', 'Bulk operation partially succeeded'
+    now = _now_ms()
+    return {'code': code, 'msg': msg, 'data': replies, 'inTime': now, 'outTime': now}
+
+
+def _sign(message, secret_key):
+    mac = hmac.new(secret_key.encode(), message.encode(), digestmod='sha256')
+    return base64.b64encode(mac.digest()).decode()
+
+
+def _fmt(value):
+    return f"{value:.8f}".rstrip('0').rstrip('.') or '0'
+
+
+def _now_ms():
+    return str(int(time.time() * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный симулятор OKX (REST + WebSocket)")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765, help="порт REST")
+    parser.add_argument('--ws-port', type=int, default=8766, help="порт WebSocket")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа REST, секунды")
+    parser.add_argument('--jitter', type=float, default=0.0, help="случайная добавка к задержке, секунды")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 50001 (0..1)")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="доля ответов с задержкой --slow-delay (0..1)")
+    parser.add_argument('--slow-delay', type=float, default=15.0)
+    parser.add_argument('--no-rate-limits', action='store_true', help="не ограничивать частоту запросов")
+    parser.add_argument('--clock-offset', type=float, default=0.0, help="смещение часов биржи, секунды")
+    parser.add_argument('--pos-mode', default="net_mode", choices=("net_mode", "long_short_mode"))
+    parser.add_argument('--balance', type=float, default=10000.0)
+    parser.add_argument('--extra-instruments', type=int, default=0, help="дополнительные инструменты SIM<N>-USDT-SWAP")
+    parser.add_argument('--config', help="config.json с ключами для проверки подписи")
+    args = parser.parse_args()
+
+    keys = {}
+    if args.config:
+        with open(args.config, 'r') as f:
+            okx = json.load(f)['okx']
+        keys = {'api_key': okx['api_key'], 'secret_key': okx['secret_key'], 'passphrase': okx['passphrase']}
+
+    exchange = SimExchange(extra_instruments=args.extra_instruments, balance=args.balance, pos_mode=args.pos_mode)
+    simulator = OKXSimulator(
+        host=args.host, port=args.port, ws_port=args.ws_port, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, slow_rate=args.slow_rate, slow_delay=args.slow_delay,
+        rate_limits=not args.no_rate_limits, clock_offset=args.clock_offset, exchange=exchange, **keys
+    ).start()
+
+    print(f"🧪 Симулятор OKX запущен")
+    print(f"   REST:      {simulator.base_url}")
+    print(f"   WebSocket: {simulator.ws_public_url}, {simulator.ws_private_url}")
+    print("   Ctrl+C для остановки")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
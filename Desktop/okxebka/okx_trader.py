@@ -1,18 +1,229 @@
+import hashlib
 import json
-import okx.Account as Account
-import okx.Trade as Trade
-import okx.MarketData as MarketData
-import okx.PublicData as PublicData
+import os
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import threading
 import time
+import uuid
+from position_book import PositionBook, normalize_position
+from pnl_engine import PnLEngine
+from latency import LatencyRecorder, instrument_client, timed
+from okx_log import logger, setup_logging
+from rate_limit import RateLimiter, limit_client
+from server_clock import ServerClock
+from host_selector import HEDGE_PATHS, HostSelector
+
+
+# Максимум ордеров в одном запросе /trade/batch-orders
+BATCH_ORDERS_LIMIT = 20
+
+# Ответы, после которых неизвестно, принят ли ордер: сервис недоступен, таймаут эндпоинта, система занята
+AMBIGUOUS_CODES = ('50001', '50004', '50013')
+DUPLICATE_CL_ORD_ID = '51016'
+ORDER_NOT_FOUND = '51603'
+
+# Результат поиска ордера по clOrdId: найден, точно отсутствует (51603), проверить не удалось
+ORDER_FOUND = 'found'
+ORDER_MISSING = 'missing'
+ORDER_UNKNOWN = 'unknown'
+
+# Снимок инструментов, режима позиций и плеча на диске
+SNAPSHOT_VERSION = 2
+SNAPSHOT_INSTRUMENT_FIELDS = ('instId', 'ctVal', 'ctValCcy', 'ctType', 'lotSz', 'minSz', 'tickSz',
+                              'settleCcy', 'quoteCcy', 'lever', 'state')
+
+
+class InstrumentIndex:
+    """
+    Индекс для поиска по мере ввода: отсортированный список всех суффиксов instId.
+    Подстрока запроса находится бинарным поиском по суффиксам, без сети и полного перебора.
+    """
+
+    def __init__(self, instruments):
+        self.by_id = {inst['instId']: inst for inst in instruments}
+        suffixes = []
+        for inst_id in self.by_id:
+            key = inst_id.upper()
+            suffixes.extend((key[i:], inst_id) for i in range(len(key)))
+        suffixes.sort()
+        self.suffixes = suffixes
+        self._last = None  # (запрос, найденные instId) - для сужения результата при наборе
+
+    def matching_ids(self, query):
+        """Все instId, содержащие query как подстроку"""
+        last = self._last
+        if last is not None and query.startswith(last[0]):
+            # Запрос дописан - фильтруем предыдущий результат
+            ids = {inst_id for inst_id in last[1] if query in inst_id.upper()}
+        else:
+            ids = set()
+            suffixes = self.suffixes
+            i = bisect_left(suffixes, (query,))
+            while i < len(suffixes) and suffixes[i][0].startswith(query):
+                ids.add(suffixes[i][1])
+                i += 1
+        self._last = (query, ids)
+        return ids
+
+    def search(self, query, usdt_only=True):
+        """
+        Инструменты по подстроке запроса, по рангу: точное совпадение базовой валюты,
+        базовая валюта начинается с запроса, instId начинается с запроса, остальные;
+        внутри группы USDT-маржинальные первыми
+        """
+        query = query.strip().upper()
+        if not query:
+            return []
+        ranked = []
+        for inst_id in self.matching_ids(query):
+            parts = inst_id.upper().split('-')
+            base, quote = parts[0], parts[1] if len(parts) > 1 else ''
+            if usdt_only and 'USDT' not in inst_id:
+                continue
+            if base == query:
+                rank = 0
+            elif base.startswith(query):
+                rank = 1
+            elif inst_id.upper().startswith(query):
+                rank = 2
+            else:
+                rank = 3
+            ranked.append((rank, quote != 'USDT', inst_id))
+        ranked.sort()
+        return [self.by_id[inst_id] for _, _, inst_id in ranked]
+
+
+class InstrumentRegistry:
+    """Кэш SWAP-инструментов: словарь по instId, индекс по базовой валюте и индекс для поиска"""
+
+    def __init__(self, public_api, ttl=3600):
+        # public_api - клиент PublicAPI или функция, возвращающая его (клиент создается при первой загрузке);
+        # None - кэш заполняется извне через load()
+        self._public_api = public_api
+        self.ttl = ttl  # Время жизни кэша в секундах
+        self.by_id = {}
+        self.by_base = {}
+        self._index = None  # (by_id, InstrumentIndex) - строится при первом поиске
+        self.loaded_at = 0
+        self.listeners = []  # listener() после каждой загрузки списка инструментов
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def add_listener(self, listener):
+        """Подписка на загрузку инструментов (вызывается в потоке загрузки, должна быть быстрой)"""
+        self.listeners.append(listener)
+
+    def is_stale(self):
+        """Кэш пуст или устарел"""
+        return not self.by_id or time.time() - self.loaded_at > self.ttl
+
+    def refresh(self, if_stale=False):
+        """Полная перезагрузка списка SWAP-инструментов с биржи (if_stale - только если кэш устарел)"""
+        with self._lock:
+            # Пока ждали блокировку, кэш мог загрузить другой поток
+            if if_stale and not self.is_stale():
+                return True
+            public_api = self._public_api() if callable(self._public_api) else self._public_api
+            result = public_api.get_instruments(instType="SWAP")
+            if result['code'] != '0':
+                logger.error("Ошибка при получении инструментов: %s", result)
+                return False
+
+            self.load(result['data'])
+            return True
+
+    def load(self, instruments):
+        """Построение словаря и индекса по списку инструментов"""
+        by_id = {}
+        by_base = {}
+        for inst in instruments:
+            inst_id = inst['instId']
+            by_id[inst_id] = inst
+            by_base.setdefault(inst_id.split('-')[0], []).append(inst)
+
+        # Подменяем словари целиком, чтобы читатели не видели частичного состояния
+        self.by_id = by_id
+        self.by_base = by_base
+        self.loaded_at = time.time()
+        for listener in self.listeners:
+            listener()
+
+    @property
+    def index(self):
+        """Индекс для поиска (строится при первом обращении после загрузки)"""
+        by_id = self.by_id
+        cached = self._index
+        if cached is None or cached[0] is not by_id:
+            # Индекс привязан к конкретному словарю: после перезагрузки строится заново
+            cached = self._index = (by_id, InstrumentIndex(list(by_id.values())))
+        return cached[1]
+
+    def ensure_loaded(self):
+        """Загрузка инструментов: пустой кэш - с ожиданием, устаревший - в фоне (до обновления отдаются старые данные)"""
+        if self._public_api is None or not self.is_stale():
+            return
+        if not self.by_id:
+            self.refresh(if_stale=True)
+        else:
+            self.refresh_in_background()
+
+    def refresh_in_background(self):
+        """Загрузка пустого или устаревшего кэша в фоновом потоке (поиск продолжает работать по старому)"""
+        if self._public_api is None or self._refreshing:
+            return
+        self._refreshing = True
+
+        def run():
+            try:
+                # Кэш мог загрузить другой поток (сверка снимка), пока ждали блокировку
+                self.refresh(if_stale=True)
+            except Exception as e:
+                logger.error("Ошибка обновления инструментов: %s", e)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get(self, inst_id):
+        """Данные инструмента по instId (при промахе кэш перезагружается один раз)"""
+        self.ensure_loaded()
+        inst = self.by_id.get(inst_id)
+        if inst is None and self._public_api is not None and time.time() - self.loaded_at > 60:
+            # Инструмент мог появиться после загрузки кэша
+            self.refresh()
+            inst = self.by_id.get(inst_id)
+        return inst
+
+    def get_by_base(self, base_ccy):
+        """Все инструменты с указанной базовой валютой"""
+        self.ensure_loaded()
+        return list(self.by_base.get(base_ccy.upper(), []))
+
+    def search(self, symbol, usdt_only=True):
+        """
+        Поиск инструментов по подстроке в памяти (подходит для поиска на каждое нажатие клавиши).
+        Запросов к сети и ожидания нет: пустой или устаревший кэш загружается в фоне,
+        пока кэш пуст, результат пустой (см. add_listener - повтор поиска после загрузки).
+        """
+        if self.is_stale():
+            self.refresh_in_background()
+        if not self.by_id:
+            return []
+        return self.index.search(symbol, usdt_only)
 
 
 class OKXTrader:
     def __init__(self, config_file="config.json"):
         """Инициализация трейдера с настройками из конфигурационного файла"""
+        started = time.perf_counter()
         with open(config_file, 'r') as f:
             self.config = json.load(f)
         
+        # Логирование через фоновый поток (файл с ротацией, консоль, панель логов GUI)
+        setup_logging(self.config.get('logging'))
+        
         # API ключи
         self.api_key = self.config['okx']['api_key']
         self.secret_key = self.config['okx']['secret_key']
@@ -21,78 +232,427 @@ class OKXTrader:
         # Флаг торговли: 0 - реальная торговля, 1 - демо
         self.flag = "0"  # Реальная торговля
         
-        # Инициализация API клиентов
-        self.account_api = Account.AccountAPI(self.api_key, self.secret_key, self.passphrase, False, self.flag)
-        self.trade_api = Trade.TradeAPI(self.api_key, self.secret_key, self.passphrase, False, self.flag)
-        self.market_api = MarketData.MarketAPI(flag=self.flag)
-        self.public_api = PublicData.PublicAPI(flag=self.flag)
+        # Адрес REST API (можно указать локальный симулятор, см. okx_simulator.py)
+        self.base_url = self.config['okx'].get('base_url', "https://www.okx.com")
+        
+        # Замеры задержек по этапам ордера и по эндпоинтам (и этапам запуска: startup:*)
+        self.latency = LatencyRecorder()
+        # Общий лимит запросов по группам эндпоинтов: ордера идут вне очереди
+        self.rate_limiter = RateLimiter(recorder=self.latency, enabled=self.config.get('client_rate_limit', True))
+        
+        # API клиенты создаются при первом обращении (см. account_api, trade_api, market_api, public_api)
+        self._clients = {}
+        self._clients_lock = threading.RLock()
+        
+        # Общая HTTP/2 сессия с пулом keep-alive соединений для всех клиентов (см. http_session)
+        self.http_config = self.config.get('http', {})
+        # Равнозначные хосты API: запросы идут на самый быстрый по фоновым замерам (см. _sync_clock)
+        self.hosts = HostSelector(self.config['okx'].get('base_urls') or [self.base_url],
+                                  hedge=self.http_config.get('hedge', False),
+                                  hedge_paths=self.http_config.get('hedge_paths', HEDGE_PATHS))
+        self._http_session = None
+        self._closed = threading.Event()
+        
+        # Смещение часов сервера для подписи запросов и RTT до биржи (по public/time)
+        self.clock = ServerClock(fetch=lambda: self.public_api.get_system_time())
+        
+        # Кэш инструментов (загружается один раз, обновляется по TTL)
+        self.instruments = InstrumentRegistry(lambda: self.public_api, self.config.get('instruments_ttl', 3600))
+        
+        # Кэш конфигурации аккаунта (нужен для определения posSide без запроса к API)
+        self.account_config = None
+        
+        # Текущее плечо по (instId, mgnMode), чтобы не переустанавливать то же значение
+        self.leverage = {}
+        
+        # Снимок с диска: инструменты и режим позиций сразу, сверка с биржей и запись снимка - в фоне
+        # (без снимка конфигурация аккаунта загружается там же или при первом ордере)
+        self.snapshot_file = self.config.get('snapshot_file', "okx_snapshot.json")
+        self._snapshot_leverage = []  # (instId, mgnMode, плечо) из снимка, ждут сверки
+        with self.latency.span("startup:snapshot"):
+            self.load_snapshot()
+        self.snapshot_thread = threading.Thread(target=self.revalidate_snapshot, daemon=True)
+        self.snapshot_thread.start()
+        
+        # WebSocket-фид цен (опционально, см. start_market_feed)
+        self.market_feed = None
+        
+        # Книга позиций: приватный WebSocket (см. start_private_feed) + сверка через REST
+        self.position_book = PositionBook()
+        # Локальный PnL по тикам mark-price из WebSocket-фида цен
+        self.pnl = PnLEngine(self.position_book, self.contract_value, self.config.get('price_stale_after', 5.0))
+        self.private_feed = None
+        self.last_positions_sync = 0
+        
+        # Синхронизация с часами сервера; повторные замеры заодно не дают соединению закрыться по простою
+        self.clock_thread = threading.Thread(target=self._sync_clock, daemon=True)
+        self.clock_thread.start()
+        
+        self.latency.record("startup:init", time.perf_counter() - started)
+        
+    @property
+    def account_api(self):
+        return self._client('account_api')
+    
+    @property
+    def trade_api(self):
+        return self._client('trade_api')
+    
+    @property
+    def market_api(self):
+        return self._client('market_api')
+    
+    @property
+    def public_api(self):
+        return self._client('public_api')
+    
+    def _client(self, name):
+        """Клиент python-okx по имени; создается при первом обращении (импорт SDK - тоже)"""
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._clients_lock:
+            client = self._clients.get(name)
+            if client is None:
+                from okx_http import share_session
+                with self.latency.span(f"startup:client:{name}"):
+                    client = self._create_client(name)
+                    # Для ордеров - короткий таймаут: ордер проверяется по clOrdId и сразу отправляется повторно
+                    timeout = self.http_config.get('order_timeout', 3.0) if name == 'trade_api' else None
+                    share_session(client, self.http_session, self.clock, timeout,
+                                  self.hosts if len(self.hosts.hosts) > 1 else None)
+                    instrument_client(client, self.latency)
+                    limit_client(client, self.rate_limiter)
+                self._clients[name] = client
+            return client
+    
+    @property
+    def http_session(self):
+        """Общий HTTP/2 клиент: один пул соединений на REST-запросы всех клиентов python-okx"""
+        with self._clients_lock:
+            if self._http_session is None:
+                from okx_http import create_client  # httpx импортируется при первом запросе
+                self._http_session = create_client(
+                    self.base_url,
+                    max_connections=self.http_config.get('max_connections', 10),
+                    timeout=self.http_config.get('timeout', 10.0),
+                    keepalive_expiry=self.http_config.get('keepalive_expiry', 60.0)
+                )
+            return self._http_session
+    
+    def _sync_clock(self):
+        """
+        Замер RTT каждого хоста и смещения часов сервера по public/time при запуске
+        и затем раз в keepalive_interval секунд (0 - только при запуске)
+        """
+        interval = self.http_config.get('keepalive_interval', 15)
+        session = self.http_session
+        while True:
+            for host in self.hosts.hosts:
+                try:
+                    rtt = self.clock.sample(lambda: session.get(host + "/api/v5/public/time").json())
+                    self.hosts.update(host, rtt)
+                    self.latency.record(f"clock:rtt:{host}", rtt)
+                except Exception as e:
+                    self.hosts.fail(host)
+                    logger.debug("Ошибка замера времени сервера %s: %s", host, e)
+            logger.debug("Часы сервера: смещение %.1f мс, самый быстрый хост %s",
+                         self.clock.offset * 1000, self.hosts.best)
+            if not interval or self._closed.wait(interval):
+                return
+    
+    def close(self):
+        """Остановка синхронизации часов и закрытие общей HTTP сессии"""
+        self._closed.set()
+        self.hosts.close()
+        with self._clients_lock:
+            if self._http_session is not None:
+                self._http_session.close()
+    
+    def _create_client(self, name):
+        if name == 'account_api':
+            import okx.Account as Account
+            return Account.AccountAPI(self.api_key, self.secret_key, self.passphrase, False, self.flag,
+                                      domain=self.base_url)
+        if name == 'trade_api':
+            import okx.Trade as Trade
+            return Trade.TradeAPI(self.api_key, self.secret_key, self.passphrase, False, self.flag,
+                                  domain=self.base_url)
+        if name == 'market_api':
+            import okx.MarketData as MarketData
+            return MarketData.MarketAPI(flag=self.flag, domain=self.base_url)
+        if name == 'public_api':
+            import okx.PublicData as PublicData
+            return PublicData.PublicAPI(flag=self.flag, domain=self.base_url)
+        raise ValueError(f"Неизвестный клиент: {name}")
+    
+    def start_market_feed(self):
+        """Запуск WebSocket-фида цен, если он не отключен в конфигурации"""
+        if self.market_feed is not None or not self.config.get('use_websocket', True):
+            return self.market_feed
+        try:
+            from okx_ws import OKXPublicFeed, PUBLIC_WS_URL
+            self.market_feed = OKXPublicFeed(
+                url=self.config['okx'].get('ws_public_url', PUBLIC_WS_URL),
+                stale_after=self.config.get('price_stale_after', 5.0),
+                on_mark_price=self.pnl.update_mark
+            )
+            self.market_feed.start()
+        except Exception as e:
+            logger.error("Не удалось запустить WebSocket-фид цен: %s", e)
+            self.market_feed = None
+        return self.market_feed
+    
+    def stop_market_feed(self):
+        """Остановка WebSocket-фида цен"""
+        if self.market_feed is not None:
+            self.market_feed.stop()
+            self.market_feed = None
+        
+    def start_private_feed(self):
+        """Запуск приватного WebSocket (позиции, баланс, ордера), если он не отключен в конфигурации"""
+        if self.private_feed is not None or not self.config.get('use_websocket', True):
+            return self.private_feed
+        try:
+            from okx_ws import OKXPrivateFeed, PRIVATE_WS_URL
+            self.private_feed = OKXPrivateFeed(
+                self.api_key, self.secret_key, self.passphrase,
+                book=self.position_book, clock=self.clock,
+                url=self.config['okx'].get('ws_private_url', PRIVATE_WS_URL)
+            )
+            self.private_feed.start()
+        except Exception as e:
+            logger.error("Не удалось запустить приватный WebSocket: %s", e)
+            self.private_feed = None
+        return self.private_feed
+    
+    def stop_private_feed(self):
+        """Остановка приватного WebSocket"""
+        if self.private_feed is not None:
+            self.private_feed.stop()
+            self.private_feed = None
+        
+    def latency_report(self):
+        """Отчет по задержкам: p50/p95/p99 по этапам (stage:) и эндпоинтам (endpoint:)"""
+        return self.latency.report()
+    
+    def startup_report(self):
+        """Отчет о времени запуска (startup:): создание трейдера, снимок, клиенты SDK, окно GUI"""
+        stats = self.latency.stats()
+        return [f"{name}: {stats[name]['max']:.0f}ms" for name in sorted(stats) if name.startswith("startup:")]
+        
+    def _snapshot_owner(self):
+        # Снимок привязан к адресу API и аккаунту (сам ключ не сохраняется)
+        return hashlib.sha256(f"{self.base_url}|{self.api_key}".encode()).hexdigest()[:16]
+    
+    def load_snapshot(self):
+        """
+        Загрузка снимка с диска. Инструменты и режим позиций используются сразу;
+        плечо из снимка применяется только после сверки с биржей (revalidate_snapshot),
+        чтобы ордер не ушел с чужим плечом.
+        """
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return False
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('owner') != self._snapshot_owner():
+                return False
+            self.instruments.load(snapshot['instruments'])
+            if snapshot.get('pos_mode'):
+                self.account_config = {'posMode': snapshot['pos_mode']}
+            self._snapshot_leverage = [tuple(item) for item in snapshot.get('leverage', [])]
+            logger.info("Снимок загружен: %s инструментов", len(snapshot['instruments']))
+            return True
+        except Exception as e:
+            logger.warning("Не удалось загрузить снимок %s: %s", self.snapshot_file, e)
+            return False
+    
+    def save_snapshot(self):
+        """Запись снимка инструментов, режима позиций и плеча на диск (атомарно).
+        Из конфигурации аккаунта сохраняется только posMode - uid, права ключа и прочее на диск не попадают."""
+        if not self.snapshot_file or not self.instruments.by_id:
+            return False
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'owner': self._snapshot_owner(),
+            'saved_at': time.time(),
+            'instruments': [{field: inst[field] for field in SNAPSHOT_INSTRUMENT_FIELDS if field in inst}
+                            for inst in self.instruments.by_id.values()],
+            'pos_mode': (self.account_config or {}).get('posMode'),
+            'leverage': [[inst_id, mgn_mode, lever] for (inst_id, mgn_mode), lever in list(self.leverage.items())]
+        }
+        try:
+            tmp_file = self.snapshot_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(tmp_file, self.snapshot_file)
+            return True
+        except Exception as e:
+            logger.warning("Не удалось сохранить снимок %s: %s", self.snapshot_file, e)
+            return False
+    
+    def revalidate_snapshot(self):
+        """Сверка снимка с биржей: инструменты, конфигурация аккаунта, плечо; затем запись нового снимка"""
+        try:
+            self.refresh_instruments()
+            self.get_account_config(refresh=True)
+            
+            # Плечо из снимка перечитываем пачками по 20 инструментов на режим маржи
+            by_mode = {}
+            for inst_id, mgn_mode, _ in self._snapshot_leverage:
+                if (inst_id, mgn_mode) not in self.leverage:
+                    by_mode.setdefault(mgn_mode, []).append(inst_id)
+            for mgn_mode, inst_ids in by_mode.items():
+                for i in range(0, len(inst_ids), 20):
+                    self.get_leverage_info(",".join(inst_ids[i:i + 20]), mgn_mode, refresh=True)
+            self._snapshot_leverage = []
+            
+            self.save_snapshot()
+        except Exception as e:
+            logger.error("Ошибка сверки снимка: %s", e)
+    
+    def refresh_instruments(self):
+        """Принудительное обновление кэша инструментов"""
+        try:
+            return self.instruments.refresh()
+        except Exception as e:
+            logger.error("Ошибка обновления инструментов: %s", e)
+            return False
         
     def search_futures_pair(self, symbol):
         """Поиск фьючерсной пары по символу (например SOL -> SOL-USDT-SWAP)"""
         try:
-            result = self.public_api.get_instruments(instType="SWAP")
-            if result['code'] == '0':
-                instruments = result['data']
-                
-                # Поиск подходящих пар
-                found_pairs = []
-                for inst in instruments:
-                    inst_id = inst['instId']
-                    if symbol.upper() in inst_id and 'USDT' in inst_id:
-                        found_pairs.append({
-                            'instId': inst_id,
-                            'baseCcy': inst['ctVal'],
-                            'quoteCcy': inst['quoteCcy'],
-                            'tickSz': inst['tickSz'],
-                            'lotSz': inst['lotSz']
-                        })
-                
-                return found_pairs
-            else:
-                print(f"Ошибка при получении инструментов: {result}")
-                return []
+            found_pairs = []
+            for inst in self.instruments.search(symbol):
+                found_pairs.append({
+                    'instId': inst['instId'],
+                    'baseCcy': inst['ctVal'],
+                    'quoteCcy': inst['quoteCcy'],
+                    'tickSz': inst['tickSz'],
+                    'lotSz': inst['lotSz']
+                })
+            return found_pairs
         except Exception as e:
-            print(f"Ошибка поиска пары: {e}")
+            logger.error("Ошибка поиска пары: %s", e)
             return []
     
+    @timed("get_current_price")
     def get_current_price(self, inst_id):
-        """Получение текущей цены инструмента"""
+        """Получение текущей цены инструмента (из WebSocket-фида, REST - если цена устарела)"""
+        feed = self.market_feed
+        if feed is not None:
+            price = feed.get_price(inst_id)
+            if price is not None:
+                return price
+            feed.subscribe([inst_id])
         try:
             result = self.market_api.get_ticker(instId=inst_id)
             if result['code'] == '0' and result['data']:
-                return float(result['data'][0]['last'])
+                price = float(result['data'][0]['last'])
+                if feed is not None:
+                    feed.update_price(inst_id, last=price)
+                return price
             return None
         except Exception as e:
-            print(f"Ошибка получения цены: {e}")
+            logger.error("Ошибка получения цены: %s", e)
             return None
     
-    def get_account_config(self):
-        """Получение конфигурации аккаунта"""
+    @timed("get_prices")
+    def get_prices(self, inst_ids):
+        """Текущие цены нескольких инструментов: из WebSocket-фида, недостающие - одним запросом get_tickers"""
+        prices = {}
+        feed = self.market_feed
+        if feed is not None:
+            for inst_id in inst_ids:
+                price = feed.get_price(inst_id)
+                if price is not None:
+                    prices[inst_id] = price
+            
+        missing = set(inst_ids) - set(prices)
+        if not missing:
+            return prices
+        try:
+            result = self.market_api.get_tickers(instType="SWAP")
+            if result['code'] == '0':
+                for ticker in result['data']:
+                    if ticker['instId'] in missing:
+                        prices[ticker['instId']] = float(ticker['last'])
+                        if feed is not None:
+                            feed.update_price(ticker['instId'], last=prices[ticker['instId']])
+            else:
+                logger.error("Ошибка получения цен: %s", result)
+        except Exception as e:
+            logger.error("Ошибка получения цен: %s", e)
+        if feed is not None:
+            feed.subscribe(list(missing))
+        return prices
+    
+    @timed("get_account_config")
+    def get_account_config(self, refresh=False):
+        """Получение конфигурации аккаунта (из кэша, если она уже загружена)"""
+        if self.account_config is not None and not refresh:
+            return self.account_config
         try:
             result = self.account_api.get_account_config()
             if result['code'] == '0':
-                return result['data'][0]
+                self.account_config = result['data'][0]
+                return self.account_config
             return None
         except Exception as e:
-            print(f"Ошибка получения конфигурации: {e}")
+            logger.error("Ошибка получения конфигурации: %s", e)
             return None
     
+    def invalidate_account_config(self):
+        """Сброс кэша конфигурации аккаунта (перечитается при следующем обращении)"""
+        self.account_config = None
+    
+    def get_position_mode(self):
+        """Режим позиций аккаунта из кэша конфигурации (net_mode / long_short_mode)"""
+        config = self.get_account_config()
+        if config and 'posMode' in config:
+            return config['posMode']
+        return None
+    
     def set_position_mode(self, mode="net_mode"):
         """Установка режима позиций"""
         try:
             result = self.account_api.set_position_mode(posMode=mode)
             if result['code'] == '0':
-                print(f"Режим позиций установлен: {mode}")
+                logger.info("Режим позиций установлен: %s", mode)
+                if self.account_config is not None:
+                    self.account_config = dict(self.account_config, posMode=mode)
                 return True
             else:
-                print(f"Ошибка установки режима позиций: {result}")
+                logger.error("Ошибка установки режима позиций: %s", result)
                 return False
         except Exception as e:
-            print(f"Ошибка установки режима позиций: {e}")
+            logger.error("Ошибка установки режима позиций: %s", e)
             return False
 
-    def set_leverage(self, inst_id, leverage, margin_mode="cross"):
-        """Установка плеча для инструмента"""
+    def get_leverage_info(self, inst_id, margin_mode="cross", refresh=False):
+        """Текущее плечо инструмента (из кэша или с биржи)"""
+        key = (inst_id, margin_mode)
+        if key in self.leverage and not refresh:
+            return self.leverage[key]
+        try:
+            result = self.account_api.get_leverage(mgnMode=margin_mode, instId=inst_id)
+            if result['code'] == '0':
+                for item in result['data']:
+                    self.leverage[(item['instId'], item['mgnMode'])] = float(item['lever'])
+                return self.leverage.get(key)
+            logger.error("Ошибка получения плеча: %s", result)
+            return None
+        except Exception as e:
+            logger.error("Ошибка получения плеча: %s", e)
+            return None
+
+    @timed("set_leverage")
+    def set_leverage(self, inst_id, leverage, margin_mode="cross", force=False):
+        """Установка плеча для инструмента (запрос отправляется, только если плечо меняется)"""
+        key = (inst_id, margin_mode)
+        if not force and self.leverage.get(key) == float(leverage):
+            return True
         try:
             result = self.account_api.set_leverage(
                 instId=inst_id,
@@ -100,15 +660,19 @@ class OKXTrader:
                 mgnMode=margin_mode
             )
             if result['code'] == '0':
-                print(f"Плечо {leverage}x установлено для {inst_id}")
+                logger.info("Плечо %sx установлено для %s", leverage, inst_id)
+                self.leverage[key] = float(leverage)
                 return True
             else:
-                print(f"Ошибка установки плеча: {result}")
+                logger.error("Ошибка установки плеча: %s", result)
+                self.leverage.pop(key, None)
                 return False
         except Exception as e:
-            print(f"Ошибка установки плеча: {e}")
+            logger.error("Ошибка установки плеча: %s", e)
+            self.leverage.pop(key, None)
             return False
     
+    @timed("calculate_position_size")
     def calculate_position_size(self, inst_id, usd_amount, leverage, current_price):
         """
         Расчет размера позиции в контрактах
@@ -116,41 +680,28 @@ class OKXTrader:
         leverage - плечо, которое умножает позицию
         """
         try:
-            # Получаем информацию об инструменте
-            result = self.public_api.get_instruments(instType="SWAP", instId=inst_id)
-            print(f"Информация об инструменте: {result}")
+            # Информация об инструменте из кэша
+            inst_info = self.instruments.get(inst_id)
             
-            if result['code'] == '0' and result['data']:
-                inst_info = result['data'][0]
+            if inst_info:
                 ct_val = float(inst_info['ctVal'])  # Размер контракта (обычно 1 для большинства пар)
                 lot_sz = float(inst_info['lotSz'])  # Минимальный размер лота
                 
-                print(f"ctVal: {ct_val}, lotSz: {lot_sz}, цена: {current_price}")
-                print(f"Маржа: ${usd_amount}, Плечо: {leverage}x")
-                
-                # usd_amount это маржа (собственные средства)
-                # Полная стоимость позиции = маржа * плечо
-                total_position_value = usd_amount * leverage
-                
-                # Для SWAP контрактов количество = полная стоимость / цена
-                contracts = total_position_value / current_price
-                
-                # Округляем до минимального размера лота
-                contracts = max(lot_sz, round(contracts / lot_sz) * lot_sz)
-                
-                print(f"Полная стоимость позиции: ${total_position_value:.2f}")
-                print(f"Количество контрактов (базовая валюта): {contracts}")
+                contracts = contracts_for_margin(usd_amount, leverage, current_price, lot_sz)
+                logger.debug("Размер позиции рассчитан", extra={'fields': {
+                    'instId': inst_id, 'ctVal': ct_val, 'lotSz': lot_sz, 'price': current_price,
+                    'margin': usd_amount, 'leverage': leverage, 'contracts': contracts
+                }})
                 
                 return str(contracts)
             else:
-                print(f"Ошибка получения данных инструмента: {result}")
+                logger.warning("Инструмент не найден: %s", inst_id)
                 return None
         except Exception as e:
-            print(f"Ошибка расчета размера позиции: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Ошибка расчета размера позиции: %s", e)
             return None
     
+    @timed("place_market_order")
     def place_market_order(self, inst_id, side, size, leverage=None, margin_mode="cross"):
         """Размещение рыночного ордера"""
         try:
@@ -158,51 +709,43 @@ class OKXTrader:
             if leverage:
                 self.set_leverage(inst_id, leverage, margin_mode)
             
-            # Получаем конфигурацию аккаунта для определения режима позиций
-            config = self.get_account_config()
-            print(f"Конфигурация аккаунта: {config}")
+            # Режим позиций из кэша конфигурации аккаунта
+            pos_mode = self.get_position_mode()
             
             # Определяем правильный posSide в зависимости от режима
-            if config and 'posMode' in config:
-                pos_mode = config['posMode']
-                print(f"Режим позиций: {pos_mode}")
-                
-                if pos_mode == 'net_mode':
-                    pos_side = "net"
-                else:  # long_short_mode
-                    pos_side = "long" if side == "buy" else "short"
-            else:
-                # По умолчанию пробуем net режим
-                pos_side = "net"
-                
-            print(f"Используем posSide: {pos_side}")
+            pos_side = open_pos_side(pos_mode, side)
             
             # Размещение ордера с правильным posSide
-            result = self.trade_api.place_order(
-                instId=inst_id,
-                tdMode=margin_mode,
-                side=side,
-                posSide=pos_side,
-                ordType="market",
-                sz=size
-            )
+            order = {
+                'instId': inst_id,
+                'tdMode': margin_mode,
+                'side': side,
+                'posSide': pos_side,
+                'ordType': "market",
+                'sz': size
+            }
+            result = self._place_order(order)
             
-            # Если все еще ошибка posSide, пробуем переключить режим и повторить
+            # Ошибка posSide: режим в кэше (или снимке) мог устареть - перечитываем его с биржи.
+            # clOrdId тот же: если первый ордер все же был принят, повтор не откроет вторую позицию
             if result['code'] != '0' and 'posSide' in str(result):
-                print("Ошибка posSide, пробуем переключить в net_mode...")
-                if self.set_position_mode("net_mode"):
-                    result = self.trade_api.place_order(
-                        instId=inst_id,
-                        tdMode=margin_mode,
-                        side=side,
-                        posSide="net",
-                        ordType="market",
-                        sz=size
-                    )
+                config = self.get_account_config(refresh=True)
+                fresh_mode = config.get('posMode') if config else None
+                fresh_side = open_pos_side(fresh_mode, side)
+                if fresh_mode is not None and fresh_side != pos_side:
+                    logger.warning("Режим позиций изменился (%s), повтор с posSide=%s", fresh_mode, fresh_side)
+                    result = self._place_order(dict(order, posSide=fresh_side))
+                elif fresh_mode is not None and fresh_mode != "net_mode":
+                    # Режим подтвержден биржей, но posSide все равно не принят - переключаем в net_mode
+                    logger.warning("Ошибка posSide в режиме %s, пробуем переключить в net_mode...", fresh_mode)
+                    if self.set_position_mode("net_mode"):
+                        result = self._place_order(dict(order, posSide="net"))
             
             if result['code'] == '0':
                 order_id = result['data'][0]['ordId']
-                print(f"Ордер успешно размещен! ID: {order_id}")
+                logger.info("Ордер успешно размещен! ID: %s", order_id, extra={'fields': {
+                    'instId': inst_id, 'side': side, 'sz': size, 'leverage': leverage
+                }})
                 return {
                     'success': True,
                     'order_id': order_id,
@@ -210,18 +753,117 @@ class OKXTrader:
                 }
             else:
                 error_msg = result['data'][0]['sMsg'] if result['data'] else result['msg']
-                print(f"Ошибка размещения ордера: {error_msg}")
+                logger.error("Ошибка размещения ордера: %s", error_msg)
                 return {
                     'success': False,
                     'error': error_msg
                 }
         except Exception as e:
-            print(f"Ошибка размещения ордера: {e}")
+            logger.error("Ошибка размещения ордера: %s", e)
             return {
                 'success': False,
                 'error': str(e)
             }
     
+    @timed("place_prepared_order")
+    def place_prepared_order(self, inst_id, side, size, pos_side, margin_mode="cross"):
+        """Рыночный ордер с заранее известными размером и posSide - ровно один запрос place_order"""
+        try:
+            result = self._place_order({
+                'instId': inst_id,
+                'tdMode': margin_mode,
+                'side': side,
+                'posSide': pos_side,
+                'ordType': "market",
+                'sz': size
+            })
+            if result['code'] == '0':
+                return {
+                    'success': True,
+                    'order_id': result['data'][0]['ordId'],
+                    'data': result['data'][0]
+                }
+            if 'posSide' in str(result):
+                self.invalidate_account_config()
+            error_msg = result['data'][0]['sMsg'] if result['data'] else result['msg']
+            logger.error("Ошибка размещения ордера: %s", error_msg)
+            return {'success': False, 'error': error_msg}
+        except Exception as e:
+            logger.error("Ошибка размещения ордера: %s", e)
+            return {'success': False, 'error': str(e)}
+    
+    @timed("place_market_orders")
+    def place_market_orders(self, orders, margin_mode="cross"):
+        """
+        Размещение корзины рыночных ордеров через /trade/batch-orders (до 20 ордеров в запросе).
+        orders - список словарей: inst_id, side и либо size (в контрактах),
+        либо usd_amount (маржа) + leverage; опционально margin_mode.
+        Возвращает результат по каждому ордеру в том же порядке.
+        """
+        results = [None] * len(orders)
+        try:
+            # Цены нужны только ногам, которые рассчитываются по марже
+            priced = [order['inst_id'] for order in orders if not order.get('size')]
+            prices = self.get_prices(priced) if priced else {}
+            
+            # Плечо устанавливается параллельно и только там, где оно меняется
+            levers = {(order['inst_id'], order.get('margin_mode', margin_mode)): order['leverage']
+                      for order in orders if order.get('leverage')}
+            changed = [(key, lever) for key, lever in levers.items() if self.leverage.get(key) != float(lever)]
+            if changed:
+                with ThreadPoolExecutor(max_workers=min(len(changed), 8)) as pool:
+                    list(pool.map(lambda item: self.set_leverage(item[0][0], item[1], item[0][1]), changed))
+            
+            pos_mode = self.get_position_mode()
+            batch = []
+            batch_index = []
+            for i, order in enumerate(orders):
+                inst_id = order['inst_id']
+                size = order.get('size')
+                if not size:
+                    inst_info = self.instruments.get(inst_id)
+                    price = prices.get(inst_id)
+                    if not inst_info or not price:
+                        results[i] = {'instId': inst_id, 'success': False,
+                                      'error': 'Нет данных инструмента или цены'}
+                        continue
+                    size = str(contracts_for_margin(order['usd_amount'], order['leverage'],
+                                                    price, float(inst_info['lotSz'])))
+                batch.append({
+                    'instId': inst_id,
+                    'tdMode': order.get('margin_mode', margin_mode),
+                    'side': order['side'],
+                    'posSide': open_pos_side(pos_mode, order['side']),
+                    'ordType': "market",
+                    'sz': size,
+                    'clOrdId': new_cl_ord_id()
+                })
+                batch_index.append(i)
+            
+            replies = self._send_batch_orders(batch) if batch else []
+            for i, leg, reply in zip(batch_index, batch, replies):
+                success = reply.get('sCode') == '0'
+                results[i] = {
+                    'instId': leg['instId'],
+                    'success': success,
+                    'order_id': reply.get('ordId', ''),
+                    'size': leg['sz'],
+                    'error': '' if success else reply.get('sMsg', '')
+                }
+            return results
+        except Exception as e:
+            logger.error("Ошибка размещения корзины ордеров: %s", e)
+            return [result or {'instId': order['inst_id'], 'success': False, 'error': str(e)}
+                    for order, result in zip(orders, results)]
+    
+    def contract_value(self, inst_id):
+        """Размер линейного контракта (ctVal) или None - PnL такой позиции берется из REST"""
+        inst = self.instruments.get(inst_id)
+        if inst is None or inst.get('ctType', 'linear') != 'linear':
+            return None
+        return float(inst['ctVal'])
+    
+    @timed("get_positions")
     def get_positions(self):
         """Получение всех открытых позиций"""
         try:
@@ -229,26 +871,38 @@ class OKXTrader:
             if result['code'] == '0':
                 positions = []
                 for pos in result['data']:
+                    # Плечо из позиций держим в кэше актуальным
+                    if pos.get('lever') and pos.get('mgnMode'):
+                        self.leverage[(pos['instId'], pos['mgnMode'])] = float(pos['lever'])
                     if float(pos['pos']) != 0:  # Только открытые позиции
-                        positions.append({
-                            'instId': pos['instId'],
-                            'posSide': pos['posSide'],
-                            'pos': pos['pos'],
-                            'avgPx': pos['avgPx'],
-                            'upl': pos['upl'],
-                            'uplRatio': pos['uplRatio'],
-                            'notionalUsd': pos['notionalUsd'],
-                            'lever': pos['lever'],
-                            'markPx': pos['markPx']
-                        })
+                        positions.append(normalize_position(pos))
+                self.position_book.apply_snapshot(positions)
+                self.last_positions_sync = time.time()
+                if self.market_feed is not None:
+                    # Держим цены открытых позиций в подписке
+                    self.market_feed.subscribe([pos['instId'] for pos in positions])
                 return positions
             else:
-                print(f"Ошибка получения позиций: {result}")
+                logger.error("Ошибка получения позиций: %s", result)
                 return []
         except Exception as e:
-            print(f"Ошибка получения позиций: {e}")
+            logger.error("Ошибка получения позиций: %s", e)
             return []
     
+    def reconcile_positions(self):
+        """Сверка книги позиций через REST, если с последней сверки прошло достаточно времени.
+        Пока приватный WebSocket не работает, сверка идет с интервалом опроса (2 секунды)."""
+        feed = self.private_feed
+        if feed is not None and feed.is_live():
+            interval = self.config.get('positions_reconcile_interval', 30)
+        else:
+            interval = 2
+        if time.time() - self.last_positions_sync >= interval:
+            self.get_positions()
+        elif self.market_feed is not None:
+            self.market_feed.subscribe([pos['instId'] for pos in self.position_book.get_positions()])
+        return self.position_book.get_positions()
+    
     def get_account_balance(self):
         """Получение баланса аккаунта"""
         try:
@@ -257,9 +911,10 @@ class OKXTrader:
                 return result['data'][0]
             return None
         except Exception as e:
-            print(f"Ошибка получения баланса: {e}")
+            logger.error("Ошибка получения баланса: %s", e)
             return None
     
+    @timed("close_position")
     def close_position(self, inst_id, size):
         """Закрытие позиции"""
         try:
@@ -275,81 +930,168 @@ class OKXTrader:
             if not current_position:
                 return {'success': False, 'error': 'Позиция не найдена'}
             
-            # Получаем конфигурацию аккаунта для определения режима позиций
-            config = self.get_account_config()
-            print(f"Конфигурация аккаунта для закрытия: {config}")
+            # Режим позиций из кэша конфигурации аккаунта
+            pos_mode = self.get_position_mode()
             
-            # Определяем сторону для закрытия
-            current_pos = float(current_position['pos'])
-            current_pos_side = current_position['posSide']
-            
-            # В зависимости от режима позиций определяем параметры
-            if config and 'posMode' in config:
-                pos_mode = config['posMode']
-                print(f"Режим позиций: {pos_mode}")
-                
-                if pos_mode == 'net_mode':
-                    # В net режиме противоположная сторона
-                    side = "sell" if current_pos > 0 else "buy"
-                    pos_side = "net"
-                else:  # long_short_mode
-                    # В long/short режиме закрываем используя противоположную сторону но тот же posSide
-                    if current_pos_side == "long":
-                        side = "sell"
-                        pos_side = "long"
-                    else:  # short
-                        side = "buy"  
-                        pos_side = "short"
-            else:
-                # По умолчанию net режим
-                side = "sell" if current_pos > 0 else "buy"
-                pos_side = "net"
-                
-            print(f"Закрываем позицию: side={side}, posSide={pos_side}, размер={abs(current_pos)}")
+            # Определяем сторону для закрытия в зависимости от режима позиций
+            order = close_order_args(pos_mode, current_position)
+            logger.info("Закрываем позицию %s", inst_id, extra={'fields': {
+                'side': order['side'], 'posSide': order['posSide'], 'sz': order['sz']
+            }})
             
             # Закрываем позицию рыночным ордером
-            result = self.trade_api.place_order(
-                instId=inst_id,
-                tdMode="cross",
-                side=side,
-                posSide=pos_side,
-                ordType="market",
-                sz=str(abs(current_pos))
-            )
+            result = self._place_order(order)
             
             if result['code'] == '0':
-                print(f"Позиция успешно закрыта! ID ордера: {result['data'][0]['ordId']}")
+                logger.info("Позиция успешно закрыта! ID ордера: %s", result['data'][0]['ordId'])
                 return {
                     'success': True,
                     'order_id': result['data'][0]['ordId']
                 }
             else:
+                if 'posSide' in str(result):
+                    # Режим позиций мог смениться вне приложения
+                    self.invalidate_account_config()
                 error_msg = result['data'][0]['sMsg'] if result['data'] else result['msg']
-                print(f"Ошибка закрытия позиции: {error_msg}")
+                logger.error("Ошибка закрытия позиции: %s", error_msg)
                 return {
                     'success': False,
                     'error': error_msg
                 }
                 
         except Exception as e:
-            print(f"Ошибка закрытия позиции: {e}")
+            logger.error("Ошибка закрытия позиции: %s", e)
             return {'success': False, 'error': str(e)}
     
+    def _place_order(self, order):
+        """
+        Отправка ордера с clOrdId (генерируется, если не задан). При таймауте, обрыве
+        соединения или ответе без результата (AMBIGUOUS_CODES) ордер ищется по clOrdId
+        и, только если биржа ответила, что его нет (51603), сразу отправляется повторно
+        с тем же clOrdId. Если проверить ордер не удалось, повтора нет - результат неизвестен.
+        """
+        from httpx import TransportError
+        order.setdefault('clOrdId', new_cl_ord_id())
+        retries = self.config.get('order_retries', 2)
+        for attempt in range(retries + 1):
+            try:
+                result = self.trade_api.place_order(**order)
+                s_code = result['data'][0].get('sCode') if result.get('data') else None
+                if result.get('code') not in AMBIGUOUS_CODES and s_code != DUPLICATE_CL_ORD_ID:
+                    return result
+                error = result['data'][0]['sMsg'] if s_code else result.get('msg')
+            except (TransportError, ValueError) as e:  # ValueError - ответ не JSON (страница ошибки шлюза)
+                error = str(e) or type(e).__name__
+            logger.warning("Результат ордера неизвестен (%s), проверка по clOrdId", error, extra={'fields': {
+                'instId': order['instId'], 'clOrdId': order['clOrdId'], 'attempt': attempt + 1
+            }})
+            status, placed = self._find_order(order['instId'], order['clOrdId'])
+            if status == ORDER_FOUND:
+                return {'code': '0', 'msg': '', 'data': [placed]}
+            if status == ORDER_UNKNOWN:
+                break
+        return {'code': '-1', 'msg': f"Результат ордера {order['clOrdId']} неизвестен: {error}", 'data': []}
+    
+    def _find_order(self, inst_id, cl_ord_id):
+        """
+        Поиск ордера по clOrdId: (ORDER_FOUND, ордер в формате ответа place_order),
+        (ORDER_MISSING, None) только по ответу 51603 или (ORDER_UNKNOWN, None).
+        Ошибка самого запроса не означает отсутствие ордера - запрос повторяется.
+        """
+        for attempt in range(self.config.get('order_retries', 2) + 1):
+            try:
+                result = self.trade_api.get_order(instId=inst_id, clOrdId=cl_ord_id)
+                if result.get('code') == '0' and result['data']:
+                    order = result['data'][0]
+                    return ORDER_FOUND, {'ordId': order['ordId'], 'clOrdId': cl_ord_id, 'tag': order.get('tag', ''),
+                                         'sCode': '0', 'sMsg': "Order placed"}
+                if result.get('code') == ORDER_NOT_FOUND:
+                    return ORDER_MISSING, None
+                logger.warning("Ошибка проверки ордера %s: %s", cl_ord_id, result.get('msg'))
+            except Exception as e:
+                logger.warning("Ошибка проверки ордера %s: %s", cl_ord_id, e)
+        return ORDER_UNKNOWN, None
+    
+    def _send_batch_orders(self, orders):
+        """
+        Отправка ордеров через /trade/batch-orders пачками по 20 (пачки - параллельно).
+        Возвращает ответы по каждому ордеру в том же порядке: ordId, sCode, sMsg.
+        Если результат пачки неизвестен, ордера проверяются по clOrdId и повторно
+        отправляются только точно отсутствующие на бирже (как в _place_order).
+        """
+        from httpx import TransportError
+        retries = self.config.get('order_retries', 2)
+
+        def send(chunk):
+            replies = [None] * len(chunk)
+            pending = list(range(len(chunk)))
+            for attempt in range(retries + 1):
+                try:
+                    result = self.trade_api.place_multiple_orders([chunk[i] for i in pending])
+                    if result.get('data') and len(result['data']) == len(pending):
+                        for i, reply in zip(pending, result['data']):
+                            replies[i] = reply
+                    elif result.get('code') not in AMBIGUOUS_CODES:
+                        error = {'ordId': '', 'sCode': result.get('code', '-1'), 'sMsg': result.get('msg', '')}
+                        for i in pending:
+                            replies[i] = dict(error)
+                    error = result.get('msg', '')
+                except (TransportError, ValueError) as e:
+                    error = str(e) or type(e).__name__
+                except Exception as e:
+                    for i in pending:
+                        replies[i] = {'ordId': '', 'sCode': '-1', 'sMsg': str(e)}
+                    break
+                # Повторно проверяются ордера без ответа и с дублирующимся clOrdId
+                unknown = [i for i in pending
+                           if replies[i] is None or replies[i].get('sCode') == DUPLICATE_CL_ORD_ID]
+                if not unknown:
+                    break
+                logger.warning("Результат %d ордеров пачки неизвестен (%s), проверка по clOrdId",
+                               len(unknown), error)
+                pending = []
+                for i in unknown:
+                    status, placed = self._find_order(chunk[i]['instId'], chunk[i]['clOrdId'])
+                    replies[i] = placed
+                    if status == ORDER_MISSING:
+                        pending.append(i)
+                if not pending:
+                    break
+            return [reply or {'ordId': '', 'clOrdId': order['clOrdId'], 'sCode': '-1',
+                              'sMsg': f"Результат ордера неизвестен: {error}"}
+                    for order, reply in zip(chunk, replies)]
+
+        chunks = [orders[i:i + BATCH_ORDERS_LIMIT] for i in range(0, len(orders), BATCH_ORDERS_LIMIT)]
+        if len(chunks) == 1:
+            replies = send(chunks[0])
+        else:
+            with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+                replies = [reply for chunk_replies in pool.map(send, chunks) for reply in chunk_replies]
+
+        if any('posSide' in reply.get('sMsg', '') for reply in replies):
+            # Режим позиций мог смениться вне приложения
+            self.invalidate_account_config()
+        return replies
+    
+    @timed("close_all_positions")
     def close_all_positions(self):
-        """Закрытие всех открытых позиций"""
+        """Закрытие всех открытых позиций: один снимок позиций и пачка ордеров через batch-orders"""
         try:
             positions = self.get_positions()
             if not positions:
                 return {'success': True, 'message': 'Нет открытых позиций'}
             
+            pos_mode = self.get_position_mode()
+            orders = [close_order_args(pos_mode, position) for position in positions]
+            replies = self._send_batch_orders(orders)
+            
             results = []
-            for position in positions:
-                inst_id = position['instId']
-                result = self.close_position(inst_id, None)
+            for order, reply in zip(orders, replies):
+                success = reply.get('sCode') == '0'
                 results.append({
-                    'instId': inst_id,
-                    'success': result['success'],
-                    'error': result.get('error', '')
+                    'instId': order['instId'],
+                    'success': success,
+                    'error': '' if success else reply.get('sMsg', '')
                 })
                 
             # Проверяем результаты
@@ -361,11 +1103,52 @@ class OKXTrader:
             }
             
         except Exception as e:
-            print(f"Ошибка закрытия всех позиций: {e}")
+            logger.error("Ошибка закрытия всех позиций: %s", e)
             return {'success': False, 'error': str(e)}
 
 
 # Вспомогательные функции
+def open_pos_side(pos_mode, side):
+    """posSide для открывающего ордера в зависимости от режима позиций"""
+    if pos_mode == 'long_short_mode':
+        return "long" if side == "buy" else "short"
+    # net_mode или режим неизвестен - по умолчанию net
+    return "net"
+
+def close_order_params(pos_mode, position):
+    """Сторона и posSide ордера, закрывающего позицию"""
+    if pos_mode == 'long_short_mode':
+        # В long/short режиме закрываем противоположной стороной, но тем же posSide
+        return ("sell", "long") if position['posSide'] == "long" else ("buy", "short")
+    # В net режиме - противоположная сторона
+    return ("sell" if float(position['pos']) > 0 else "buy"), "net"
+
+def close_order_args(pos_mode, position):
+    """Параметры рыночного ордера, полностью закрывающего позицию"""
+    side, pos_side = close_order_params(pos_mode, position)
+    return {
+        'instId': position['instId'],
+        'tdMode': position.get('mgnMode') or "cross",
+        'side': side,
+        'posSide': pos_side,
+        'ordType': "market",
+        'sz': str(abs(float(position['pos']))),
+        'clOrdId': new_cl_ord_id()
+    }
+
+def new_cl_ord_id():
+    """Уникальный clOrdId ордера (до 32 латинских букв и цифр)"""
+    return uuid.uuid4().hex
+
+def contracts_for_margin(usd_amount, leverage, current_price, lot_sz):
+    """
+    Количество контрактов для заданной маржи
+    Полная стоимость позиции = маржа * плечо, количество = стоимость / цена,
+    округление до минимального размера лота
+    """
+    contracts = usd_amount * leverage / current_price
+    return max(lot_sz, round(contracts / lot_sz) * lot_sz)
+
 def format_currency(amount):
     """Форматирование валютных сумм"""
     try:
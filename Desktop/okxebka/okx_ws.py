@@ -0,0 +1,261 @@
+import asyncio
+import base64
+import hmac
+import json
+import threading
+import time
+
+import websockets
+
+from okx_log import logger
+from position_book import PositionBook
+
+
+PUBLIC_WS_URL = "wss://ws.okx.com:8443/ws/v5/public"
+PRIVATE_WS_URL = "wss://ws.okx.com:8443/ws/v5/private"
+
+
+class OKXWebSocket:
+    """Базовое WebSocket-соединение OKX: фоновый поток, ping и переподключение"""
+
+    def __init__(self, url, ping_interval=25.0, max_reconnect_delay=10.0):
+        self.url = url
+        self.ping_interval = ping_interval  # OKX закрывает соединение без трафика через 30 секунд
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.connected = threading.Event()
+        self.reconnects = 0
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._ws = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Запуск фонового потока с собственным event loop"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._thread_main, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        """Остановка фида и закрытие соединения"""
+        self._running = False
+        loop = self._loop
+        if loop and self._ws is not None:
+            asyncio.run_coroutine_threadsafe(self._ws.close(), loop)
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        self.connected.clear()
+
+    async def _send(self, message):
+        try:
+            if self._ws is not None:
+                await self._ws.send(message)
+        except Exception as e:
+            logger.error("Ошибка отправки в WebSocket: %s", e)
+
+    def _send_threadsafe(self, message):
+        loop = self._loop
+        if loop is None or not self.connected.is_set():
+            return
+        asyncio.run_coroutine_threadsafe(self._send(message), loop)
+
+    def _thread_main(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._run())
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    async def _run(self):
+        delay = 0.5
+        while self._running:
+            try:
+                async with websockets.connect(self.url, ping_interval=None) as ws:
+                    self._ws = ws
+                    delay = 0.5
+                    # Сначала помечаем соединение активным, затем переподписываемся:
+                    # подписки, добавленные в этот момент, не потеряются
+                    self.connected.set()
+                    await self._on_connect(ws)
+                    await self._read_loop(ws)
+            except Exception as e:
+                if self._running:
+                    logger.error("WebSocket %s отключен: %s", self.url, e)
+            finally:
+                self._ws = None
+                self.connected.clear()
+
+            if self._running:
+                self.reconnects += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _read_loop(self, ws):
+        while self._running:
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=self.ping_interval)
+            except asyncio.TimeoutError:
+                await ws.send("ping")
+                continue
+            if raw == "pong":
+                continue
+            self._handle_message(json.loads(raw))
+
+    async def _on_connect(self, ws):
+        """Действия после (пере)подключения - подписка на каналы"""
+
+    def _handle_message(self, message):
+        """Обработка входящего сообщения"""
+
+
+class OKXPublicFeed(OKXWebSocket):
+    """Публичный WebSocket OKX: последние цены (tickers / mark-price) в памяти"""
+
+    CHANNELS = ("tickers", "mark-price")
+
+    def __init__(self, url=PUBLIC_WS_URL, stale_after=5.0, on_mark_price=None, **kwargs):
+        super().__init__(url, **kwargs)
+        self.stale_after = stale_after  # Через сколько секунд цена считается устаревшей
+        self.on_mark_price = on_mark_price  # on_mark_price(instId, markPx) на каждый тик mark-price
+
+        # instId -> {'last': float, 'markPx': float, 'last_ts': monotonic, 'mark_ts': monotonic}
+        self.prices = {}
+        self.subscriptions = set()
+
+    def subscribe(self, inst_ids):
+        """Подписка на цены инструментов (повторная подписка игнорируется)"""
+        with self._lock:
+            new_ids = [inst_id for inst_id in inst_ids if inst_id not in self.subscriptions]
+            self.subscriptions.update(new_ids)
+        if new_ids:
+            self._send_op("subscribe", new_ids)
+
+    def unsubscribe(self, inst_ids):
+        """Отписка от цен инструментов"""
+        with self._lock:
+            old_ids = [inst_id for inst_id in inst_ids if inst_id in self.subscriptions]
+            self.subscriptions.difference_update(old_ids)
+        if old_ids:
+            self._send_op("unsubscribe", old_ids)
+
+    def get_price(self, inst_id):
+        """Последняя цена сделки или None, если она устарела"""
+        return self._get_fresh(inst_id, 'last', 'last_ts')
+
+    def get_mark_price(self, inst_id):
+        """Последняя маркировочная цена или None, если она устарела"""
+        return self._get_fresh(inst_id, 'markPx', 'mark_ts')
+
+    def update_price(self, inst_id, last=None, mark_px=None):
+        """Запись цены в таблицу (из WebSocket или из REST-запроса)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self.prices.setdefault(inst_id, {})
+            if last is not None:
+                entry['last'] = last
+                entry['last_ts'] = now
+            if mark_px is not None:
+                entry['markPx'] = mark_px
+                entry['mark_ts'] = now
+        if mark_px is not None and self.on_mark_price is not None:
+            self.on_mark_price(inst_id, mark_px)
+
+    def _get_fresh(self, inst_id, field, ts_field):
+        entry = self.prices.get(inst_id)
+        if not entry or field not in entry:
+            return None
+        if time.monotonic() - entry[ts_field] > self.stale_after:
+            return None
+        return entry[field]
+
+    def _subscribe_args(self, inst_ids):
+        return [{"channel": channel, "instId": inst_id}
+                for inst_id in inst_ids for channel in self.CHANNELS]
+
+    def _send_op(self, op, inst_ids):
+        # Без соединения подписка будет отправлена при (пере)подключении
+        self._send_threadsafe(json.dumps({"op": op, "args": self._subscribe_args(inst_ids)}))
+
+    async def _on_connect(self, ws):
+        with self._lock:
+            inst_ids = list(self.subscriptions)
+        if inst_ids:
+            await ws.send(json.dumps({"op": "subscribe", "args": self._subscribe_args(inst_ids)}))
+
+    def _handle_message(self, message):
+        if 'event' in message:
+            if message['event'] == 'error':
+                logger.error("Ошибка подписки WebSocket: %s", message)
+            return
+
+        channel = message.get('arg', {}).get('channel')
+        for item in message.get('data', []):
+            if channel == 'tickers':
+                self.update_price(item['instId'], last=float(item['last']))
+            elif channel == 'mark-price':
+                self.update_price(item['instId'], mark_px=float(item['markPx']))
+
+
+class OKXPrivateFeed(OKXWebSocket):
+    """Приватный WebSocket OKX: позиции, баланс и ордера в общей книге позиций"""
+
+    def __init__(self, api_key, secret_key, passphrase, book=None, url=PRIVATE_WS_URL, login_timeout=10.0, clock=None,
+                 **kwargs):
+        super().__init__(url, **kwargs)
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.passphrase = passphrase
+        self.login_timeout = login_timeout
+        self.book = book if book is not None else PositionBook()
+        self.clock = clock  # ServerClock: вход по времени сервера
+        self.logged_in = False
+
+    def is_live(self):
+        """Соединение установлено и авторизовано"""
+        return self.logged_in and self.connected.is_set()
+
+    def _login_args(self):
+        timestamp = str(int(self.clock.now() if self.clock is not None else time.time()))
+        message = timestamp + "GET" + "/users/self/verify"
+        mac = hmac.new(self.secret_key.encode(), message.encode(), digestmod='sha256')
+        return [{
+            "apiKey": self.api_key,
+            "passphrase": self.passphrase,
+            "timestamp": timestamp,
+            "sign": base64.b64encode(mac.digest()).decode()
+        }]
+
+    async def _on_connect(self, ws):
+        self.logged_in = False
+        await ws.send(json.dumps({"op": "login", "args": self._login_args()}))
+        reply = json.loads(await asyncio.wait_for(ws.recv(), timeout=self.login_timeout))
+        if reply.get('event') != 'login' or reply.get('code') != '0':
+            raise ConnectionError(f"Ошибка авторизации WebSocket: {reply}")
+        self.logged_in = True
+
+        await ws.send(json.dumps({"op": "subscribe", "args": [
+            {"channel": "positions", "instType": "SWAP"},
+            {"channel": "account"},
+            {"channel": "orders", "instType": "SWAP"}
+        ]}))
+
+    def _handle_message(self, message):
+        if 'event' in message:
+            if message['event'] == 'error':
+                logger.error("Ошибка приватного WebSocket: %s", message)
+            return
+
+        channel = message.get('arg', {}).get('channel')
+        data = message.get('data', [])
+        if channel == 'positions':
+            self.book.apply_update(data)
+        elif channel == 'account' and data:
+            self.book.apply_account(data[0])
+        elif channel == 'orders':
+            for order in data:
+                self.book.apply_order(order)
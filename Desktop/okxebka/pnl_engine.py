@@ -0,0 +1,147 @@
+import threading
+import time
+
+from okx_log import logger
+
+
+class PnLEngine:
+    """
+    Локальный нереализованный PnL открытых позиций по потоку маркировочных цен.
+    Размер, средняя цена, размер контракта и сторона берутся из книги позиций и хранятся
+    по столбцам; на каждый тик mark-price PnL, ROE и общий PnL пересчитываются одним
+    проходом по всем позициям. upl из REST используется только для сверки.
+    """
+
+    def __init__(self, book, contract_value, stale_after=5.0):
+        self.book = book
+        self.contract_value = contract_value  # contract_value(instId) -> ctVal линейного контракта или None
+        self.stale_after = stale_after  # Цена из потока старше этого не заменяет markPx из книги
+
+        # Столбцы по позициям книги (одинаковый порядок)
+        self.keys = []
+        self.positions = []  # Позиции из книги
+        self.rows = {}  # instId -> индексы пересчитываемых позиций
+        self.qty = []  # Количество базового актива со знаком стороны: pos * ctVal
+        self.avg_px = []
+        self.mark_px = []
+        self.weight = []  # |qty| / плечо: начальная маржа = weight * markPx
+        # Позиции без ctVal (инверсные контракты) не пересчитываются: qty = 0, PnL и маржа - из REST
+        self.base_upl = []
+        self.base_imr = []
+        self.base_ratio = []
+
+        self.upl = []
+        self.roe = []
+        self.total = 0.0
+        self.total_ratio = 0.0
+
+        self.marks = {}  # instId -> (маркировочная цена из потока, monotonic)
+        self.ticks = 0
+        self.drift = 0.0  # Расхождение локального PnL с upl из REST при последней сверке
+        self.version = 0
+        self.book_version = -1
+        self._changed = threading.Condition()
+        book.add_listener(self._on_book_change)
+
+    def update_mark(self, inst_id, mark_px):
+        """Тик маркировочной цены (из WebSocket-фида): пересчет PnL всех позиций"""
+        with self._changed:
+            self.marks[inst_id] = (mark_px, time.monotonic())
+            rows = self.rows.get(inst_id)
+            if not rows:
+                return
+            for i in rows:
+                self.mark_px[i] = mark_px
+            self.ticks += 1
+            self._recompute()
+            self._bump()
+
+    def refresh(self):
+        """Перечитывание книги позиций, если она изменилась (приватный WebSocket или сверка через REST)"""
+        version = self.book.version
+        if version == self.book_version:
+            return False
+        positions = self.book.get_positions()
+        ct_values = {inst_id: self.contract_value(inst_id) for inst_id in {pos['instId'] for pos in positions}}
+
+        keys, rows, qty, avg_px, rest_mark, weight = [], {}, [], [], [], []
+        base_upl, base_imr, base_ratio = [], [], []
+        drift = 0.0
+        for i, pos in enumerate(positions):
+            inst_id = pos['instId']
+            keys.append((inst_id, pos['posSide']))
+            ct_val = ct_values[inst_id]
+            size = float(pos['pos'])
+            mark = float(pos['markPx'] or 0)
+            upl = float(pos['upl'] or 0)
+            lever = float(pos['lever'] or 0)
+            avg_px.append(float(pos['avgPx'] or 0))
+            rest_mark.append(mark)
+            if ct_val and lever:
+                rows.setdefault(inst_id, []).append(i)
+                # В режиме long/short размер положительный, сторона - в posSide
+                q = -abs(size) * ct_val if pos['posSide'] == 'short' else size * ct_val
+                qty.append(q)
+                weight.append(abs(q) / lever)
+                base_upl.append(0.0)
+                base_imr.append(0.0)
+                base_ratio.append(0.0)
+                # Сверка: локальный расчет по markPx из того же ответа должен совпасть с upl биржи
+                drift = max(drift, abs(q * (mark - avg_px[-1]) - upl))
+            else:
+                qty.append(0.0)
+                weight.append(0.0)
+                base_upl.append(upl)
+                base_imr.append(float(pos['margin'] or 0))
+                base_ratio.append(float(pos['uplRatio'] or 0))
+
+        with self._changed:
+            now = time.monotonic()
+            mark_px = []
+            for key, mark in zip(keys, rest_mark):
+                streamed = self.marks.get(key[0]) if key[0] in rows else None
+                fresh = streamed is not None and now - streamed[1] <= self.stale_after
+                mark_px.append(streamed[0] if fresh else mark)
+            self.keys, self.positions, self.rows = keys, positions, rows
+            self.qty, self.avg_px, self.mark_px, self.weight = qty, avg_px, mark_px, weight
+            self.base_upl, self.base_imr, self.base_ratio = base_upl, base_imr, base_ratio
+            self.drift = drift
+            self.book_version = version
+            self._recompute()
+            self._bump()
+        if drift > 0.01:
+            logger.debug("Сверка PnL: расхождение с REST %.4f", drift)
+        return True
+
+    def snapshot(self):
+        """Позиции с локальными markPx / upl / uplRatio ((instId, posSide) -> позиция), общий PnL и его доля от маржи"""
+        with self._changed:
+            positions = {
+                key: dict(pos, markPx=mark, upl=upl, uplRatio=roe)
+                for key, pos, mark, upl, roe in zip(self.keys, self.positions, self.mark_px, self.upl, self.roe)
+            }
+            return positions, self.total, self.total_ratio
+
+    def wait_for_change(self, version, timeout=None):
+        """Ожидание тика или изменения книги после указанной версии, возвращает текущую версию"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def _on_book_change(self, version):
+        # Вызывается под блокировкой книги: только будим ожидающих, перечитывание - в refresh
+        with self._changed:
+            self._bump()
+
+    def _recompute(self):
+        upl = [b + q * (m - a) for b, q, m, a in zip(self.base_upl, self.qty, self.mark_px, self.avg_px)]
+        imr = [b + w * m for b, w, m in zip(self.base_imr, self.weight, self.mark_px)]
+        self.upl = upl
+        self.roe = [u / i if i else r for u, i, r in zip(upl, imr, self.base_ratio)]
+        self.total = sum(upl)
+        total_imr = sum(imr)
+        self.total_ratio = self.total / total_imr if total_imr else 0.0
+
+    def _bump(self):
+        self.version += 1
+        self._changed.notify_all()
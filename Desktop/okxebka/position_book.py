@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+
+def normalize_position(pos):
+    """Приведение позиции из REST или WebSocket к единому формату"""
+    return {
+        'instId': pos['instId'],
+        'posSide': pos['posSide'],
+        'pos': pos['pos'],
+        'avgPx': pos['avgPx'],
+        'upl': pos['upl'],
+        'uplRatio': pos['uplRatio'],
+        'notionalUsd': pos['notionalUsd'],
+        'lever': pos['lever'],
+        'mgnMode': pos.get('mgnMode', ''),
+        'margin': pos.get('margin') or pos.get('imr') or '0',
+        'markPx': pos['markPx']
+    }
+
+
+def position_key(pos):
+    """Ключ позиции в книге"""
+    return (pos['instId'], pos['posSide'])
+
+
+def diff_positions(old, new):
+    """
+    Изменения между двумя снимками книги ((instId, posSide) -> позиция):
+    added и changed - списки позиций, removed - список ключей закрытых позиций
+    """
+    added = []
+    changed = []
+    for key, pos in new.items():
+        previous = old.get(key)
+        if previous is None:
+            added.append(pos)
+        elif previous is not pos and previous != pos:
+            changed.append(pos)
+    removed = [key for key in old if key not in new]
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+
+class PositionBook:
+    """Общая книга позиций: обновляется из WebSocket и сверяется через REST"""
+
+    def __init__(self, max_orders=200):
+        self.positions = {}  # (instId, posSide) -> позиция
+        self.account = None  # Последнее состояние из канала account
+        self.orders = OrderedDict()  # ordId -> последнее состояние ордера
+        self.max_orders = max_orders
+        self.version = 0
+        self.listeners = []  # listener(version) после каждого изменения позиций
+        self._lock = threading.Lock()
+
+    def get_positions(self):
+        """Список открытых позиций"""
+        with self._lock:
+            return list(self.positions.values())
+
+    def add_listener(self, listener):
+        """Подписка на изменения позиций (вызывается под блокировкой книги, должна быть быстрой)"""
+        self.listeners.append(listener)
+
+    def apply_snapshot(self, positions):
+        """Полная замена книги (сверка с REST get_positions)"""
+        snapshot = {position_key(pos): pos for pos in positions}
+        with self._lock:
+            if snapshot != self.positions:
+                self.positions = snapshot
+                self._bump()
+
+    def apply_update(self, raw_positions):
+        """Инкрементальное обновление из канала positions (pos == 0 - позиция закрыта)"""
+        with self._lock:
+            changed = False
+            for raw in raw_positions:
+                key = (raw['instId'], raw['posSide'])
+                if not raw.get('pos') or float(raw['pos']) == 0:
+                    changed |= self.positions.pop(key, None) is not None
+                    continue
+                pos = normalize_position(raw)
+                if self.positions.get(key) != pos:
+                    self.positions[key] = pos
+                    changed = True
+            if changed:
+                self._bump()
+
+    def apply_account(self, account):
+        """Обновление баланса из канала account"""
+        with self._lock:
+            self.account = account
+
+    def apply_order(self, order):
+        """Обновление состояния ордера из канала orders"""
+        with self._lock:
+            self.orders[order['ordId']] = order
+            self.orders.move_to_end(order['ordId'])
+            while len(self.orders) > self.max_orders:
+                self.orders.popitem(last=False)
+
+    def _bump(self):
+        self.version += 1
+        for listener in self.listeners:
+            listener(self.version)
@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+
+# Лимиты OKX по группам эндпоинтов: (метод, путь) -> (группа, запросов, за секунд).
+# Размещение ордера (POST) и запрос ордера (GET) на /trade/order лимитируются раздельно
+ENDPOINT_LIMITS = {
+    ('POST', '/api/v5/trade/order'): ('trade/order', 60, 2),
+    ('GET', '/api/v5/trade/order'): ('trade/order-details', 60, 2),
+    ('POST', '/api/v5/trade/batch-orders'): ('trade/batch-orders', 300, 2),
+    ('POST', '/api/v5/trade/close-position'): ('trade/close-position', 20, 2),
+    ('POST', '/api/v5/trade/cancel-order'): ('trade/cancel-order', 60, 2),
+    ('POST', '/api/v5/account/set-leverage'): ('account/set-leverage', 20, 2),
+    ('GET', '/api/v5/account/leverage-info'): ('account/leverage-info', 20, 2),
+    ('POST', '/api/v5/account/set-position-mode'): ('account/set-position-mode', 5, 2),
+    ('GET', '/api/v5/account/config'): ('account/config', 5, 2),
+    ('GET', '/api/v5/account/positions'): ('account/positions', 10, 2),
+    ('GET', '/api/v5/account/balance'): ('account/balance', 10, 2),
+    ('GET', '/api/v5/market/ticker'): ('market/ticker', 20, 2),
+    ('GET', '/api/v5/market/tickers'): ('market/tickers', 20, 2),
+    ('GET', '/api/v5/public/instruments'): ('public/instruments', 20, 2),
+    ('GET', '/api/v5/public/time'): ('public/time', 10, 2),
+}
+DEFAULT_LIMIT = (10, 2)
+
+# Запросы, которые обслуживаются в первую очередь: ордера, закрытия и подготовка к ним
+PRIORITY_PREFIXES = ('/api/v5/trade/', '/api/v5/account/set-leverage', '/api/v5/account/set-position-mode')
+
+
+def endpoint_limit(method, request_path, limits=ENDPOINT_LIMITS):
+    """(группа, запросов, за секунд) для запроса; неизвестные эндпоинты - отдельная группа на метод и путь"""
+    path = request_path.split('?', 1)[0]
+    limit = limits.get((method, path))
+    if limit is not None:
+        return limit
+    return (f"{method} {path}",) + DEFAULT_LIMIT
+
+
+class TokenBucket:
+    """Ведро токенов: capacity запросов, пополнение capacity за period секунд"""
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def try_take(self):
+        """Взять токен; возвращает 0 при успехе или сколько секунд ждать до следующего токена"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Клиентский ограничитель запросов к OKX: ведро токенов на группу эндпоинтов.
+    Ордера и закрытия имеют строгий приоритет - фоновые запросы ждут, пока есть
+    ожидающие приоритетные. Одинаковые фоновые GET-запросы, выполняющиеся
+    одновременно, объединяются в один.
+    """
+
+    def __init__(self, limits=None, recorder=None, enabled=True):
+        self.limits = {**ENDPOINT_LIMITS, **(limits or {})}
+        self.enabled = enabled  # False - без ожидания токенов (объединение запросов остается)
+        self.recorder = recorder  # LatencyRecorder для времени ожидания (ratelimit:<группа>)
+        self.buckets = {}
+        self.priority_waiting = 0
+        self.inflight = {}  # (method, path, params) -> Future фонового GET-запроса
+        self._cond = threading.Condition()
+        self._inflight_lock = threading.Lock()
+
+    def group(self, method, request_path):
+        """Группа эндпоинта и его лимит по методу и пути (без query-строки)"""
+        return endpoint_limit(method, request_path, self.limits)
+
+    @staticmethod
+    def is_priority(request_path):
+        return request_path.startswith(PRIORITY_PREFIXES)
+
+    def acquire(self, method, request_path):
+        """Ожидание токена для запроса; фоновые запросы пропускают приоритетные вперед"""
+        if not self.enabled:
+            return
+        group, capacity, period = self.group(method, request_path)
+        priority = self.is_priority(request_path)
+        start = time.perf_counter()
+        with self._cond:
+            bucket = self.buckets.get(group)
+            if bucket is None:
+                bucket = self.buckets[group] = TokenBucket(capacity, period)
+            if priority:
+                self.priority_waiting += 1
+            try:
+                while True:
+                    if not priority and self.priority_waiting:
+                        self._cond.wait(0.05)
+                        continue
+                    wait = bucket.try_take()
+                    if wait == 0:
+                        break
+                    self._cond.wait(wait)
+            finally:
+                if priority:
+                    self.priority_waiting -= 1
+                    self._cond.notify_all()
+        waited = time.perf_counter() - start
+        if self.recorder is not None and waited > 0.001:
+            self.recorder.record(f"ratelimit:{group}", waited)
+
+    def call(self, request, method, request_path, params):
+        """Выполнение запроса с учетом лимита; одинаковые фоновые GET объединяются"""
+        if method != "GET" or self.is_priority(request_path):
+            self.acquire(method, request_path)
+            return request(method, request_path, params)
+
+        key = (method, request_path, json.dumps(params, sort_keys=True))
+        with self._inflight_lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            self.acquire(method, request_path)
+            result = request(method, request_path, params)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self.inflight.pop(key, None)
+
+
+def limit_client(client, limiter):
+    """Пропуск всех REST-запросов клиента python-okx через общий RateLimiter"""
+    request = client._request
+
+    def limited_request(method, request_path, params):
+        return limiter.call(request, method, request_path, params)
+
+    client._request = limited_request
+    return client
@@ -0,0 +1,66 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+
+# Код ошибки OKX: метка времени запроса вне допустимого окна
+TIMESTAMP_EXPIRED = '50102'
+
+
+class ServerClock:
+    """
+    Часы сервера OKX: сглаженное смещение относительно локальных часов и RTT
+    по запросам public/time. Смещение применяется к метке времени подписи.
+    """
+
+    def __init__(self, fetch=None, alpha=0.2, outlier_factor=3.0):
+        self.fetch = fetch  # fetch() -> ответ public/time (python-okx get_system_time)
+        self.alpha = alpha  # Вес нового замера в экспоненциальном сглаживании
+        self.outlier_factor = outlier_factor  # Замеры с RTT выше rtt * factor не сдвигают смещение
+
+        self.offset = 0.0  # Секунды: время сервера - локальное время
+        self.rtt = None  # Сглаженное время запроса public/time, секунды
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def now(self):
+        """Текущее время сервера (unix, секунды)"""
+        return time.time() + self.offset
+
+    def timestamp(self):
+        """Метка времени сервера в формате OKX (ISO 8601, миллисекунды, UTC)"""
+        now = datetime.fromtimestamp(self.now(), timezone.utc)
+        return now.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+    def sample(self, fetch=None):
+        """Запрос времени сервера (fetch или self.fetch) и обновление смещения; возвращает RTT в секундах"""
+        sent_at = time.time()
+        start = time.perf_counter()
+        result = (fetch or self.fetch)()
+        rtt = time.perf_counter() - start
+        if result.get('code') != '0':
+            raise RuntimeError(f"Ошибка получения времени сервера: {result}")
+        server_time = int(result['data'][0]['ts']) / 1000
+        # Ответ сформирован примерно в середине запроса
+        self.update(server_time - (sent_at + rtt / 2), rtt)
+        return rtt
+
+    def update(self, offset, rtt):
+        """Учет замера смещения и RTT"""
+        with self._lock:
+            # Первые замеры могут включать установку соединения - берется самый быстрый
+            if self.samples == 0 or (self.samples < 3 and rtt < self.rtt):
+                self.offset = offset
+                self.rtt = rtt
+            else:
+                # При долгом запросе асимметрия задержки искажает смещение - такой замер пропускается
+                if rtt <= self.rtt * self.outlier_factor:
+                    self.offset += self.alpha * (offset - self.offset)
+                self.rtt += self.alpha * (rtt - self.rtt)
+            self.samples += 1
+
+    def resync(self):
+        """Сброс сглаживания и новый замер (после ошибки метки времени)"""
+        with self._lock:
+            self.samples = 0
+        return self.sample()
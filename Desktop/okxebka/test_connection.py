@@ -30,7 +30,7 @@ def test_connection():
             
         # Тест 1.1: Проверка конфигурации аккаунта
         print("\n⚙️ Тест 1.1: Конфигурация аккаунта")
-        config = trader.get_account_config()
+        config = trader.get_account_config(refresh=True)
         if config:
             print(f"✅ Конфигурация получена")
             print(f"   Уровень аккаунта: {config.get('acctLv', 'N/A')}")
@@ -42,6 +42,7 @@ def test_connection():
             
         # Тест 2: Поиск торговых пар
         print("\n🔍 Тест 2: Поиск торговых пар")
+        trader.instruments.ensure_loaded()  # Поиск не ждет сети - загружаем список заранее
         pairs = trader.search_futures_pair("BTC")
         if pairs:
             print(f"✅ Найдено {len(pairs)} BTC пар")